@@ -1,14 +1,27 @@
 import os
-import re
+import time
+import operator
+import asyncio
 import logging
-from typing import List, Literal
+import threading
+from typing import Annotated, List, Literal
 from typing_extensions import TypedDict
+from pydantic import BaseModel, Field
+import openai
 
 from llama_index.core.base.response.schema import Response
+from llama_index.core.schema import QueryBundle, NodeWithScore
 from llama_index.core.query_engine import BaseQueryEngine
 
 from langgraph.graph import StateGraph, START, END
 
+from metrics import READABILITY_REWRITE_ROUNDS
+from azure_client import priority_config, PRIORITY_HIGH, PRIORITY_LOW
+from tracing import traced_node
+from load_shedding import optional_node, record_skipped, skip_optional
+from readability import (LIX_READABLE_LIMIT, text_lix, hard_sentences, rewrite_prompt, parse_rewrites,
+                         splice)
+
 
 # === Data types ===
 class Reference(TypedDict):
@@ -16,18 +29,34 @@ class Reference(TypedDict):
     url: str
     relevance_index: float
 
+class TitleAndSummary(BaseModel):
+    """Title and summary of the user's question, both in Norwegian and in the 'I' form."""
+    title: str = Field(description="One short sentence in Norwegian that works as a title for the question")
+    summary: str = Field(description="One sentence in Norwegian summarizing the question")
+
 class State(TypedDict):
     llm: any  # LLM client (from server_settings.get_llm())
     query_engine: BaseQueryEngine
     vector_index_description: str
     query: str
+    query_embedding: List[float] | None  # computed once for the response cache, reused by retrieval
     similarity_cutoff: float
+    source_nodes: List[NodeWithScore] | None
     response: Response | None
     validate_response_result: Literal["Accepted", "Rejected"]
     answer: str
     lix_score: float
     lix_category: str
     readable_or_not: Literal["readable", "not readable"]
+    rewrite_rounds: int
+    max_rewrite_rounds: int
+    deadline: float  # time.monotonic() after which the best answer so far is used
+    request_deadline: float  # time.monotonic() by which the answer is due, see load_shedding.py
+    request_seconds: float  # time the request was given until request_deadline
+    skipped_nodes: Annotated[List[str], operator.add]  # optional nodes skipped under load
+    best_answer: str
+    best_lix_score: float
+    rewrites_stopped: bool
     feedback: str
     references: List[Reference]
     query_short_version: str
@@ -50,13 +79,27 @@ def categorize_lix(lix: float) -> str:
 
 # === Node functions ===
 
-def llm_call_answer(state: State) -> dict:
-    response_obj = state["query_engine"].query(state["query"])
+def query_bundle(state: State) -> QueryBundle:
+    return QueryBundle(query_str=state["query"], embedding=state.get("query_embedding"))
+
+async def retrieve_nodes(state: State) -> dict:
+    if state["source_nodes"] is not None:
+        # already retrieved by answer_utils.stream_answer()
+        return {}
+    # retrieval only, the answer is synthesized after validation
+    nodes = await state["query_engine"].aretrieve(query_bundle(state))
+    return {"source_nodes": nodes}
+
+async def llm_call_answer(state: State) -> dict:
+    if state["response"] is not None:
+        # answer already streamed to the client by answer_utils.stream_answer()
+        return {}
+    response_obj = await state["query_engine"].asynthesize(query_bundle(state), state["source_nodes"])
     return {"answer": response_obj.response, "response": response_obj}
 
 def validate_response(state: State) -> dict:
     cutoff = state["similarity_cutoff"]
-    nodes = [n for n in state["response"].source_nodes if n.score is not None]
+    nodes = [n for n in state["source_nodes"] if n.score is not None]
     for n in nodes:
         if n.score >= cutoff:
             return {"validate_response_result": "Accepted"}
@@ -65,50 +108,130 @@ def validate_response(state: State) -> dict:
     feedback = f'Jeg beklager! {vector_index_desc}. Hvis du har spørsmål om disse emnene, kan jeg prøve å hjelpe deg med det. Bare gi meg beskjed om hva du lurer på!'
     return {"validate_response_result": "Rejected", "feedback": feedback}
 
-def llm_call_short_version_generator(state: State) -> dict:
+async def llm_call_short_version_generator(state: State) -> dict:
     llm = state["llm"]
     query = state["query"]
-    msg = llm.invoke(
-        f"Give a title in norwegian to the query, ensuring that the 'I' form is preserved: {query}, use only one short sentence"
+    msg = await llm.ainvoke(
+        f"Give a title in norwegian to the query, ensuring that the 'I' form is preserved: {query}, use only one short sentence",
+        config=priority_config(PRIORITY_LOW),
     )
     return {"query_short_version": msg.content}
 
 
-def llm_call_summary_generator(state: State) -> dict:
+async def llm_call_summary_generator(state: State) -> dict:
     llm = state["llm"]
     query = state["query"]
-    msg = llm.invoke(
-        f"Please provide a summary of the user's question in norwegian, ensuring that the 'I' form is preserved : {query}, use only one sentence"
+    msg = await llm.ainvoke(
+        f"Please provide a summary of the user's question in norwegian, ensuring that the 'I' form is preserved : {query}, use only one sentence",
+        config=priority_config(PRIORITY_LOW),
     )
     return {"query_summary": msg.content}
 
+@optional_node(lambda state: {"query_short_version": "", "query_summary": ""})
+async def llm_call_title_and_summary(state: State) -> dict:
+    llm = state["llm"]
+    query = state["query"]
+    try:
+        # one round-trip for both fields instead of one per field; function calling, because the
+        # default json_schema method needs an API version and deployment with structured outputs
+        msg = await llm.with_structured_output(TitleAndSummary, method="function_calling").ainvoke(
+            f"Give a title and a summary in norwegian of the user's question, ensuring that the 'I' form is preserved: {query}. "
+            "The title is one short sentence, the summary is one sentence.",
+            config=priority_config(PRIORITY_LOW),
+        )
+        if msg is None or not msg.title.strip() or not msg.summary.strip():
+            raise ValueError("empty structured output")
+        return {"query_short_version": msg.title, "query_summary": msg.summary}
+    except (ValueError, NotImplementedError, openai.BadRequestError) as e:
+        # output parser and pydantic validation errors, a model without structured output support,
+        # or a deployment rejecting the tool schema
+        logging.warning(f"Structured title/summary failed ({e}), falling back to two calls")
+        title, summary = await asyncio.gather(
+            llm_call_short_version_generator(state),
+            llm_call_summary_generator(state),
+        )
+        return {**title, **summary}
+
 def calculate_readability_index(state: State) -> None:
-    text = state["answer"]
-    words = text.split()
-    num_words = len(words) or 1
-    num_sentences = max(len(re.split(r'[.!?]', text)) - 1, 1)
-    num_long = sum(1 for w in words if len(re.sub(r'[^a-zA-Z]', '', w)) > 6)
-    lix = (num_words / num_sentences) + (num_long / num_words) * 100
+    lix = text_lix(state["answer"])
     state["lix_score"] = lix
     state["lix_category"] = categorize_lix(lix)
 
 
+def rewrite_rounds_used(state: State) -> bool:
+    return state["rewrite_rounds"] >= state["max_rewrite_rounds"]
+
+
+def skip_rewrite(state: State) -> bool:
+    """
+    Out of time or under load the answer is kept as it is; the rewrite is listed as skipped,
+    so the degraded answer is not cached.
+    """
+    if time.monotonic() >= state["deadline"]:
+        record_skipped("llm_make_answer_more_readable")
+        return True
+    return skip_optional("llm_make_answer_more_readable", state)
+
+
 def readability_evaluator(state: State) -> dict:
     calculate_readability_index(state)
-    if state["lix_score"] > 50:
+    update = {}
+    # keep the most readable version seen so far, rewrites do not always improve the text
+    if not state["best_answer"] or state["lix_score"] < state["best_lix_score"]:
+        update = {"best_answer": state["answer"], "best_lix_score": state["lix_score"]}
+
+    if state["lix_score"] <= LIX_READABLE_LIMIT:
+        READABILITY_REWRITE_ROUNDS.observe(state["rewrite_rounds"])
+        return {**update, "readable_or_not": "readable", "feedback": "No need for improvements"}
+
+    exhausted = rewrite_rounds_used(state)
+    skipped = not exhausted and skip_rewrite(state)
+    if exhausted or skipped:
+        best_answer = update.get("best_answer", state["best_answer"])
+        best_lix = update.get("best_lix_score", state["best_lix_score"])
+        logging.info(f"Readability rewrites stopped after {state['rewrite_rounds']} rounds, best LIX {best_lix:.1f}")
+        READABILITY_REWRITE_ROUNDS.observe(state["rewrite_rounds"])
         return {
+            "answer": best_answer,
+            "lix_score": best_lix,
+            "lix_category": categorize_lix(best_lix),
             "readable_or_not": "not readable",
-            "feedback": "Make this text more readable by using shorter sentences, fewer words, and simpler language."
+            "rewrites_stopped": True,
+            "feedback": "Rewrite budget exhausted, using the most readable answer so far",
+            "skipped_nodes": ["llm_make_answer_more_readable"] if skipped else [],
         }
-    return {"readable_or_not": "readable", "feedback": "No need for improvements"}
+
+    return {
+        **update,
+        "readable_or_not": "not readable",
+        "feedback": "Make this text more readable by using shorter sentences, fewer words, and simpler language."
+    }
+
+
+def route_readability(state: State) -> str:
+    if state["readable_or_not"] == "readable" or state["rewrites_stopped"]:
+        return "ok"
+    return "revise"
 
 
-def llm_make_answer_more_readable(state: State) -> dict:
+async def llm_make_answer_more_readable(state: State) -> dict:
     llm = state["llm"]
     answer = state["answer"]
     feedback = state["feedback"]
-    msg = llm.invoke(f"Improve readability: {answer}. Feedback: {feedback}")
-    return {"answer": msg.content}
+    # only the hard sentences are rewritten and spliced back, see readability.py
+    sentences = hard_sentences(answer)
+    if sentences:
+        msg = await llm.ainvoke(rewrite_prompt(sentences, feedback), config=priority_config(PRIORITY_HIGH))
+        rewrites = parse_rewrites(msg.content, len(sentences))
+        if rewrites is not None:
+            return {"answer": splice(answer, sentences, rewrites), "rewrite_rounds": state["rewrite_rounds"] + 1}
+        logging.warning(f"Sentence rewrite returned {msg.content!r}, rewriting the whole answer instead")
+
+    msg = await llm.ainvoke(
+        f"Improve readability: {answer}. Feedback: {feedback}",
+        config=priority_config(PRIORITY_HIGH),
+    )
+    return {"answer": msg.content, "rewrite_rounds": state["rewrite_rounds"] + 1}
 
 
 def route_answer(state: State) -> str:
@@ -116,7 +239,7 @@ def route_answer(state: State) -> str:
 
 
 def on_reject_build_structured(state: State) -> dict:
-    print("rejected")
+    logging.info(f"Answer still hard to read after {state['rewrite_rounds']} rewrite rounds, building it as it is")
     # exactly what aggregator does:
     return aggregator(state)
 
@@ -124,10 +247,15 @@ def response_builder_node(state: State) -> dict:
     return {}
 
 
+def readable_answer_ready(state: State) -> dict:
+    # join point for the readability loop, see the barrier edge into aggregator
+    return {}
+
+
 def references_generator(state: State) -> dict:
     cutoff = state["similarity_cutoff"]
     refs: List[Reference] = []
-    for node in state["response"].source_nodes:
+    for node in state["source_nodes"]:
         if node.score is not None and node.score >= cutoff:
             meta = node.metadata
             refs.append({
@@ -146,8 +274,11 @@ def aggregator(state: State) -> dict:
     else:
         combined = f"# Oppsummering av spørsmålet\n\n"
         combined += f"## Spørsmålet fra brukeren\n{state['query']}\n\n"
-        combined += f"## Tittel\n{state['query_short_version']}\n\n"
-        combined += f"## Kort sammendrag av spørsmålet\n{state['query_summary']}\n\n"
+        # title and summary are left out when they were skipped under load
+        if state['query_short_version']:
+            combined += f"## Tittel\n{state['query_short_version']}\n\n"
+        if state['query_summary']:
+            combined += f"## Kort sammendrag av spørsmålet\n{state['query_summary']}\n\n"
         combined += f"## Lettlest svar\n{state['answer']}\n\n"
         if state['references']:
             combined += "## Referanser\n"
@@ -157,63 +288,66 @@ def aggregator(state: State) -> dict:
 
 
 # === Build static, stateless workflow ===
+# every node is timed into the request trace, see tracing.py
 builder = StateGraph(State)
 
-# 1️⃣ Core answer + validation
-builder.add_node("llm_call_answer", llm_call_answer)
-builder.add_node("validate_response", validate_response)
-builder.add_edge(START, "llm_call_answer")
-builder.add_edge("llm_call_answer", "validate_response")
+# 1️⃣ Retrieval + validation, nothing is synthesized for rejected queries
+builder.add_node("retrieve_nodes", traced_node(retrieve_nodes))
+builder.add_node("validate_response", traced_node(validate_response))
+builder.add_edge(START, "retrieve_nodes")
+builder.add_edge("retrieve_nodes", "validate_response")
 
 # 2️⃣ Branch on validation result:
 #    - "Rejected" → aggregator
-#    - "Accepted" → fan-out into 4 nodes
-builder.add_node("aggregator", aggregator)
-builder.add_node("llm_call_short_version_generator", llm_call_short_version_generator)
-builder.add_node("llm_call_summary_generator", llm_call_summary_generator)
-builder.add_node("references_generator", references_generator)
-builder.add_node("readability_evaluator", readability_evaluator)
+#    - "Accepted" → fan-out into answer synthesis, title/summary and references
+builder.add_node("aggregator", traced_node(aggregator))
+builder.add_node("llm_call_answer", traced_node(llm_call_answer))
+builder.add_node("llm_call_title_and_summary", traced_node(llm_call_title_and_summary))
+builder.add_node("references_generator", traced_node(references_generator))
+builder.add_node("readability_evaluator", traced_node(readability_evaluator))
+builder.add_node("readable_answer_ready", traced_node(readable_answer_ready))
 
 builder.add_conditional_edges(
     "validate_response",
-    # router: return exactly the keys below
-    lambda s: "Rejected" if s["validate_response_result"] == "Rejected"
-              else "Accepted",
-    {
-        "Rejected": "aggregator",
-        "Accepted": "llm_call_short_version_generator",
-    }
+    # router: the accepted branch runs its three nodes in parallel
+    lambda s: "aggregator" if s["validate_response_result"] == "Rejected"
+              else ["llm_call_answer", "llm_call_title_and_summary", "references_generator"],
+    ["aggregator", "llm_call_answer", "llm_call_title_and_summary", "references_generator"]
 )
 
-# 3️⃣ Fan-out the Accepted branch into the other 3 nodes
-#    (these edges will only fire when validate_response_result == "Accepted")
-builder.add_edge("validate_response", "llm_call_summary_generator")
-builder.add_edge("validate_response", "references_generator")
-builder.add_edge("validate_response", "readability_evaluator")
-
-builder.add_edge("llm_call_short_version_generator", "aggregator")
-builder.add_edge("llm_call_summary_generator", "aggregator")
-builder.add_edge("references_generator", "aggregator")
-
-# 4️⃣ Readability loop
-builder.add_node("llm_make_answer_more_readable", llm_make_answer_more_readable)
+# 3️⃣ Readability loop on the synthesized answer
+builder.add_edge("llm_call_answer", "readability_evaluator")
+builder.add_node("llm_make_answer_more_readable", traced_node(llm_make_answer_more_readable))
 builder.add_conditional_edges(
     "readability_evaluator",
-    lambda s: "ok" if s["readable_or_not"] == "readable" else "revise",
+    route_readability,
     {
-        "ok":     "aggregator",
+        "ok":     "readable_answer_ready",
         "revise": "llm_make_answer_more_readable",
     }
 )
 builder.add_edge("llm_make_answer_more_readable", "readability_evaluator")
 
+# 4️⃣ aggregator waits for all accepted branches (and runs directly on rejection)
+builder.add_edge(["llm_call_title_and_summary", "references_generator", "readable_answer_ready"], "aggregator")
+
 # 5️⃣ Finally, aggregator → END
 builder.add_edge("aggregator", END)
 
-optimizer_workflow = builder.compile()
+_optimizer_workflow = None
+_compile_lock = threading.Lock()
+
+
+def get_optimizer_workflow():
+    """Compile the workflow once per worker; app.py does it in its warm-up step."""
+    global _optimizer_workflow
+    if _optimizer_workflow is None:
+        with _compile_lock:
+            if _optimizer_workflow is None:
+                _optimizer_workflow = builder.compile()
+                logging.info("optimizer_workflow created...")
+    return _optimizer_workflow
 
 # produce graph.mmd that visualizes the workflow
 #from graph_utils import save_mermaid_diagram
-#save_mermaid_diagram(optimizer_workflow.get_graph())
-
-logging.info("optimizer_workflow created...")
\ No newline at end of file
+#save_mermaid_diagram(get_optimizer_workflow().get_graph())
\ No newline at end of file
@@ -1,19 +1,75 @@
-from agent_workflow_structured_answer import optimizer_workflow, State
-from config import ServerSettings, VectorIndexStore, CustomError
+from agent_workflow_structured_answer import get_optimizer_workflow, State, retrieve_nodes, validate_response
+from config import (ServerSettings, VectorIndexStore, CustomError, IndexObject, MAX_CONCURRENT_CHATS,
+                    MAX_READABILITY_REWRITES, READABILITY_DEADLINE_SECONDS)
 from query_utils import QuerySettings
-from llama_index.core.llms import ChatMessage, MessageRole
-from llama_index.core import ChatPromptTemplate, get_response_synthesizer, VectorStoreIndex
+from query_engine_cache import query_engine_cache
+from multi_index import composite_entry, is_composite, cache_name, index_router
+from response_cache import response_cache
+from request_coalescing import single_flight, normalize_query
+from session_store import Session, session_store, session_from_messages, rewrite_question
+from load_shedding import load_monitor
+from tracing import span, annotate
+from llama_index.core.base.response.schema import Response
+from llama_index.core.query_engine import BaseQueryEngine
+from llama_index.core.schema import QueryBundle
+from contextlib import contextmanager, ExitStack
+from typing import AsyncIterator, Callable
+import asyncio
 import logging
-import IPython
+import time
 
-def get_answer(
+# shared by all requests in this worker, see MAX_CONCURRENT_CHATS
+chat_semaphore = asyncio.Semaphore(MAX_CONCURRENT_CHATS)
+
+
+def get_index_entry(query_settings: QuerySettings, vector_store: VectorIndexStore) -> IndexObject:
+    with lease_index(query_settings, vector_store) as entry:
+        return entry
+
+
+@contextmanager
+def lease_index(query_settings: QuerySettings, vector_store: VectorIndexStore):
+    """
+    Pin the requested index to its current version for the duration of a request.
+    A multi-index request pins each of its indexes and yields one composite entry.
+    """
+    if not query_settings.multi_index:
+        with vector_store.lease(query_settings.vectorIndex) as entry:
+            yield require_index_entry(query_settings.vectorIndex, entry)
+        return
+
+    names = query_settings.indexes or sorted(e.name for e in vector_store.get_all())
+    with ExitStack() as stack:
+        members = [
+            require_index_entry(name, stack.enter_context(vector_store.lease(name)))
+            for name in names
+        ]
+        if not members:
+            raise CustomError("Index not found, ingen indekser er lastet!", 404)
+        yield composite_entry(query_settings.vectorIndex, members)
+
+
+async def get_query_engine(
+    entry: IndexObject,
     query_settings: QuerySettings,
-    server_settings: ServerSettings,
-    vector_store: VectorIndexStore
-) -> str:
-    # 1) Try to load the requested index
-    vec_name = query_settings.vectorIndex
-    entry = vector_store.get(vec_name)
+    query_embedding: list,
+    streaming: bool = False
+) -> BaseQueryEngine:
+    """Reuse the query engine prepared for this index (or these indexes) and these settings."""
+    if not is_composite(entry):
+        return query_engine_cache.get(entry.name, entry.index, query_settings, streaming=streaming,
+                                      version=entry.version)
+
+    members = list(entry.index)
+    if query_settings.indexes is None:
+        # "auto": skip the indexes whose description does not match the question
+        with span("route_indexes"):
+            members = await index_router.select(members, query_embedding)
+    annotate(indexes=[m.name for m in members])
+    return query_engine_cache.get_fused(members, query_settings, streaming)
+
+
+def require_index_entry(vec_name: str, entry: IndexObject | None) -> IndexObject:
     if entry is None:
         # Log with %s formatting
         logging.error("Index not found: %s", vec_name)
@@ -23,84 +79,269 @@ def get_answer(
             404
         )
 
-    index: VectorStoreIndex = entry.index
-    vector_index_description = entry.description
-    logging.info("Found entry: %s", vector_index_description)
-
-    # 2) Build your prompt template
-    text_qa_template = ChatPromptTemplate([
-
-        ChatMessage(
-            role=MessageRole.SYSTEM,
-            content=(
-                "You are 'HelseSvar', a friendly, empathetic, and knowledgeable health advisor from helsenorge.no, specifically designed to help young people in Norway (ages 13-19).\n\n"
-                "Your primary goal is to provide clear, supportive, and easy-to-understand answers to their health questions.\n\n"
-                "**Tone and Style Guidelines:**\n"
-                "1.  **Empathy:** Always respond with understanding and support. Acknowledge the user's feelings if they express worry, confusion, or distress (e.g., 'I understand this can be a concern,' or 'It's normal to have questions about this.'). Be reassuring and non-judgmental.\n"
-                "2.  **Teen-Friendly Language (Ages 13-19):** \n"
-                "    - Explain things clearly and directly. Avoid overly medical jargon or complex terminology. If you must use a technical term, explain it immediately in simple words.\n"
-                "    - Use short sentences and paragraphs. Break down complex information.\n"
-                "    - Maintain a friendly, approachable, and encouraging tone. Imagine you're talking to a smart but not yet expert high school student.\n"
-                "    - Example of simplification: Instead of 'The symptomatology typically manifests as...', say 'Usually, you might notice symptoms like...'.\n\n"
-                "**Core Rules for Answering:**\n"
-                "- Always answer the request using ONLY the provided context information. Do not use any prior knowledge.\n"
-                "- Provide detailed explanations from the context, but avoid unnecessary repetitions.\n"
-                "- Always answer in Norwegian (Bokmål).\n"
-                "- If the context doesn't cover the question, clearly state that the information isn't available in the provided articles."
-            )
-        ),
-
-        ChatMessage(
-            role=MessageRole.USER,
-            content=(
-                "Context information is below.\n"
-                "---------------------\n"
-                "{context_str}\n"
-                "---------------------\n"
-                "Query: {query_str}\n"
-                "Answer: "
-            )
-        ),
-    ])
-
-    # 3) Create the response synthesizer
-    response_synthesizer = get_response_synthesizer(
-        response_mode=query_settings.response_mode,
-        text_qa_template=text_qa_template,
-        summary_template=text_qa_template,
-        structured_answer_filtering=True,
-        verbose=True,
-    )
-
-    # 4) Configure the query engine
-    query_engine = index.as_query_engine(
-        similarity_cutoff=query_settings.similarity_cutoff,
-        similarity_top_k=query_settings.similarity_top_k,
-        response_synthesizer=response_synthesizer,
-    )
-
-    # 5) Initialize and run your optimizer workflow
-    init_state: State = {
+    logging.info("Found entry: %s", entry.description)
+    return entry
+
+
+def load_session(query_settings: QuerySettings) -> Session | None:
+    """The stored session of the conversation, or one built from the history sent with the request."""
+    if query_settings.conversation_id:
+        session = session_store.get(query_settings.conversation_id)
+        if session is not None:
+            return session
+    return session_from_messages(query_settings.history)
+
+
+async def make_standalone(query_settings: QuerySettings, server_settings: ServerSettings):
+    """Rewrite a follow-up question into a standalone one; retrieval and the caches use that."""
+    session = load_session(query_settings)
+    if session is None:
+        return
+    with span("rewrite_question"):
+        query_settings.user_content = await rewrite_question(server_settings.llm, session, query_settings.question)
+    annotate(standalone_question=query_settings.user_content)
+    logging.info(f"Follow-up {query_settings.question!r} rewritten to {query_settings.user_content!r}")
+
+
+def remember_turn(query_settings: QuerySettings, server_settings: ServerSettings, structured_answer: str):
+    if query_settings.conversation_id:
+        session_store.record(query_settings.conversation_id, query_settings.question, structured_answer,
+                             server_settings.llm)
+
+
+def init_workflow_state(
+    query_settings: QuerySettings,
+    server_settings: ServerSettings,
+    entry: IndexObject,
+    query_engine: BaseQueryEngine | None,
+    query_embedding: list | None = None
+) -> State:
+    return {
         "llm": server_settings.llm,
         "query_engine": query_engine,
-        "vector_index_description": vector_index_description,
+        "vector_index_description": entry.description,
         "query": query_settings.user_content,
+        "query_embedding": query_embedding,
         "similarity_cutoff": query_settings.similarity_cutoff,
         # defaults:
+        "source_nodes": None,
         "response": None,
         "answer": "",
         "lix_score": 0.0,
         "lix_category": "",
         "readable_or_not": "not readable",
+        "rewrite_rounds": 0,
+        "max_rewrite_rounds": MAX_READABILITY_REWRITES,
+        "deadline": min(time.monotonic() + READABILITY_DEADLINE_SECONDS, query_settings.deadline),
+        "request_deadline": query_settings.deadline,
+        "request_seconds": query_settings.deadline_seconds,
+        "skipped_nodes": [],
+        "best_answer": "",
+        "best_lix_score": 0.0,
+        "rewrites_stopped": False,
         "feedback": "",
         "references": [],
         "structured_answer": "",
     }
 
-    final_state = optimizer_workflow.invoke(init_state)
-    
-    from IPython.display import Markdown
-    Markdown(final_state["structured_answer"])
 
-    # 6) Return the raw string
+async def get_answer(
+    query_settings: QuerySettings,
+    server_settings: ServerSettings,
+    vector_store: VectorIndexStore
+) -> str:
+    # 0) A follow-up in a conversation is answered as a standalone question
+    await make_standalone(query_settings, server_settings)
+
+    # 1) Try to load the requested index, pinned to its current version for the whole request
+    with lease_index(query_settings, vector_store) as entry:
+        # identical questions in flight at the same time share one execution
+        key = (
+            entry.name,
+            entry.version,
+            response_cache.settings_key(query_settings),
+            normalize_query(query_settings.user_content),
+        )
+        answer = await single_flight.do(key, lambda: _get_answer(query_settings, server_settings, entry))
+    remember_turn(query_settings, server_settings, answer)
+    return answer
+
+
+async def _get_answer(
+    query_settings: QuerySettings,
+    server_settings: ServerSettings,
+    entry: IndexObject
+) -> str:
+    # 2) Answer from the semantic cache when a close enough question was answered before
+    with span("embed_query"):
+        query_embedding = await response_cache.embed(query_settings.user_content)
+    with span("response_cache_lookup"):
+        cached = response_cache.lookup(cache_name(entry), query_settings, query_embedding)
+    annotate(cache_hit=cached is not None)
+    if cached is not None:
+        logging.info("Response cache hit for index %s", entry.name)
+        return cached.structured_answer
+
+    # 3) Reuse the query engine prepared for this index and these settings
+    query_engine = await get_query_engine(entry, query_settings, query_embedding)
+
+    # 4) Initialize and run your optimizer workflow
+    init_state = init_workflow_state(query_settings, server_settings, entry, query_engine, query_embedding)
+
+    # the nodes await their LLM calls, so other requests keep running meanwhile;
+    # a request still waiting for a slot at its deadline is shed with 503
+    async with load_monitor.slot(chat_semaphore, query_settings.deadline):
+        final_state = await get_optimizer_workflow().ainvoke(init_state)
+
+    # a degraded answer is not served again once the load is gone
+    if not final_state["skipped_nodes"]:
+        response_cache.store(cache_name(entry), query_settings, query_embedding,
+                             final_state["structured_answer"], final_state["references"])
+
+    # 5) Return the raw string
     return final_state["structured_answer"]
+
+
+def stream_answer(
+    query_settings: QuerySettings,
+    server_settings: ServerSettings,
+    vector_store: VectorIndexStore
+) -> AsyncIterator[tuple[str, object]]:
+    """
+    Same workflow as get_answer(), but yields (event, data) pairs as soon as they are known:
+    one "token" per synthesized token, then "title", "summary", "references" and the
+    final "answer" (readable answer + structured answer) once the workflow has finished.
+    The index is checked here so a missing index raises before the stream starts.
+    """
+    get_index_entry(query_settings, vector_store)
+    return _stream_workflow(query_settings, server_settings, vector_store)
+
+
+async def _iterate_tokens(streaming_response) -> AsyncIterator[str]:
+    if hasattr(streaming_response, "async_response_gen"):
+        async for token in streaming_response.async_response_gen():
+            yield token
+        return
+
+    # older llama-index versions hand back a sync generator, pull it off the event loop
+    gen = streaming_response.response_gen
+    while True:
+        token = await asyncio.to_thread(next, gen, None)
+        if token is None:
+            return
+        yield token
+
+
+async def _stream_workflow(
+    query_settings: QuerySettings,
+    server_settings: ServerSettings,
+    vector_store: VectorIndexStore
+) -> AsyncIterator[tuple[str, object]]:
+    await make_standalone(query_settings, server_settings)
+    structured_answer = None
+    # pinned to the current version of the index until the stream ends
+    with lease_index(query_settings, vector_store) as entry:
+        # the query engine is prepared once the question is embedded and not answered from the cache
+        state = init_workflow_state(query_settings, server_settings, entry, None)
+        async for event, data in _stream_events(state, entry, query_settings):
+            if event == "answer":
+                structured_answer = data["structured_answer"]
+            yield event, data
+    if structured_answer is not None:
+        remember_turn(query_settings, server_settings, structured_answer)
+
+
+async def _run_streamed_workflow(
+    state: State,
+    query_settings: QuerySettings,
+    emit: Callable[[tuple[str, object]], None]
+) -> State | None:
+    """
+    Retrieval, streamed synthesis and the rest of the workflow in a workflow slot; the tokens are
+    handed to `emit` as they come. None when the retrieval was rejected.
+    """
+    async with load_monitor.slot(chat_semaphore, query_settings.deadline):
+        # 1) Retrieve and validate before anything is synthesized
+        with span("retrieve_nodes"):
+            state.update(await retrieve_nodes(state))
+        state.update(validate_response(state))
+        if state["validate_response_result"] == "Rejected":
+            emit(("answer", {
+                "validate_response_result": "Rejected",
+                "answer": state["feedback"],
+                "structured_answer": state["feedback"],
+            }))
+            return None
+
+        # 2) Stream the synthesized answer
+        query_bundle = QueryBundle(query_str=state["query"], embedding=state["query_embedding"])
+        tokens = []
+        with span("llm_call_answer"):
+            streaming_response = await state["query_engine"].asynthesize(query_bundle, state["source_nodes"])
+            async for token in _iterate_tokens(streaming_response):
+                tokens.append(token)
+                emit(("token", {"text": token}))
+
+        answer = "".join(tokens)
+        state["answer"] = answer
+        state["response"] = Response(
+            response=answer,
+            source_nodes=streaming_response.source_nodes,
+            metadata=streaming_response.metadata,
+        )
+
+        # 3) Run the rest of the workflow on the streamed answer
+        return await get_optimizer_workflow().ainvoke(state)
+
+
+async def _stream_events(
+    state: State,
+    entry: IndexObject,
+    query_settings: QuerySettings
+) -> AsyncIterator[tuple[str, object]]:
+    with span("embed_query"):
+        query_embedding = await response_cache.embed(state["query"])
+    with span("response_cache_lookup"):
+        cached = response_cache.lookup(cache_name(entry), query_settings, query_embedding)
+    annotate(cache_hit=cached is not None)
+    if cached is not None:
+        logging.info("Response cache hit for index %s", entry.name)
+        yield "references", cached.references
+        yield "answer", {"structured_answer": cached.structured_answer, "cached": True}
+        return
+
+    state["query_embedding"] = query_embedding
+    state["query_engine"] = await get_query_engine(entry, query_settings, query_embedding, streaming=True)
+
+    # the workflow runs in its own task and queues its events without waiting for the client, so
+    # its slot is released when the workflow is done, not when a slow client has read the stream
+    events = asyncio.Queue()
+    workflow = asyncio.create_task(_run_streamed_workflow(state, query_settings, events.put_nowait))
+    workflow.add_done_callback(lambda _: events.put_nowait(None))
+    try:
+        while (event := await events.get()) is not None:
+            yield event
+        final_state = workflow.result()
+    finally:
+        # a client that went away stops the workflow
+        workflow.cancel()
+    if final_state is None:
+        return
+
+    if not final_state["skipped_nodes"]:
+        response_cache.store(cache_name(entry), query_settings, query_embedding,
+                             final_state["structured_answer"], final_state["references"])
+
+    # 4) Emit the sections produced for the aggregator
+    if final_state["validate_response_result"] == "Accepted":
+        # empty when they were skipped under load
+        if final_state["query_short_version"]:
+            yield "title", {"text": final_state["query_short_version"]}
+        if final_state["query_summary"]:
+            yield "summary", {"text": final_state["query_summary"]}
+        yield "references", final_state["references"]
+    yield "answer", {
+        "validate_response_result": final_state["validate_response_result"],
+        "answer": final_state["answer"] if final_state["validate_response_result"] == "Accepted" else final_state["feedback"],
+        "structured_answer": final_state["structured_answer"],
+    }
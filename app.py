@@ -4,9 +4,11 @@ from quart import Quart
 from quart_cors import cors
 
 
-from config import async_read_indexes, init_env_and_logging, server_settings
-from agent_workflow_structured_answer import builder #initialize a static workflow
+import os
+import time
+from config import async_read_indexes, init_env_and_logging, server_settings, watch_index_storage
 from routes import register_routes
+from job_queue import job_manager
 
 app = Quart(__name__)
 app = cors(app, allow_origin="*")  # Allow CORS from all origins
@@ -17,11 +19,41 @@ init_env_and_logging()
 register_routes(app)
 
 
+def warm_up():
+    """Import the request path, build the LLM client and compile the workflow, once per worker."""
+    start = time.time()
+    from agent_workflow_structured_answer import get_optimizer_workflow
+    import answer_utils  # noqa: F401  (LlamaIndex, query engine and response caches)
+    get_optimizer_workflow()
+    server_settings.llm  # built on first access
+    logging.info(f"Warm-up done in {time.time() - start:.2f}s")
+
+
+async def warm_up_and_read_indexes():
+    # one after the other: the index loader needs the same LlamaIndex imports the warm-up does
+    await asyncio.to_thread(warm_up)
+    await async_read_indexes()
+
+
 @app.before_serving
 async def _spawn_loader_after_bind():
-    # read indexes in a separate thread
-    asyncio.create_task(async_read_indexes())
-    logging.info("Scheduled index‐loader via create_task; server is live.")
+    # warm up and read indexes in separate threads, /status answers meanwhile
+    asyncio.create_task(warm_up_and_read_indexes())
+    logging.info("Scheduled warm-up and index‐loader via create_task; server is live.")
+
+    # optional hot reload when the index files change, 0 disables it
+    watch_interval = float(os.getenv('INDEX_WATCH_INTERVAL_SECONDS', '0'))
+    if watch_interval > 0:
+        asyncio.create_task(watch_index_storage(watch_interval))
+        logging.info(f"Watching index storage every {watch_interval}s")
+
+    # workers of the /chat/jobs queue
+    job_manager.start()
+
+
+@app.after_serving
+async def _stop_job_workers():
+    await job_manager.stop()
     
 
 if __name__ == '__main__':
@@ -0,0 +1,444 @@
+# azure_client.py
+#
+# Shared Azure OpenAI chat client:
+# - one pooled HTTP connection pool per process for sync and async calls,
+# - a tokens-per-minute / requests-per-minute budget shared by all requests of the worker,
+# - calls scheduled by priority when the budget is exhausted (main answer before title/summary),
+# - retries with jittered exponential backoff that honor Retry-After,
+# - a llama_index LLM over the same client, so with SYNTHESIS_LLM=azure the answer synthesis is
+#   scheduled and retried too,
+# - sync calls from worker threads are run on the event loop the limiter serves.
+
+import os
+import time
+import heapq
+import random
+import asyncio
+import logging
+import itertools
+from typing import Any, Sequence
+
+import httpx
+import openai
+from langchain_openai import AzureChatOpenAI
+from llama_index.core.base.llms.generic_utils import (achat_to_completion_decorator,
+                                                      astream_chat_to_completion_decorator,
+                                                      chat_to_completion_decorator,
+                                                      stream_chat_to_completion_decorator)
+from llama_index.core.base.llms.types import ChatMessage, ChatResponse, LLMMetadata, MessageRole
+from llama_index.core.llms.callbacks import llm_chat_callback, llm_completion_callback
+from llama_index.core.llms.custom import CustomLLM
+
+from metrics import AZURE_RETRIES, AZURE_QUEUE_WAIT_SECONDS
+from tracing import record_retry, token_usage_callback
+
+# lower value = scheduled first
+PRIORITY_HIGH = 0     # answer path (answer synthesis, readability rewrites, query rewriting)
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 10     # decoration (title, summary)
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+class AzureRateLimited(Exception):
+    """Raised when Azure keeps answering 429 after all retries; surfaced as 503 by the routes."""
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.code = 503
+        self.retry_after = retry_after
+
+
+def priority_config(priority: int) -> dict:
+    """LangChain run config carrying the scheduling priority of a call; ignored by plain models."""
+    return {"metadata": {"priority": priority}}
+
+
+def with_usage_callback(config: dict | None) -> dict:
+    """Copy of the run config that reports token usage to the request trace."""
+    config = dict(config or {})
+    config["callbacks"] = [*(config.get("callbacks") or []), token_usage_callback]
+    return config
+
+
+def retry_after_seconds(error: Exception) -> float | None:
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+def estimate_tokens(value) -> int:
+    # about four characters per token for Norwegian and English text
+    return max(1, len(str(value)) // 4)
+
+
+class RateLimiter:
+    """
+    Token and request budget per minute, refilled continuously, plus a concurrency cap.
+    Waiters are served strictly by (priority, arrival), so a low-priority call never
+    takes budget a waiting high-priority call needs. 0 disables a limit.
+    """
+    def __init__(self, tokens_per_minute: int = 0, requests_per_minute: int = 0, max_concurrency: int = 0):
+        self.tokens_per_minute = tokens_per_minute
+        self.requests_per_minute = requests_per_minute
+        self.max_concurrency = max_concurrency
+        self.tokens = float(tokens_per_minute)
+        self.requests = float(requests_per_minute)
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self._updated = time.monotonic()
+        self._waiters = []
+        self._seq = itertools.count()
+        self._timer: asyncio.TimerHandle | None = None
+        # the event loop the limiter serves, from its creation or the last acquire; sync callers
+        # in worker threads schedule their calls on it
+        try:
+            self.loop: asyncio.AbstractEventLoop | None = asyncio.get_running_loop()
+        except RuntimeError:
+            self.loop = None
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        if self.tokens_per_minute:
+            self.tokens = min(self.tokens_per_minute, self.tokens + elapsed * self.tokens_per_minute / 60)
+        if self.requests_per_minute:
+            self.requests = min(self.requests_per_minute, self.requests + elapsed * self.requests_per_minute / 60)
+
+    def _wait_time(self, tokens: int) -> float:
+        """Seconds until the budget covers a call of `tokens`, 0 if it does now."""
+        waits = [self.blocked_until - time.monotonic()]
+        if self.tokens_per_minute:
+            needed = min(tokens, self.tokens_per_minute) - self.tokens
+            waits.append(needed * 60 / self.tokens_per_minute)
+        if self.requests_per_minute:
+            waits.append((1 - self.requests) * 60 / self.requests_per_minute)
+        return max(0.0, *waits)
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._refill()
+        while self._waiters:
+            _, _, future, tokens = self._waiters[0]
+            if future.done():
+                # cancelled while waiting
+                heapq.heappop(self._waiters)
+                continue
+            if self.max_concurrency and self.in_flight >= self.max_concurrency:
+                return  # release() dispatches again
+            wait = self._wait_time(tokens)
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+            heapq.heappop(self._waiters)
+            self.tokens -= tokens if self.tokens_per_minute else 0
+            self.requests -= 1 if self.requests_per_minute else 0
+            self.in_flight += 1
+            future.set_result(None)
+
+    async def acquire(self, tokens: int, priority: int = PRIORITY_NORMAL):
+        self.loop = asyncio.get_running_loop()
+        future = self.loop.create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future, tokens))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # granted just before the caller was cancelled, hand the slot back
+                self.release(tokens, 0)
+            raise
+
+    def release(self, estimated_tokens: int, used_tokens: int | None = None):
+        """Give back the slot, and the part of the estimate that was not used."""
+        self.in_flight -= 1
+        if self.tokens_per_minute and used_tokens is not None:
+            self.tokens += estimated_tokens - used_tokens
+        self._dispatch()
+
+    def pause(self, seconds: float):
+        """Stop dispatching for a while, e.g. after a 429 with Retry-After."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def stats(self) -> dict:
+        return {
+            "tokens_available": round(self.tokens),
+            "requests_available": round(self.requests),
+            "in_flight": self.in_flight,
+            "waiting": sum(1 for w in self._waiters if not w[2].done()),
+        }
+
+
+class ScheduledRunnable:
+    """Runs async calls of a LangChain runnable through the shared limiter, with retries."""
+    def __init__(self, runnable, limiter: RateLimiter, max_retries: int = 4,
+                 backoff_base: float = 0.5, backoff_max: float = 20.0, max_output_tokens: int = 600):
+        self.runnable = runnable
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_output_tokens = max_output_tokens
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        # full jitter, but never earlier than the server asked for
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        retry_after = retry_after_seconds(error)
+        return max(delay, retry_after) if retry_after is not None else delay
+
+    def _retry_delay(self, attempt: int, error: Exception, final: bool = False) -> float:
+        """Seconds to wait before retrying after `error`, or raise it when no retry is left."""
+        if final or attempt == self.max_retries:
+            if isinstance(error, openai.RateLimitError):
+                raise AzureRateLimited("Azure OpenAI is rate limiting, try again later",
+                                       retry_after_seconds(error)) from error
+            raise error
+        delay = self._backoff(attempt, error)
+        if isinstance(error, openai.RateLimitError):
+            # the whole deployment is throttled, hold back every waiting call
+            self.limiter.pause(delay)
+        AZURE_RETRIES.inc(error=type(error).__name__)
+        record_retry()
+        logging.warning(f"Azure call failed ({type(error).__name__}), retry {attempt + 1} in {delay:.2f}s")
+        return delay
+
+    async def _acquire(self, estimated: int, priority: int):
+        queued = time.monotonic()
+        await self.limiter.acquire(estimated, priority)
+        AZURE_QUEUE_WAIT_SECONDS.observe(time.monotonic() - queued, priority=priority)
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        config = with_usage_callback(config)
+        priority = (config.get("metadata") or {}).get("priority", PRIORITY_NORMAL)
+        estimated = estimate_tokens(input) + self.max_output_tokens
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(estimated, priority)
+            used = None
+            try:
+                result = await self.runnable.ainvoke(input, config, **kwargs)
+                usage = getattr(result, "usage_metadata", None)
+                used = usage.get("total_tokens") if usage else None
+                return result
+            except RETRYABLE_ERRORS as e:
+                delay = self._retry_delay(attempt, e)
+            finally:
+                self.limiter.release(estimated, used)
+            await asyncio.sleep(delay)
+
+    async def astream(self, input, config=None, **kwargs):
+        """Stream the output chunks; a failed call is retried as long as nothing was streamed yet."""
+        config = with_usage_callback(config)
+        priority = (config.get("metadata") or {}).get("priority", PRIORITY_NORMAL)
+        estimated = estimate_tokens(input) + self.max_output_tokens
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(estimated, priority)
+            used, streamed = None, False
+            try:
+                async for chunk in self.runnable.astream(input, config, **kwargs):
+                    streamed = True
+                    usage = getattr(chunk, "usage_metadata", None)
+                    if usage:
+                        used = (used or 0) + usage.get("total_tokens", 0)
+                    yield chunk
+                return
+            except RETRYABLE_ERRORS as e:
+                delay = self._retry_delay(attempt, e, final=streamed)
+            finally:
+                self.limiter.release(estimated, used)
+            await asyncio.sleep(delay)
+
+    def _sync_loop(self) -> asyncio.AbstractEventLoop | None:
+        """The running event loop the limiter serves, None when no loop does (a script)."""
+        loop = self.limiter.loop
+        if loop is None or loop.is_closed() or not loop.is_running():
+            return None
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            raise RuntimeError("A sync Azure call on the event loop thread would block it, use the async method")
+        return loop
+
+    def _iterate_sync(self, chunks):
+        """
+        Drive an async generator from a sync caller: on the event loop the limiter serves, so the
+        call waits for budget and priority like the async calls, or on a private loop in a script.
+        """
+        loop = self._sync_loop()
+        own_loop = asyncio.new_event_loop() if loop is None else None
+
+        def run(coroutine):
+            if own_loop is not None:
+                return own_loop.run_until_complete(coroutine)
+            return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+        async def next_chunk():
+            try:
+                return False, await chunks.__anext__()
+            except StopAsyncIteration:
+                return True, None
+
+        try:
+            while True:
+                done, chunk = run(next_chunk())
+                if done:
+                    return
+                yield chunk
+        finally:
+            run(chunks.aclose())
+            if own_loop is not None:
+                own_loop.close()
+
+    def invoke(self, input, config=None, **kwargs):
+        async def call():
+            yield await self.ainvoke(input, config, **kwargs)
+        [result] = self._iterate_sync(call())
+        return result
+
+    def stream(self, input, config=None, **kwargs):
+        return self._iterate_sync(self.astream(input, config, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self.runnable, name)
+
+
+class ScheduledChatModel(ScheduledRunnable):
+    """Chat model wrapper; structured-output runnables derived from it share its limiter."""
+    def with_structured_output(self, schema, **kwargs):
+        return ScheduledRunnable(
+            self.runnable.with_structured_output(schema, **kwargs),
+            self.limiter,
+            max_retries=self.max_retries,
+            backoff_base=self.backoff_base,
+            backoff_max=self.backoff_max,
+            max_output_tokens=self.max_output_tokens,
+        )
+
+
+class ScheduledSynthesisLLM(CustomLLM):
+    """
+    llama_index LLM for the response synthesis, calling a ScheduledChatModel: the main answer
+    shares the token budget and the retries of the workflow calls, at PRIORITY_HIGH.
+    """
+    chat_model: Any = None
+    priority: int = PRIORITY_HIGH
+    context_window: int
+    num_output: int
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ScheduledSynthesisLLM"
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(context_window=self.context_window, num_output=self.num_output, is_chat_model=True)
+
+    @staticmethod
+    def _messages(messages: Sequence[ChatMessage]) -> list[tuple[str, str]]:
+        return [(m.role.value, m.content or "") for m in messages]
+
+    @staticmethod
+    def _response(content: str, delta: str | None = None) -> ChatResponse:
+        # token usage is recorded by the chat model callback, not from the llama_index events
+        return ChatResponse(message=ChatMessage(role=MessageRole.ASSISTANT, content=content), delta=delta)
+
+    @llm_chat_callback()
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        msg = self.chat_model.invoke(self._messages(messages), priority_config(self.priority))
+        return self._response(msg.content)
+
+    @llm_chat_callback()
+    async def achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        msg = await self.chat_model.ainvoke(self._messages(messages), config=priority_config(self.priority))
+        return self._response(msg.content)
+
+    @llm_chat_callback()
+    def stream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any):
+        def gen():
+            content = ""
+            for chunk in self.chat_model.stream(self._messages(messages), priority_config(self.priority)):
+                content += chunk.content
+                yield self._response(content, chunk.content)
+        return gen()
+
+    @llm_chat_callback()
+    async def astream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any):
+        async def gen():
+            content = ""
+            async for chunk in self.chat_model.astream(self._messages(messages), config=priority_config(self.priority)):
+                content += chunk.content
+                yield self._response(content, chunk.content)
+        return gen()
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any):
+        return chat_to_completion_decorator(self.chat)(prompt, **kwargs)
+
+    @llm_completion_callback()
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any):
+        return await achat_to_completion_decorator(self.achat)(prompt, **kwargs)
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any):
+        return stream_chat_to_completion_decorator(self.stream_chat)(prompt, **kwargs)
+
+    @llm_completion_callback()
+    async def astream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any):
+        return await astream_chat_to_completion_decorator(self.astream_chat)(prompt, **kwargs)
+
+
+def create_azure_chat_model(**overrides) -> AzureChatOpenAI:
+    """AzureChatOpenAI on pooled keep-alive connections; retries are done by ScheduledRunnable."""
+    max_connections = int(os.getenv('AZURE_HTTP_MAX_CONNECTIONS', '100'))
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+    timeout = httpx.Timeout(120, connect=10)
+    params = dict(
+        model=os.getenv('AZURE_OPENAI_MODEL'),
+        deployment_name=os.getenv('AZURE_OPENAI_DEPLOYMENT_NAME'),
+        azure_deployment=os.getenv('AZURE_OPENAI_DEPLOYMENT_NAME'),
+        api_key=os.getenv('AZURE_OPENAI_API_KEY'),
+        azure_endpoint=os.getenv('AZURE_OPENAI_AZURE_ENDPOINT'),
+        api_version=os.getenv('AZURE_OPENAI_API_VERSJON'),
+        temperature=0.0,
+        timeout=120,
+        max_retries=0,
+        http_client=httpx.Client(limits=limits, timeout=timeout),
+        http_async_client=httpx.AsyncClient(limits=limits, timeout=timeout),
+    )
+    params.update(overrides)
+    return AzureChatOpenAI(**params)
+
+
+def create_scheduled_llm(llm) -> ScheduledChatModel:
+    limiter = RateLimiter(
+        tokens_per_minute=int(os.getenv('AZURE_OPENAI_TOKENS_PER_MINUTE', '0')),
+        requests_per_minute=int(os.getenv('AZURE_OPENAI_REQUESTS_PER_MINUTE', '0')),
+        max_concurrency=int(os.getenv('AZURE_OPENAI_MAX_CONCURRENCY', '0')),
+    )
+    return ScheduledChatModel(llm, limiter, max_retries=int(os.getenv('AZURE_OPENAI_MAX_RETRIES', '4')))
+
+
+def create_synthesis_llm(chat_model: ScheduledChatModel) -> ScheduledSynthesisLLM:
+    """The answer synthesis LLM over the scheduled deployment, sized by its context window and output limit."""
+    return ScheduledSynthesisLLM(
+        chat_model=chat_model,
+        context_window=int(os.getenv('AZURE_OPENAI_CONTEXT_WINDOW', '128000')),
+        num_output=int(os.getenv('AZURE_OPENAI_MAX_OUTPUT_TOKENS', '1024')),
+    )
@@ -0,0 +1,108 @@
+# bench_azure_client.py
+#
+# Bursts of chat calls against the local mock Azure endpoint, with injected latency and 429s,
+# through a plain AzureChatOpenAI versus the pooled, scheduled client of azure_client.py.
+#   python -m benchmarks.bench_azure_client [--calls 60] [--rate-429 0.2] [--tokens-per-minute 10000]
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from hypercorn.asyncio import serve
+from hypercorn.config import Config
+from langchain_openai import AzureChatOpenAI
+
+from azure_client import (PRIORITY_HIGH, PRIORITY_LOW, RateLimiter, ScheduledChatModel,
+                          create_azure_chat_model, priority_config)
+from benchmarks.mock_azure import create_mock_app
+
+PROMPT = "Hva bør jeg spise når jeg er gravid? " * 20
+
+CLIENT_PARAMS = dict(
+    model="gpt-4o",
+    azure_deployment="gpt-4o",
+    api_key="mock",
+    api_version="2024-08-01-preview",
+    temperature=0.0,
+)
+
+
+async def run_burst(llm, calls: int) -> dict:
+    latencies = {PRIORITY_HIGH: [], PRIORITY_LOW: []}
+    failures = 0
+
+    async def one(i):
+        nonlocal failures
+        priority = PRIORITY_HIGH if i % 3 == 0 else PRIORITY_LOW
+        start = time.perf_counter()
+        try:
+            await llm.ainvoke(PROMPT, config=priority_config(priority))
+            latencies[priority].append(time.perf_counter() - start)
+        except Exception:
+            failures += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(calls)))
+    return {"elapsed": time.perf_counter() - start, "failures": failures, "latencies": latencies}
+
+
+def report(name: str, result: dict, throttled: int):
+    print(f"{name:10s} {result['elapsed']:6.2f}s  failed {result['failures']:3d}  429s seen {throttled:3d}")
+    for priority, label in ((PRIORITY_HIGH, "high"), (PRIORITY_LOW, "low")):
+        values = sorted(result["latencies"][priority])
+        if values:
+            p95 = values[int(0.95 * (len(values) - 1))]
+            print(f"    {label:4s} n={len(values):3d}  p50 {statistics.median(values):6.2f}s  p95 {p95:6.2f}s")
+
+
+async def against_fresh_mock(args, make_llm) -> tuple[dict, int]:
+    """Run one burst against its own mock server, so every client starts with a full budget."""
+    app = create_mock_app(args.latency_ms, 50, args.rate_429, args.retry_after, args.tokens_per_minute)
+    config = Config()
+    config.bind = [f"127.0.0.1:{args.port}"]
+    config.loglevel = "WARNING"
+    shutdown = asyncio.Event()
+    server = asyncio.create_task(serve(app, config, shutdown_trigger=shutdown.wait))
+    await asyncio.sleep(0.5)
+    try:
+        result = await run_burst(make_llm(f"http://127.0.0.1:{args.port}"), args.calls)
+        return result, app.config["stats"]["throttled"]
+    finally:
+        shutdown.set()
+        await server
+
+
+async def main_async(args):
+    print(f"{args.calls} calls, 429 rate {args.rate_429}, mock budget {args.tokens_per_minute} tokens/min")
+
+    # the client as config.py built it before: openai's own retries, no shared budget
+    result, throttled = await against_fresh_mock(
+        args, lambda endpoint: AzureChatOpenAI(azure_endpoint=endpoint, max_retries=2, **CLIENT_PARAMS))
+    report("plain", result, throttled)
+
+    def scheduled(endpoint):
+        # keep a margin below the deployment limit for estimation errors
+        limiter = RateLimiter(tokens_per_minute=int(args.tokens_per_minute * 0.9), max_concurrency=args.concurrency)
+        return ScheduledChatModel(create_azure_chat_model(azure_endpoint=endpoint, **CLIENT_PARAMS),
+                                  limiter, max_retries=6, max_output_tokens=50)
+
+    result, throttled = await against_fresh_mock(args, scheduled)
+    report("scheduled", result, throttled)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=60)
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--rate-429", type=float, default=0.2)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--tokens-per-minute", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
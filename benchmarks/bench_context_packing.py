@@ -0,0 +1,102 @@
+# bench_context_packing.py
+#
+# LLM calls, prompt tokens and synthesis time per answer of tree_summarize versus the packed
+# response mode, through the same query engines the app builds (query_engine_cache).
+#   python -m benchmarks.bench_context_packing [--questions 30] [--top-k 10] [--chunk-tokens 700]
+#
+# The synthetic index has long chunks and some articles published twice (the same text under
+# two URLs), so the top-k does not fit in one prompt of --context-window tokens and holds
+# duplicates. The fake LLM takes --llm-latency-ms plus --ms-per-1k-prompt-tokens per call.
+
+import time
+import random
+import asyncio
+import argparse
+
+from llama_index.core import Settings, VectorStoreIndex
+from llama_index.core.schema import QueryBundle, TextNode
+
+from benchmarks.fakes import (FakeSynthesisLLM, WORDS, install_fakes, set_dummy_azure_env,
+                              synthetic_questions)
+
+
+def long_chunk_index(num_articles: int, chunk_tokens: int, duplicate_share: float, embed_model, seed: int):
+    rng = random.Random(seed)
+    nodes = []
+    for i in range(num_articles):
+        topic = rng.sample(WORDS, 4)
+        sentences = [f"Når det gjelder {rng.choice(topic)} og {rng.choice(WORDS)}, bør du {rng.choice(WORDS)} "
+                     f"og snakke med {rng.choice(['fastlegen', 'helsesykepleier', 'jordmor'])} om {rng.choice(topic)}."
+                     for _ in range(chunk_tokens // 20)]
+        text = " ".join(sentences)
+        copies = 2 if rng.random() < duplicate_share else 1
+        for copy in range(copies):
+            nodes.append(TextNode(
+                id_=f"artikkel-{i}-{copy}",
+                text=text,
+                metadata={"title": f"Artikkel {i}", "url": f"https://www.helsenorge.no/artikkel-{i}/{copy}"},
+                embedding=embed_model.vector(text),
+            ))
+    return VectorStoreIndex(nodes, embed_model=embed_model)
+
+
+async def answer_all(engine, questions, embed_model) -> dict:
+    from tracing import request_trace, span
+
+    calls = prompt = completion = 0
+    start = time.perf_counter()
+    for question in questions:
+        bundle = QueryBundle(query_str=question, embedding=embed_model.vector(question))
+        with request_trace(response_mode="bench", similarity_top_k="bench") as trace:
+            nodes = await engine.aretrieve(bundle)
+            with span("llm_call_answer"):
+                await engine.asynthesize(bundle, nodes)
+        calls += sum(s.llm_calls for s in trace.spans)
+        prompt += trace.prompt_tokens
+        completion += trace.completion_tokens
+    n = len(questions)
+    return {"calls": calls / n, "prompt": prompt / n, "completion": completion / n,
+            "ms": (time.perf_counter() - start) / n * 1000}
+
+
+async def main_async(args):
+    set_dummy_azure_env()
+    embed_model = install_fakes(dim=args.dim)
+    Settings.llm = FakeSynthesisLLM(latency_ms=args.llm_latency_ms, ms_per_1k_prompt_tokens=args.ms_per_1k_prompt_tokens,
+                                    context_window=args.context_window)
+    # imported after the fakes are installed, the synthesizers read the LLM's context window
+    from query_engine_cache import build_query_engine
+    from query_utils import QuerySettings
+
+    index = long_chunk_index(args.articles, args.chunk_tokens, args.duplicate_share, embed_model, args.seed)
+    questions = synthetic_questions(args.questions, args.seed)
+    print(f"{args.articles} articles of ~{args.chunk_tokens} tokens ({args.duplicate_share:.0%} published twice), "
+          f"top_k {args.top_k}, context window {args.context_window}, "
+          f"LLM {args.llm_latency_ms} ms + {args.ms_per_1k_prompt_tokens} ms per 1k prompt tokens")
+    print(f"{'response mode':16s} {'LLM calls':>10s} {'prompt tok':>11s} {'compl. tok':>11s} {'ms/answer':>10s}")
+    for mode in args.modes:
+        settings = QuerySettings(response_mode=mode, similarity_top_k=args.top_k, similarity_cutoff=0.0,
+                                 retrieval_mode="vector")
+        result = await answer_all(build_query_engine(index, settings), questions, embed_model)
+        print(f"{mode:16s} {result['calls']:>10.2f} {result['prompt']:>11.0f} {result['completion']:>11.0f} "
+              f"{result['ms']:>10.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--articles", type=int, default=300)
+    parser.add_argument("--chunk-tokens", type=int, default=700)
+    parser.add_argument("--duplicate-share", type=float, default=0.2)
+    parser.add_argument("--questions", type=int, default=30)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--context-window", type=int, default=8192)
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--ms-per-1k-prompt-tokens", type=float, default=100)
+    parser.add_argument("--modes", nargs="+", default=["tree_summarize", "packed"])
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
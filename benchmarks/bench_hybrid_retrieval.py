@@ -0,0 +1,158 @@
+# bench_hybrid_retrieval.py
+#
+# Recall@k and context tokens per answer of vector-only retrieval versus hybrid BM25 + vector
+# retrieval, on a synthetic corpus with short keyword-like questions ("snus gravid").
+#   python -m benchmarks.bench_hybrid_retrieval [--nodes 1000] [--queries 300] [--dim 256] [--cutoff 0.7]
+#
+# Every article mentions two specific terms among general health sentences; a question is the
+# two terms of one article, and every article mentioning both is relevant. The embedding is
+# the hashed bag-of-words of benchmarks/fakes.py: like a real embedding, one rare term weighs
+# little against the rest of a long chunk; with 1000 articles a question has about four
+# relevant ones. Context tokens are what the synthesis step reads; the last line shows the top-k
+# hybrid retrieval needs to match the recall of vector retrieval at the largest k.
+# Both retrievers apply the similarity_cutoff of a request (0.7 by default, --cutoff -1 disables it);
+# "answered" is the share of questions with a node at or above the cutoff, which validation accepts;
+# "off-topic" is that share for questions about something the corpus does not cover. The hashed
+# bag-of-words embedding gives a two-word question a cosine of about 0.2 with a matching article,
+# far below real embeddings, so at 0.7 no node passes; --cutoff 0.3 shows how the keyword
+# coverage in the hybrid score lifts multi-term matches over a cutoff without admitting off-topic ones.
+
+import time
+import random
+import argparse
+
+import numpy as np
+from llama_index.core.schema import TextNode
+
+from benchmarks.fakes import FakeEmbedding, count_tokens
+from keyword_index import HybridRetriever, KeywordIndex, node_text
+from vector_search import EmbeddingMatrix, NumpyVectorRetriever, normalize_rows
+
+TERMS = (
+    "snus p-piller nikotinplaster jerntilskudd folat kvalme svangerskapsdiabetes angstlidelse "
+    "søvnmangel migrene eksem pollenallergi astmamedisin hasj alkoholforgiftning kondom "
+    "klamydia hpv-vaksine meslinger vannkopper ritalin paracet ibux insulin blodsukker "
+    "spiseforstyrrelse selvskading mobbing ensomhet kviser menssmerter"
+).split()
+TOPICS = ("gravid", "ungdom", "trening", "skole", "fastlegen", "helsestasjonen", "foreldre", "venner")
+OFF_TOPIC = (
+    "skattemelding ungdom", "bilforsikring pris", "fotball resultater", "billig flybillett",
+    "leie leilighet oslo", "norsk grammatikk", "skolerute vinterferie", "strømpris i dag",
+)
+SENTENCES = (
+    "Mange unge lurer på hvordan de kan ta vare på helsen sin i hverdagen.",
+    "Det er lurt å snakke med noen du stoler på hvis du er bekymret.",
+    "Helsesykepleieren på skolen kan gi deg råd og veiledning uten at foreldrene får vite det.",
+    "Du kan alltid kontakte fastlegen din for å få en vurdering av plagene dine.",
+    "Søvn, mat og fysisk aktivitet påvirker hvordan du har det både fysisk og psykisk.",
+    "Noen opplever bivirkninger, og da er det viktig å få hjelp tidlig.",
+    "Informasjonen her erstatter ikke en konsultasjon med helsepersonell.",
+    "Det finnes gode tilbud for ungdom i de fleste kommuner i Norge.",
+)
+
+
+def synthetic_corpus(num_nodes: int, embed_model: FakeEmbedding, seed: int) -> list[TextNode]:
+    rng = random.Random(seed)
+    nodes = []
+    for i in range(num_nodes):
+        term, topic = rng.choice(TERMS), rng.choice(TOPICS)
+        body = " ".join(rng.sample(SENTENCES, 5))
+        text = f"{body} Her kan du lese mer om {term} når du er {topic}. {' '.join(rng.sample(SENTENCES, 3))}"
+        nodes.append(TextNode(id_=f"artikkel-{i}", text=text, metadata={"title": f"Artikkel {i}"},
+                              embedding=embed_model.vector(text)))
+    return nodes
+
+
+def relevant_rows(nodes: list[TextNode], term: str, topic: str) -> set[int]:
+    return {row for row, node in enumerate(nodes) if f" {term} " in node.text and f" {topic}." in node.text}
+
+
+def evaluate(retriever, queries, nodes, ks, cutoff) -> dict:
+    row_of = {node.node_id: row for row, node in enumerate(nodes)}
+    ks = range(1, max(ks) + 1)
+    recall = {k: 0.0 for k in ks}
+    tokens = {k: 0 for k in ks}
+    answered, off_topic = 0, 0
+    for query in OFF_TOPIC:
+        retrieved = retriever.retrieve(query)
+        off_topic += any(n.score >= cutoff for n in retrieved) if cutoff is not None else bool(retrieved)
+    start = time.perf_counter()
+    for query, relevant in queries:
+        retrieved = retriever.retrieve(query)
+        hits = [row_of[n.node.node_id] for n in retrieved]
+        answered += any(n.score >= cutoff for n in retrieved) if cutoff is not None else bool(retrieved)
+        for k in ks:
+            recall[k] += len(relevant & set(hits[:k])) / len(relevant)
+            tokens[k] += sum(count_tokens(nodes[row].text) for row in hits[:k])
+    seconds = (time.perf_counter() - start) / len(queries)
+    return {
+        "recall": {k: recall[k] / len(queries) for k in ks},
+        "tokens": {k: tokens[k] / len(queries) for k in ks},
+        "answered": answered / len(queries),
+        "off_topic": off_topic / len(OFF_TOPIC),
+        "ms_per_query": seconds * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--cutoff", type=float, default=0.7)
+    parser.add_argument("--keyword-weight", type=float, default=0.3)
+    parser.add_argument("--ks", type=int, nargs="+", default=[3, 5, 10])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    embed_model = FakeEmbedding(dim=args.dim)
+    nodes = synthetic_corpus(args.nodes, embed_model, args.seed)
+    ids = [n.node_id for n in nodes]
+    matrix = EmbeddingMatrix(ids, normalize_rows(np.asarray([n.embedding for n in nodes], dtype=np.float32)),
+                             lambda row: nodes[row])
+    start = time.perf_counter()
+    keyword_index = KeywordIndex.build([node_text(n) for n in nodes])
+    build_seconds = time.perf_counter() - start
+
+    rng = random.Random(args.seed + 1)
+    queries = []
+    while len(queries) < args.queries:
+        term, topic = rng.choice(TERMS), rng.choice(TOPICS)
+        relevant = relevant_rows(nodes, term, topic)
+        if relevant:
+            queries.append((f"{term} {topic}", relevant))
+
+    top_k = max(args.ks)
+    cutoff = args.cutoff if args.cutoff >= 0 else None
+    retrievers = {
+        "vector": NumpyVectorRetriever(matrix, similarity_top_k=top_k, similarity_cutoff=cutoff,
+                                        embed_model=embed_model),
+        "hybrid": HybridRetriever(matrix, keyword_index, similarity_top_k=top_k,
+                                  similarity_cutoff=cutoff, keyword_weight=args.keyword_weight, embed_model=embed_model),
+    }
+    print(f"{args.nodes} nodes, {len(queries)} keyword questions, keyword index built in {build_seconds:.2f}s "
+          f"({len(keyword_index.postings)} terms), keyword weight {args.keyword_weight}, similarity cutoff {cutoff}")
+    header = " ".join(f"{'recall@' + str(k):>10s} {'tokens@' + str(k):>10s}" for k in args.ks)
+    print(f"{'retriever':10s} {header} {'answered':>9s} {'off-topic':>9s} {'ms/query':>9s}")
+    results = {}
+    for name, retriever in retrievers.items():
+        results[name] = result = evaluate(retriever, queries, nodes, args.ks, cutoff)
+        row = " ".join(f"{result['recall'][k]:>10.3f} {result['tokens'][k]:>10.0f}" for k in args.ks)
+        print(f"{name:10s} {row} {result['answered']:>9.1%} {result['off_topic']:>9.1%} {result['ms_per_query']:>9.2f}")
+
+    target = results["vector"]["recall"][top_k]
+    if not results["vector"]["tokens"][top_k]:
+        print(f"vector retrieval returns no node at or above the similarity cutoff {cutoff}")
+        return
+    k = next((k for k in range(1, top_k + 1) if results["hybrid"]["recall"][k] >= target), None)
+    if k is None:
+        print(f"hybrid does not reach the vector recall@{top_k} of {target:.3f} within top {top_k}")
+    else:
+        saved = 1 - results["hybrid"]["tokens"][k] / results["vector"]["tokens"][top_k]
+        print(f"hybrid reaches the vector recall@{top_k} ({target:.3f}) at top_k={k}: "
+              f"{results['hybrid']['tokens'][k]:.0f} instead of {results['vector']['tokens'][top_k]:.0f} "
+              f"context tokens per answer ({-saved:+.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# bench_index_build.py
+#
+# Full versus incremental builds with build_index.py, offline with the fake embedding model.
+#   python -m benchmarks.bench_index_build [--articles 1000] [--changed 0.05] [--embed-latency-ms 200]
+#
+# Writes --articles synthetic articles to a temporary directory and builds the index from
+# scratch, then edits, removes and adds a --changed share of the articles and builds again.
+# Every build is loaded the way the server loads it, to check the store is complete.
+
+import os
+import random
+import asyncio
+import tempfile
+import argparse
+
+from llama_index.core import Settings
+
+from benchmarks.fakes import FakeEmbedding, WORDS
+from build_index import build_index
+from mmap_vector_store import load_mmap_index
+
+
+def write_article(directory: str, i: int, rng: random.Random, paragraphs: int):
+    topic = rng.sample(WORDS, 3)
+    body = "\n\n".join(
+        " ".join(f"Om {rng.choice(topic)} og {rng.choice(WORDS)}: snakk med fastlegen om {rng.choice(WORDS)}."
+                 for _ in range(rng.randint(8, 16)))
+        for _ in range(paragraphs)
+    )
+    with open(os.path.join(directory, f"artikkel-{i}.md"), "w", encoding="utf-8") as f:
+        f.write(f"---\ntitle: Artikkel {i} om {topic[0]}\nurl: https://www.helsenorge.no/artikkel-{i}/\n---\n"
+                f"# Artikkel {i}\n\n{body}\n")
+
+
+async def build(label: str, source: str, storage: str, embed_model, args) -> None:
+    report = await build_index(source, storage, embed_model, chunk_size=args.chunk_size,
+                               batch_size=args.batch_size, concurrency=args.concurrency)
+    nodes = len(load_mmap_index(storage).vector_store)
+    print(f"{label:12s} {report.chunks:>7d} {report.embedded:>9d} {report.reused:>7d} {report.deleted:>8d} "
+          f"{report.embedding_calls:>6d} {report.seconds:>8.2f} {report.chunks_per_second:>9.0f}  (loaded {nodes})")
+
+
+async def main_async(args):
+    rng = random.Random(args.seed)
+    embed_model = FakeEmbedding(dim=args.dim, latency_ms=args.embed_latency_ms)
+    Settings.embed_model = embed_model  # the loaded index is checked with it
+    with tempfile.TemporaryDirectory() as tmp:
+        source, storage = os.path.join(tmp, "articles"), os.path.join(tmp, "storage")
+        os.makedirs(source)
+        for i in range(args.articles):
+            write_article(source, i, rng, args.paragraphs)
+
+        print(f"{args.articles} articles, batches of {args.batch_size}, {args.concurrency} in flight, "
+              f"{args.embed_latency_ms} ms per embedding request")
+        print(f"{'build':12s} {'chunks':>7s} {'embedded':>9s} {'reused':>7s} {'deleted':>8s} {'calls':>6s} "
+              f"{'seconds':>8s} {'chunks/s':>9s}")
+        await build("full", source, storage, embed_model, args)
+        await build("unchanged", source, storage, embed_model, args)
+
+        changed = max(1, int(args.articles * args.changed))
+        for i in rng.sample(range(args.articles), changed):
+            write_article(source, i, rng, args.paragraphs)
+        for i in rng.sample(range(args.articles), changed):
+            os.remove(os.path.join(source, f"artikkel-{i}.md"))
+        for i in range(args.articles, args.articles + changed):
+            write_article(source, i, rng, args.paragraphs)
+        await build(f"{args.changed:.0%} changed", source, storage, embed_model, args)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--articles", type=int, default=1000)
+    parser.add_argument("--paragraphs", type=int, default=3)
+    parser.add_argument("--changed", type=float, default=0.05)
+    parser.add_argument("--chunk-size", type=int, default=512)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--embed-latency-ms", type=float, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
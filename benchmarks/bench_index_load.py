@@ -0,0 +1,94 @@
+# bench_index_load.py
+#
+# Load time and memory of the JSON stores versus the memory-mapped format.
+#   python -m benchmarks.bench_index_load [--nodes 5000] [--dim 1536]
+#
+# Every load runs in a fresh process. RssAnon is private to the worker, RssFile is
+# backed by the page cache and shared by all workers mapping the same files.
+
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+import numpy as np
+from llama_index.core import Settings, VectorStoreIndex, MockEmbedding, StorageContext, load_index_from_storage
+from llama_index.core.schema import TextNode
+
+from mmap_vector_store import convert_storage_to_mmap, load_mmap_index
+
+
+def build_json_store(storage: str, num_nodes: int, dim: int):
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((num_nodes, dim)).astype(np.float32)
+    nodes = [
+        TextNode(
+            id_=f"node-{i}",
+            text=f"Artikkel {i} om helse, graviditet og rus. " * 40,
+            metadata={"title": f"Artikkel {i}", "url": f"https://www.helsenorge.no/artikkel-{i}/"},
+            embedding=embeddings[i].tolist(),
+        )
+        for i in range(num_nodes)
+    ]
+    VectorStoreIndex(nodes).storage_context.persist(persist_dir=storage)
+
+
+def memory_kb() -> dict:
+    usage = {"RssAnon": 0, "RssFile": 0}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                key = line.split(":")[0]
+                if key in usage:
+                    usage[key] = int(line.split()[1])
+    except FileNotFoundError:
+        usage["RssAnon"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage
+
+
+def load_and_measure(fmt: str, storage: str, queue):
+    Settings.embed_model = MockEmbedding(embed_dim=8)
+    before = memory_kb()
+    start = time.perf_counter()
+    if fmt == "json":
+        index = load_index_from_storage(StorageContext.from_defaults(persist_dir=storage))
+    else:
+        index = load_mmap_index(storage)
+    elapsed = time.perf_counter() - start
+    after = memory_kb()
+    queue.put((elapsed, {k: after[k] - before[k] for k in after}))
+    del index
+
+
+def measure(fmt: str, storage: str):
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=load_and_measure, args=(fmt, storage, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=5000)
+    parser.add_argument("--dim", type=int, default=1536)
+    args = parser.parse_args()
+
+    Settings.embed_model = MockEmbedding(embed_dim=args.dim)
+    with tempfile.TemporaryDirectory() as storage:
+        build_json_store(storage, args.nodes, args.dim)
+        convert_storage_to_mmap(storage)
+
+        print(f"{args.nodes} nodes, dim {args.dim}")
+        for fmt in ("json", "mmap"):
+            elapsed, mem = measure(fmt, storage)
+            print(f"{fmt:5s} load {elapsed:7.2f}s  RssAnon +{mem['RssAnon'] / 1024:8.1f} MB  "
+                  f"RssFile +{mem['RssFile'] / 1024:8.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# bench_multi_index.py
+#
+# Retrieval latency over several indexes: one index alone, the indexes searched one
+# after the other, and FusionRetriever searching them concurrently.
+#   python -m benchmarks.bench_multi_index [--indexes 4] [--nodes 50000] [--dim 1536]
+
+import time
+import asyncio
+import argparse
+
+import numpy as np
+from llama_index.core import MockEmbedding
+from llama_index.core.schema import QueryBundle, TextNode
+
+from multi_index import FusionRetriever
+from vector_search import EmbeddingMatrix, NumpyVectorRetriever, normalize_rows
+
+
+def random_retriever(name: str, nodes: int, dim: int, top_k: int, rng) -> NumpyVectorRetriever:
+    matrix = normalize_rows(rng.standard_normal((nodes, dim)).astype(np.float32))
+    ids = [f"{name}-{i}" for i in range(nodes)]
+    get_node = lambda row: TextNode(id_=ids[row], text=f"{name} {row}")
+    # the queries come with their embedding, the embedding model is never called
+    return NumpyVectorRetriever(EmbeddingMatrix(ids, matrix, get_node), similarity_top_k=top_k,
+                                embed_model=MockEmbedding(embed_dim=dim))
+
+
+async def time_per_query(fn, bundles) -> float:
+    start = time.perf_counter()
+    for bundle in bundles:
+        await fn(bundle)
+    return (time.perf_counter() - start) / len(bundles)
+
+
+async def main_async(args):
+    rng = np.random.default_rng(0)
+    retrievers = {f"index{i}": random_retriever(f"index{i}", args.nodes, args.dim, args.top_k, rng)
+                  for i in range(args.indexes)}
+    fusion = FusionRetriever(retrievers, similarity_top_k=args.top_k, mode=args.mode)
+    bundles = [QueryBundle(query_str="q", embedding=rng.standard_normal(args.dim).tolist())
+               for _ in range(args.queries)]
+    single = next(iter(retrievers.values()))
+
+    async def sequential(bundle):
+        return fusion.fuse([r.retrieve(bundle) for r in retrievers.values()])
+
+    # first call of each path builds nothing, but warms the thread pool and caches
+    await fusion.aretrieve(bundles[0])
+
+    one = await time_per_query(single.aretrieve, bundles)
+    one_by_one = await time_per_query(sequential, bundles)
+    concurrent = await time_per_query(fusion.aretrieve, bundles)
+
+    print(f"{args.indexes} indexes x {args.nodes} nodes, dim {args.dim}, top_k {args.top_k}, fusion {args.mode}")
+    print(f"{'single index':24s} {one * 1e3:8.2f} ms")
+    print(f"{'sequential':24s} {one_by_one * 1e3:8.2f} ms  {one_by_one / one:5.2f}x single")
+    print(f"{'concurrent (fusion)':24s} {concurrent * 1e3:8.2f} ms  {concurrent / one:5.2f}x single")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--indexes", type=int, default=4)
+    parser.add_argument("--nodes", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--mode", default="rrf", choices=["rrf", "minmax"])
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
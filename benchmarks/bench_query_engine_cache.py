@@ -0,0 +1,60 @@
+# bench_query_engine_cache.py
+#
+# Per-request setup overhead of get_answer() before and after the query engine cache.
+#   python -m benchmarks.bench_query_engine_cache [--nodes 1000] [--iterations 200]
+
+import argparse
+import time
+
+from llama_index.core import Settings, VectorStoreIndex, MockEmbedding
+from llama_index.core.llms import MockLLM
+from llama_index.core.schema import TextNode
+
+from query_utils import QuerySettings
+from query_engine_cache import QueryEngineCache, build_text_qa_template, build_query_engine
+
+
+def build_index(num_nodes: int) -> VectorStoreIndex:
+    nodes = [TextNode(text=f"Artikkel {i} om helse.", id_=str(i)) for i in range(num_nodes)]
+    return VectorStoreIndex(nodes)
+
+
+def per_request_rebuild(index: VectorStoreIndex, query_settings: QuerySettings):
+    # what get_answer() did on every request: template, synthesizer, query engine, IPython
+    build_text_qa_template()
+    build_query_engine(index, query_settings)
+    from IPython.display import Markdown
+    Markdown("")
+
+
+def time_per_call(fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=1000)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    Settings.embed_model = MockEmbedding(embed_dim=64)
+    Settings.llm = MockLLM()
+    index = build_index(args.nodes)
+    query_settings = QuerySettings()
+
+    cache = QueryEngineCache()
+    cache.warm("bench", index)
+
+    before = time_per_call(lambda: per_request_rebuild(index, query_settings), args.iterations)
+    after = time_per_call(lambda: cache.get("bench", index, query_settings), args.iterations)
+
+    print(f"per-request setup before: {before * 1e6:10.1f} us")
+    print(f"per-request setup after:  {after * 1e6:10.1f} us")
+    print(f"speed-up:                 {before / after:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
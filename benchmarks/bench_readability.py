@@ -0,0 +1,129 @@
+# bench_readability.py
+#
+# The readability loop with whole-answer rewrites versus sentence rewrites (readability.py):
+# LLM calls, prompt and output tokens, time and the final LIX per answer, plus the cost of
+# scoring an answer and the LIX the old scorer gave without æ, ø and å.
+#   python -m benchmarks.bench_readability [--answers 50] [--paragraphs 4] [--hard-share 0.3]
+#
+# The synthetic answers are paragraphs of plain sentences with a share of long sentences full
+# of long words. The fake chat model (benchmarks/fakes.py) simplifies whatever it is asked to
+# rewrite and takes --llm-latency-ms plus --ms-per-1k-output-tokens per call.
+
+import re
+import time
+import random
+import asyncio
+import argparse
+
+from benchmarks.fakes import FakeChatModel, READABLE_ANSWER
+from readability import LIX_READABLE_LIMIT, text_lix
+from agent_workflow_structured_answer import llm_make_answer_more_readable
+
+HARD_WORDS = (
+    "svangerskapsomsorgen helsestasjonstjenesten fastlegeordningen blodsukkerregulering "
+    "nikotinavhengighet røykeavvenningsprogrammet legemiddelhåndtering bivirkningsrapportering "
+    "ernæringsanbefalingene kostholdsrådgivning søvnforstyrrelser førstelinjetjenesten "
+    "henvisningspraksis oppfølgingsansvaret spesialisthelsetjenesten påvirkningsfaktorer"
+).split()
+# seven letters with æ, ø or å: long words the old scorer counted as short
+FILLER = "og i som for at det med på en til av er kan påvirke særlige følgene således behøver utløser".split()
+EASY_SENTENCES = READABLE_ANSWER.split(". ")
+
+
+def hard_sentence(rng: random.Random) -> str:
+    words = [rng.choice(HARD_WORDS) if rng.random() < 0.5 else rng.choice(FILLER) for _ in range(rng.randint(25, 40))]
+    return " ".join(words).capitalize() + "."
+
+
+def synthetic_answer(rng: random.Random, paragraphs: int, sentences: int, hard_share: float) -> str:
+    blocks = []
+    for _ in range(paragraphs):
+        block = [hard_sentence(rng) if rng.random() < hard_share else rng.choice(EASY_SENTENCES).rstrip(".") + "."
+                 for _ in range(sentences)]
+        blocks.append(" ".join(block))
+    return "\n\n".join(blocks)
+
+
+def old_lix(text: str) -> float:
+    """The scorer before readability.py: ASCII letters only, one score for the whole answer."""
+    words = text.split()
+    num_words = len(words) or 1
+    num_sentences = max(len(re.split(r'[.!?]', text)) - 1, 1)
+    num_long = sum(1 for w in words if len(re.sub(r'[^a-zA-Z]', '', w)) > 6)
+    return (num_words / num_sentences) + (num_long / num_words) * 100
+
+
+class CountingLLM:
+    """Sums the token usage the fake reports, like the request trace does for Azure."""
+    def __init__(self, llm):
+        self.llm = llm
+        self.calls = self.prompt_tokens = self.output_tokens = 0
+
+    async def ainvoke(self, prompt, config=None):
+        msg = await self.llm.ainvoke(prompt, config=config)
+        self.calls += 1
+        self.prompt_tokens += msg.usage_metadata["input_tokens"]
+        self.output_tokens += msg.usage_metadata["output_tokens"]
+        return msg
+
+
+async def rewrite_whole(state: dict) -> dict:
+    msg = await state["llm"].ainvoke(f"Improve readability: {state['answer']}. Feedback: {state['feedback']}")
+    return {"answer": msg.content, "rewrite_rounds": state["rewrite_rounds"] + 1}
+
+
+async def run(mode: str, answers: list[str], chat_model, max_rounds: int) -> dict:
+    llm = CountingLLM(chat_model)
+    rewrite = rewrite_whole if mode == "whole answer" else llm_make_answer_more_readable
+    final_lix = 0.0
+    start = time.perf_counter()
+    for answer in answers:
+        state = {"llm": llm, "answer": answer, "rewrite_rounds": 0,
+                 "feedback": "Use shorter sentences, fewer words, and simpler language."}
+        while text_lix(state["answer"]) > LIX_READABLE_LIMIT and state["rewrite_rounds"] < max_rounds:
+            state.update(await rewrite(state))
+        final_lix += text_lix(state["answer"])
+    n = len(answers)
+    return {"calls": llm.calls / n, "prompt": llm.prompt_tokens / n, "output": llm.output_tokens / n,
+            "ms": (time.perf_counter() - start) / n * 1000, "lix": final_lix / n}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--answers", type=int, default=50)
+    parser.add_argument("--paragraphs", type=int, default=4)
+    parser.add_argument("--sentences", type=int, default=6)
+    parser.add_argument("--hard-share", type=float, default=0.3)
+    parser.add_argument("--max-rounds", type=int, default=2)
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--ms-per-1k-output-tokens", type=float, default=15000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    answers = [synthetic_answer(rng, args.paragraphs, args.sentences, args.hard_share) for _ in range(args.answers)]
+
+    start = time.perf_counter()
+    for answer in answers:
+        old_lix(answer)
+    old_us = (time.perf_counter() - start) / len(answers) * 1e6
+    start = time.perf_counter()
+    for answer in answers:
+        text_lix(answer)
+    new_us = (time.perf_counter() - start) / len(answers) * 1e6
+    print(f"{len(answers)} answers of ~{sum(len(a.split()) for a in answers) // len(answers)} words, "
+          f"LLM {args.llm_latency_ms} ms + {args.ms_per_1k_output_tokens} ms per 1k output tokens")
+    print(f"scoring: {new_us:.0f} µs per answer ({old_us:.0f} µs before), mean LIX "
+          f"{sum(map(text_lix, answers)) / len(answers):.1f} ({sum(map(old_lix, answers)) / len(answers):.1f} "
+          f"when æ, ø and å are not counted as letters)")
+
+    chat_model = FakeChatModel(latency_ms=args.llm_latency_ms, ms_per_1k_output_tokens=args.ms_per_1k_output_tokens)
+    print(f"{'rewrite':14s} {'LLM calls':>10s} {'prompt tok':>11s} {'output tok':>11s} {'ms/answer':>10s} {'final LIX':>10s}")
+    for mode in ("whole answer", "sentences"):
+        result = asyncio.run(run(mode, answers, chat_model, args.max_rounds))
+        print(f"{mode:14s} {result['calls']:>10.2f} {result['prompt']:>11.0f} {result['output']:>11.0f} "
+              f"{result['ms']:>10.0f} {result['lix']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
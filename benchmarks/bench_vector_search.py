@@ -0,0 +1,59 @@
+# bench_vector_search.py
+#
+# Top-k similarity search of the simple vector store (Python lists, per-node loop)
+# versus one matrix-vector product with argpartition.
+#   python -m benchmarks.bench_vector_search [--sizes 1000 10000 100000] [--dim 256]
+
+import argparse
+import time
+
+import numpy as np
+from llama_index.core.indices.query.embedding_utils import get_top_k_embeddings
+
+from vector_search import normalize_rows, normalize_query, top_k_similarities
+
+
+def time_per_query(fn, queries) -> float:
+    start = time.perf_counter()
+    for q in queries:
+        fn(q)
+    return (time.perf_counter() - start) / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--cutoff", type=float, default=0.0)
+    parser.add_argument("--queries", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"dim {args.dim}, top_k {args.top_k}, cutoff {args.cutoff}")
+    print(f"{'nodes':>8} {'simple store':>14} {'numpy':>10} {'speed-up':>9}")
+    for size in args.sizes:
+        embeddings = rng.standard_normal((size, args.dim)).astype(np.float32)
+        queries = rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+
+        # what SimpleVectorStore holds and does per query
+        embedding_lists = embeddings.tolist()
+        ids = [str(i) for i in range(size)]
+        query_lists = queries.tolist()
+        baseline = time_per_query(
+            lambda q: get_top_k_embeddings(q, embedding_lists, similarity_top_k=args.top_k,
+                                           embedding_ids=ids, similarity_cutoff=args.cutoff),
+            query_lists,
+        )
+
+        matrix = normalize_rows(embeddings)
+        vectorized = time_per_query(
+            lambda q: top_k_similarities(matrix, normalize_query(q), args.top_k, args.cutoff),
+            queries,
+        )
+
+        print(f"{size:>8} {baseline * 1e3:>11.2f} ms {vectorized * 1e3:>7.2f} ms {baseline / vectorized:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
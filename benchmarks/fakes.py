@@ -0,0 +1,284 @@
+# fakes.py
+#
+# Deterministic local stand-ins for Azure OpenAI, so benchmarks run without network or cost:
+# - FakeEmbedding: hashed bag-of-words vectors, similar questions get similar vectors
+# - FakeChatModel: LangChain chat model used by the workflow nodes (title, summary, rewrites) and,
+#   through the scheduler and ScheduledSynthesisLLM like SYNTHESIS_LLM=azure, for response synthesis
+# - FakeSynthesisLLM: llama_index LLM for benchmarks of the synthesis prompt alone
+# All of them wait a configurable latency with asyncio.sleep, like a network call would.
+
+import os
+import re
+import time
+import random
+import asyncio
+import hashlib
+from typing import Any, ClassVar
+
+import numpy as np
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableLambda
+from llama_index.core import Settings, VectorStoreIndex
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.llms import CustomLLM, CompletionResponse, LLMMetadata
+from llama_index.core.llms.callbacks import llm_completion_callback
+from llama_index.core.schema import TextNode
+
+# plain, short sentences: LIX well below 50, so no readability rewrites are needed
+READABLE_ANSWER = (
+    "Snus kan skade fosteret. Du bør slutte før du blir gravid. "
+    "Snakk med fastlegen om hjelp til å slutte. Det finnes gode råd og støtte."
+)
+
+WORDS = (
+    "snus røyk tobakk alkohol graviditet foster svangerskap kvalme søvn kosthold vitaminer "
+    "jern folat trening vekt blodtrykk diabetes astma allergi feber hoste vaksine barn "
+    "amming fødsel prevensjon sex rus cannabis angst depresjon stress hodepine ryggsmerter"
+).split()
+
+
+def count_tokens(text: str) -> int:
+    # about four characters per token
+    return max(1, len(text) // 4)
+
+
+def fake_latency(latency_ms: float, jitter_ms: float) -> float:
+    return max(0.0, latency_ms + random.uniform(-jitter_ms, jitter_ms)) / 1000
+
+
+class FakeEmbedding(BaseEmbedding):
+    """Hashed bag-of-words embedding; deterministic across processes."""
+    dim: int = 256
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    # symmetric: request_coalescing batches its queries through the text endpoint
+    embeds_queries_as_texts: ClassVar[bool] = True
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "FakeEmbedding"
+
+    def vector(self, text: str) -> list[float]:
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            vec[int(hashlib.md5(word.encode()).hexdigest(), 16) % self.dim] += 1.0
+        norm = np.linalg.norm(vec)
+        return (vec / norm if norm else vec).tolist()
+
+    def _get_query_embedding(self, query: str) -> list[float]:
+        time.sleep(fake_latency(self.latency_ms, self.jitter_ms))
+        return self.vector(query)
+
+    def _get_text_embedding(self, text: str) -> list[float]:
+        time.sleep(fake_latency(self.latency_ms, self.jitter_ms))
+        return self.vector(text)
+
+    async def _aget_query_embedding(self, query: str) -> list[float]:
+        await asyncio.sleep(fake_latency(self.latency_ms, self.jitter_ms))
+        return self.vector(query)
+
+    async def _aget_text_embedding(self, text: str) -> list[float]:
+        await asyncio.sleep(fake_latency(self.latency_ms, self.jitter_ms))
+        return self.vector(text)
+
+    async def _aget_text_embeddings(self, texts: list[str]) -> list[list[float]]:
+        # one round-trip for the whole batch, like the real endpoint
+        await asyncio.sleep(fake_latency(self.latency_ms, self.jitter_ms))
+        return [self.vector(t) for t in texts]
+
+
+class FakeSynthesisLLM(CustomLLM):
+    """
+    llama_index LLM answering every prompt with READABLE_ANSWER after `latency_ms`, plus
+    `ms_per_1k_prompt_tokens` for the prompt, since long prompts are slower to process.
+    """
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    ms_per_1k_prompt_tokens: float = 0.0
+    context_window: int = 128000
+    answer: str = READABLE_ANSWER
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "FakeSynthesisLLM"
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(context_window=self.context_window, num_output=1024, is_chat_model=False)
+
+    def _latency(self, prompt: str) -> float:
+        return fake_latency(self.latency_ms + self.ms_per_1k_prompt_tokens * count_tokens(prompt) / 1000,
+                            self.jitter_ms)
+
+    def _response(self, prompt: str, text: str, delta: str | None = None) -> CompletionResponse:
+        # token counts in the same place the OpenAI integration puts them
+        return CompletionResponse(text=text, delta=delta, additional_kwargs={
+            "prompt_tokens": count_tokens(prompt),
+            "completion_tokens": count_tokens(text),
+            "total_tokens": count_tokens(prompt) + count_tokens(text),
+        })
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        time.sleep(self._latency(prompt))
+        return self._response(prompt, self.answer)
+
+    @llm_completion_callback()
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        await asyncio.sleep(self._latency(prompt))
+        return self._response(prompt, self.answer)
+
+    def _chunks(self):
+        words = self.answer.split(" ")
+        return [w if i == len(words) - 1 else w + " " for i, w in enumerate(words)]
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any):
+        def gen():
+            time.sleep(self._latency(prompt))
+            text = ""
+            for chunk in self._chunks():
+                text += chunk
+                yield self._response(prompt, text, chunk)
+        return gen()
+
+    @llm_completion_callback()
+    async def astream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any):
+        async def gen():
+            await asyncio.sleep(self._latency(prompt))
+            text = ""
+            for chunk in self._chunks():
+                text += chunk
+                yield self._response(prompt, text, chunk)
+        return gen()
+
+
+def simplify(sentence: str) -> str:
+    """A readable version of a sentence: its short words, at most eight of them."""
+    words = [w for w in re.findall(r"\w+", sentence) if len(w) <= 6][:8] or ["Ja"]
+    return " ".join(words).capitalize() + "."
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    LangChain chat model for the workflow nodes; supports with_structured_output() and streaming.
+    The synthesis prompt is answered with READABLE_ANSWER. Readability rewrites simplify what they
+    are given, so their output is as long as a real rewrite would be; `ms_per_1k_output_tokens`
+    makes long outputs slower, like generation is.
+    """
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    ms_per_1k_output_tokens: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _message(self, messages) -> AIMessage:
+        prompt = " ".join(str(m.content) for m in messages)
+        if prompt.startswith("You are 'HelseSvar'"):
+            content = READABLE_ANSWER
+        elif prompt.startswith("Improve readability"):
+            answer = prompt[len("Improve readability: "):].rsplit(" Feedback:", 1)[0]
+            content = " ".join(simplify(s) for s in re.split(r"(?<=[.!?])\s+", answer) if s.strip())
+        elif prompt.startswith("Rewrite the numbered sentences"):
+            numbered = re.findall(r"^(\d+): (.+)$", prompt, re.MULTILINE)
+            content = "\n".join(f"{number}: {simplify(sentence)}" for number, sentence in numbered)
+        else:
+            content = "Kan jeg bruke snus når jeg er gravid?"
+        return AIMessage(content=content, usage_metadata={
+            "input_tokens": count_tokens(prompt),
+            "output_tokens": count_tokens(content),
+            "total_tokens": count_tokens(prompt) + count_tokens(content),
+        })
+
+    def _latency(self, message: AIMessage) -> float:
+        output_ms = self.ms_per_1k_output_tokens * count_tokens(message.content) / 1000
+        return fake_latency(self.latency_ms + output_ms, self.jitter_ms)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message = self._message(messages)
+        time.sleep(self._latency(message))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message = self._message(messages)
+        await asyncio.sleep(self._latency(message))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        message = self._message(messages)
+        await asyncio.sleep(self._latency(message))
+        words = message.content.split(" ")
+        for i, word in enumerate(words):
+            last = i == len(words) - 1
+            chunk = AIMessageChunk(content=word if last else word + " ",
+                                   usage_metadata=message.usage_metadata if last else None)
+            yield ChatGenerationChunk(message=chunk)
+
+    def with_structured_output(self, schema, **kwargs):
+        def fill():
+            return schema(**{name: "Snus i svangerskapet" for name in schema.model_fields})
+
+        def structured(_input):
+            time.sleep(fake_latency(self.latency_ms, self.jitter_ms))
+            return fill()
+
+        async def astructured(_input):
+            await asyncio.sleep(fake_latency(self.latency_ms, self.jitter_ms))
+            return fill()
+
+        return RunnableLambda(structured, afunc=astructured)
+
+
+def build_synthetic_index(num_nodes: int, embed_model: FakeEmbedding, seed: int = 0,
+                          name: str = "artikkel") -> VectorStoreIndex:
+    """Index of `num_nodes` short health articles with precomputed embeddings (no embedding calls)."""
+    rng = random.Random(seed)
+    nodes = []
+    for i in range(num_nodes):
+        topic = rng.sample(WORDS, 4)
+        text = (f"Artikkel {i} handler om {topic[0]} og {topic[1]}. "
+                f"Her får du råd om {topic[2]}, {topic[3]} og helse i hverdagen. " * 3)
+        nodes.append(TextNode(
+            id_=f"{name}-{i}",
+            text=text,
+            metadata={"title": f"Artikkel {i}: {topic[0]}", "url": f"https://www.helsenorge.no/{name}-{i}/"},
+            embedding=embed_model.vector(text),
+        ))
+    return VectorStoreIndex(nodes, embed_model=embed_model)
+
+
+def synthetic_questions(count: int, seed: int = 1) -> list[str]:
+    rng = random.Random(seed)
+    return [f"Hva bør jeg vite om {a} og {b} når jeg er gravid?" for a, b in (rng.sample(WORDS, 2) for _ in range(count))]
+
+
+def set_dummy_azure_env():
+    """Placeholder Azure settings; install_fakes() replaces the client before anything could connect."""
+    for name, value in {
+        "AZURE_OPENAI_MODEL": "gpt-4o",
+        "AZURE_OPENAI_DEPLOYMENT_NAME": "fake",
+        "AZURE_OPENAI_API_KEY": "fake",
+        "AZURE_OPENAI_AZURE_ENDPOINT": "http://localhost:1",
+        "AZURE_OPENAI_API_VERSJON": "2024-08-01-preview",
+        "OPENAI_API_KEY": "fake",
+    }.items():
+        os.environ.setdefault(name, value)
+
+
+def install_fakes(llm_latency_ms: float = 0.0, embed_latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                  dim: int = 256) -> FakeEmbedding:
+    """Swap the embedding model, the synthesis LLM and server_settings.llm for the fakes."""
+    from azure_client import create_scheduled_llm, create_synthesis_llm
+    from config import server_settings
+
+    embed_model = FakeEmbedding(dim=dim, latency_ms=embed_latency_ms, jitter_ms=jitter_ms)
+    Settings.embed_model = embed_model
+    # through the same scheduler as the Azure model, so its overhead is measured too
+    llm = create_scheduled_llm(FakeChatModel(latency_ms=llm_latency_ms, jitter_ms=jitter_ms))
+    server_settings.set_llm(llm)
+    Settings.llm = create_synthesis_llm(llm)
+    return embed_model
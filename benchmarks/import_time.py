@@ -0,0 +1,64 @@
+# import_time.py
+#
+# Import-time profile of a module, from python -X importtime in a fresh interpreter.
+#   python -m benchmarks.import_time [--module app] [--top 15]
+#
+# Shows the total, the packages that cost the most (self time summed per top-level
+# package) and the slowest modules including their own imports. Run it before and
+# after touching imports to keep app.py cheap to import: Hypercorn only binds once it is done.
+
+import os
+import sys
+import argparse
+import subprocess
+from collections import defaultdict
+
+
+def profile_imports(module: str) -> list[tuple[str, int, int, int]]:
+    """(module, self us, cumulative us, depth) for every module imported by `import module`."""
+    env = dict(os.environ)
+    # config.py reads these; nothing connects during import
+    for name in ("AZURE_OPENAI_MODEL", "AZURE_OPENAI_DEPLOYMENT_NAME", "AZURE_OPENAI_API_KEY",
+                 "AZURE_OPENAI_AZURE_ENDPOINT", "AZURE_OPENAI_API_VERSJON", "OPENAI_API_KEY"):
+        env.setdefault(name, "fake")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=env,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    rows = profile_imports(args.module)
+    total = next(cumulative for name, _, cumulative, _ in reversed(rows) if name == args.module)
+    print(f"import {args.module}: {total / 1e6:.2f}s, {len(rows)} modules")
+
+    packages = defaultdict(int)
+    for name, self_us, _, _ in rows:
+        packages[name.split(".")[0]] += self_us
+    print(f"\n{'package (self time)':40s} {'ms':>8s}")
+    for name, us in sorted(packages.items(), key=lambda kv: -kv[1])[:args.top]:
+        print(f"{name:40s} {us / 1000:8.1f}")
+
+    print(f"\n{'module (with its imports)':60s} {'ms':>8s}")
+    for name, _, cumulative, depth in sorted(rows, key=lambda r: -r[2])[:args.top]:
+        print(f"{'  ' * min(depth, 4) + name:60s} {cumulative / 1000:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
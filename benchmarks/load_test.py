@@ -0,0 +1,181 @@
+# load_test.py
+#
+# Offline load test of /chat: the Quart app with fake LLMs and embeddings (benchmarks/fakes.py)
+# over a synthetic index, driven at a fixed concurrency through the test client.
+# No network and no Azure costs.
+#   python -m benchmarks.load_test [--nodes 2000] [--requests 200] [--concurrency 16] [--llm-latency-ms 200]
+#
+# Reports p50/p95/p99 latency, throughput and the mean/p95 time of every stage (from the
+# request traces). With --max-p95-ms / --min-throughput it exits with status 1 when a
+# threshold is missed, so it can guard against performance regressions in CI.
+# With --deadline-seconds every request carries that deadline; requests shed with 503 and
+# answers degraded under load (optional workflow nodes skipped) are counted apart from errors.
+
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+from collections import defaultdict
+
+from benchmarks.fakes import build_synthetic_index, install_fakes, set_dummy_azure_env, synthetic_questions
+
+INDEX_NAME = "helsenorgeartikler"
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+async def drive(client, payloads: list[dict], concurrency: int, path: str) -> tuple[list[dict], float]:
+    """Send all payloads with at most `concurrency` requests in flight."""
+    queue = asyncio.Queue()
+    for payload in payloads:
+        queue.put_nowait(payload)
+    results = []
+
+    async def worker():
+        while not queue.empty():
+            payload = queue.get_nowait()
+            start = time.perf_counter()
+            response = await client.post(path, json=payload)
+            body = await response.get_json()
+            results.append({
+                "status": response.status_code,
+                "seconds": time.perf_counter() - start,
+                "trace": (body or {}).get("trace"),
+            })
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results, time.perf_counter() - start
+
+
+def summarize(results: list[dict], elapsed: float) -> dict:
+    ok = [r for r in results if r["status"] == 200]
+    shed = sum(1 for r in results if r["status"] == 503)
+    latencies = [r["seconds"] * 1000 for r in ok]
+    stages = defaultdict(list)
+    tokens = []
+    for r in ok:
+        trace = r["trace"] or {}
+        tokens.append(trace.get("prompt_tokens", 0) + trace.get("completion_tokens", 0))
+        per_request = defaultdict(float)
+        for s in trace.get("spans", []):
+            per_request[s["name"]] += s["seconds"] * 1000
+        for name, ms in per_request.items():
+            stages[name].append(ms)
+    return {
+        "requests": len(results),
+        "errors": len(results) - len(ok) - shed,
+        "shed": shed,
+        "degraded": sum(1 for r in ok if (r["trace"] or {}).get("skipped_nodes")),
+        "throughput_rps": len(ok) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "cache_hits": sum(1 for r in ok if (r["trace"] or {}).get("cache_hit")),
+        "coalesced": sum(1 for r in ok if (r["trace"] or {}).get("coalesced")),
+        "mean_tokens": sum(tokens) / len(tokens) if tokens else 0.0,
+        "stages": {
+            name: {"mean_ms": sum(v) / len(v), "p95_ms": percentile(v, 95), "count": len(v)}
+            for name, v in stages.items()
+        },
+    }
+
+
+def print_report(summary: dict, args):
+    print(f"{summary['requests']} requests, concurrency {args.concurrency}, {args.nodes} nodes, "
+          f"LLM latency {args.llm_latency_ms} ms, embedding latency {args.embed_latency_ms} ms")
+    print(f"errors {summary['errors']}  throughput {summary['throughput_rps']:.1f} req/s  "
+          f"cache hits {summary['cache_hits']}  coalesced {summary['coalesced']}  "
+          f"mean tokens {summary['mean_tokens']:.0f}")
+    print(f"shed {summary['shed']}  degraded {summary['degraded']}")
+    print(f"latency p50 {summary['p50_ms']:.0f} ms  p95 {summary['p95_ms']:.0f} ms  p99 {summary['p99_ms']:.0f} ms")
+    print(f"{'stage':32s} {'mean ms':>9s} {'p95 ms':>9s} {'count':>6s}")
+    for name, s in sorted(summary["stages"].items(), key=lambda kv: -kv[1]["mean_ms"]):
+        print(f"{name:32s} {s['mean_ms']:9.1f} {s['p95_ms']:9.1f} {s['count']:6d}")
+
+
+async def main_async(args) -> dict:
+    set_dummy_azure_env()
+    # imported after the placeholder Azure settings are in place
+    import app as app_module
+    from config import vector_store, server_settings
+    from response_cache import response_cache
+
+    embed_model = install_fakes(args.llm_latency_ms, args.embed_latency_ms, args.jitter_ms, args.dim)
+    start = time.perf_counter()
+    index = build_synthetic_index(args.nodes, embed_model)
+    print(f"synthetic index of {args.nodes} nodes built in {time.perf_counter() - start:.1f}s")
+    vector_store.add(INDEX_NAME, index, "Jeg svarer på spørsmål om helse")
+    vector_store.set_status(INDEX_NAME, "ready", nodes=args.nodes)
+    server_settings.update_status("Server is ready")
+    response_cache.enabled = args.response_cache
+
+    questions = synthetic_questions(args.unique_questions)
+    rng = random.Random(args.seed)
+    payloads = [{
+        "messages": [{"role": "user", "content": rng.choice(questions)}],
+        "vectorIndex": INDEX_NAME,
+        "similarity_top_k": args.top_k,
+        "similarity_cutoff": args.cutoff,
+        "response_mode": args.response_mode,
+        "debug": True,
+        **({"deadline_seconds": args.deadline_seconds} if args.deadline_seconds else {}),
+    } for _ in range(args.requests)]
+
+    client = app_module.app.test_client()
+    if args.warmup:
+        await drive(client, payloads[:args.warmup], min(args.warmup, args.concurrency), "/chat")
+    results, elapsed = await drive(client, payloads, args.concurrency, "/chat")
+    return summarize(results, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=2000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--unique-questions", type=int, default=1000,
+                        help="size of the question pool; fewer unique questions means more cache hits")
+    parser.add_argument("--llm-latency-ms", type=float, default=200)
+    parser.add_argument("--embed-latency-ms", type=float, default=20)
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--cutoff", type=float, default=0.0)
+    parser.add_argument("--response-mode", default="packed")
+    parser.add_argument("--response-cache", action="store_true", help="keep the semantic response cache enabled")
+    parser.add_argument("--deadline-seconds", type=float, help="deadline sent with every request")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the summary to this file")
+    parser.add_argument("--max-p95-ms", type=float, help="exit 1 when p95 latency is above this")
+    parser.add_argument("--min-throughput", type=float, help="exit 1 when throughput (req/s) is below this")
+    args = parser.parse_args()
+
+    summary = asyncio.run(main_async(args))
+    print_report(summary, args)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+    failed = []
+    if summary["errors"]:
+        failed.append(f"{summary['errors']} failed requests")
+    if args.max_p95_ms is not None and summary["p95_ms"] > args.max_p95_ms:
+        failed.append(f"p95 {summary['p95_ms']:.0f} ms > {args.max_p95_ms:.0f} ms")
+    if args.min_throughput is not None and summary["throughput_rps"] < args.min_throughput:
+        failed.append(f"throughput {summary['throughput_rps']:.1f} req/s < {args.min_throughput:.1f} req/s")
+    if failed:
+        print("FAILED: " + "; ".join(failed))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# mock_azure.py
+#
+# Local stand-in for an Azure OpenAI deployment, with injected latency and 429s.
+#   python -m benchmarks.mock_azure [--port 8089] [--latency-ms 300] [--rate-429 0.2] [--retry-after 1]
+#
+# Point the app at it with AZURE_OPENAI_AZURE_ENDPOINT=http://localhost:8089.
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from quart import Quart, request
+
+
+def create_mock_app(latency_ms: float = 300, jitter_ms: float = 100, rate_429: float = 0.0,
+                    retry_after: float = 1.0, tokens_per_minute: int = 0, embed_dim: int = 256) -> Quart:
+    """
+    Chat completions and embeddings in the OpenAI wire format. Answers 429 at random with
+    probability `rate_429`, and always when the `tokens_per_minute` budget is used up.
+    """
+    app = Quart(__name__)
+    app.config["stats"] = stats = {"requests": 0, "throttled": 0}
+    # token bucket refilled continuously, like the deployment quota
+    bucket = {"tokens": float(tokens_per_minute), "updated": time.monotonic()}
+
+    def throttle(tokens):
+        now = time.monotonic()
+        if tokens_per_minute:
+            elapsed = now - bucket["updated"]
+            bucket["tokens"] = min(tokens_per_minute, bucket["tokens"] + elapsed * tokens_per_minute / 60)
+        bucket["updated"] = now
+        over_budget = tokens_per_minute and bucket["tokens"] < tokens
+        if over_budget or random.random() < rate_429:
+            stats["throttled"] += 1
+            body = {"error": {"code": "429", "message": "Requests to the deployment have exceeded the rate limit."}}
+            return body, 429, {"retry-after": str(retry_after), "retry-after-ms": str(int(retry_after * 1000))}
+        bucket["tokens"] -= tokens
+        return None
+
+    async def delay():
+        await asyncio.sleep(max(0.0, latency_ms + random.uniform(-jitter_ms, jitter_ms)) / 1000)
+
+    @app.route("/openai/deployments/<deployment>/chat/completions", methods=["POST"])
+    async def chat_completions(deployment):
+        stats["requests"] += 1
+        body = await request.get_json()
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in body.get("messages", [])) // 4
+        throttled = throttle(prompt_tokens + 50)
+        if throttled:
+            return throttled
+        await delay()
+
+        response_format = body.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            # structured output: fill every property of the schema with text
+            schema = response_format["json_schema"]["schema"]
+            content = json.dumps({name: f"Mock {name}" for name in schema.get("properties", {})})
+        else:
+            content = "Dette er et kort svar. Det er lett å lese."
+        completion_tokens = len(content) // 4
+        return {
+            "id": f"chatcmpl-mock-{stats['requests']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": deployment,
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    @app.route("/openai/deployments/<deployment>/embeddings", methods=["POST"])
+    async def embeddings(deployment):
+        stats["requests"] += 1
+        body = await request.get_json()
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        tokens = sum(len(str(t)) for t in texts) // 4
+        throttled = throttle(tokens)
+        if throttled:
+            return throttled
+        await delay()
+        data = []
+        for i, text in enumerate(texts):
+            rng = random.Random(str(text))
+            data.append({"object": "embedding", "index": i,
+                         "embedding": [rng.uniform(-1, 1) for _ in range(embed_dim)]})
+        return {"object": "list", "data": data, "model": deployment,
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}
+
+    @app.route("/stats", methods=["GET"])
+    async def get_stats():
+        return stats
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--jitter-ms", type=float, default=100)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--tokens-per-minute", type=int, default=0)
+    args = parser.parse_args()
+    app = create_mock_app(args.latency_ms, args.jitter_ms, args.rate_429, args.retry_after, args.tokens_per_minute)
+    app.run(port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+# build_index.py
+#
+# Builds the memory-mapped store of an index (see mmap_vector_store.py) from a directory of
+# articles, incrementally. Every chunk is hashed (sha256 of the text that is embedded); chunks
+# whose hash is in the previous build reuse its embedding, only new or changed chunks are
+# embedded, in large batches sent concurrently, and chunks of removed or edited articles are
+# dropped. The result is what reload_indexes (read_index_from_storage in config.py) loads for the
+# storage directory of the index in VECTOR_INDEX_MAP. Every build is written to a new directory next to the current
+# one and takes its place in one atomic replace of the mmap.current pointer file, so a loader
+# always finds a complete store.
+#
+#   python build_index.py <articles_dir> <storage_dir> [--chunk-size 512] [--batch-size 256]
+#                         [--concurrency 4] [--mock-embeddings]
+#
+# Articles are .md, .txt or .html files. An optional front matter block sets the title and url
+# the answers reference:
+#   ---
+#   title: Snus og graviditet
+#   url: https://www.helsenorge.no/gravid/snus/
+#   ---
+# --mock-embeddings uses the deterministic local embedding of benchmarks/fakes.py, so a build
+# runs offline.
+
+import os
+import re
+import sys
+import json
+import math
+import time
+import uuid
+import shutil
+import asyncio
+import hashlib
+import logging
+import argparse
+from dataclasses import dataclass
+
+import numpy as np
+
+from mmap_vector_store import MMAP_DIRNAME, has_mmap_store, mmap_dir, set_mmap_dir, write_mmap_store
+
+DOCUMENT_EXTENSIONS = (".md", ".txt", ".html", ".htm")
+MANIFEST_FILENAME = "build_manifest.json"
+FRONT_MATTER_PATTERN = re.compile(r"\A---\s*\n(.*?)\n---\s*\n", re.S)
+HTML_TITLE_PATTERN = re.compile(r"<title>(.*?)</title>", re.S | re.I)
+HTML_TAG_PATTERN = re.compile(r"<(script|style)\b.*?</\1>|<[^>]+>", re.S | re.I)
+# metadata kept out of the embedded text, the url and source path do not describe the content
+EXCLUDED_EMBED_METADATA = ["url", "source"]
+
+
+@dataclass
+class BuildReport:
+    documents: int = 0
+    chunks: int = 0
+    embedded: int = 0
+    reused: int = 0
+    deleted: int = 0
+    embedding_calls: int = 0
+    full_rebuild_calls: int = 0
+    seconds: float = 0.0
+
+    @property
+    def chunks_per_second(self) -> float:
+        return self.chunks / self.seconds if self.seconds else 0.0
+
+    def summary(self) -> str:
+        saved = self.full_rebuild_calls - self.embedding_calls
+        return (f"{self.documents} documents, {self.chunks} chunks in {self.seconds:.2f}s "
+                f"({self.chunks_per_second:.0f} chunks/s): {self.embedded} embedded, {self.reused} reused, "
+                f"{self.deleted} deleted; {self.embedding_calls} embedding calls, "
+                f"{saved} saved of {self.full_rebuild_calls} for a full rebuild")
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def parse_document(path: str, text: str) -> tuple[dict, str]:
+    """Title and url from the front matter (or the HTML title / first heading), and the body."""
+    metadata = {}
+    match = FRONT_MATTER_PATTERN.match(text)
+    if match:
+        for line in match.group(1).splitlines():
+            key, _, value = line.partition(":")
+            if value.strip():
+                metadata[key.strip().lower()] = value.strip()
+        text = text[match.end():]
+    if path.endswith((".html", ".htm")):
+        title = HTML_TITLE_PATTERN.search(text)
+        if title and "title" not in metadata:
+            metadata["title"] = title.group(1).strip()
+        text = re.sub(r"\n\s*\n+", "\n\n", HTML_TAG_PATTERN.sub("", text))
+    if "title" not in metadata:
+        heading = re.search(r"^#+\s*(.+)$", text, re.M)
+        metadata["title"] = heading.group(1).strip() if heading else os.path.splitext(os.path.basename(path))[0]
+    return metadata, text.strip()
+
+
+def read_documents(source_dir: str) -> list:
+    from llama_index.core import Document
+
+    documents = []
+    for root, _, files in os.walk(source_dir):
+        for filename in sorted(files):
+            if not filename.lower().endswith(DOCUMENT_EXTENSIONS):
+                continue
+            path = os.path.join(root, filename)
+            with open(path, encoding="utf-8") as f:
+                metadata, body = parse_document(path.lower(), f.read())
+            if not body:
+                continue
+            source = os.path.relpath(path, source_dir)
+            documents.append(Document(
+                id_=source,
+                text=body,
+                metadata={"title": metadata["title"], "url": metadata.get("url", ""), "source": source},
+                excluded_embed_metadata_keys=EXCLUDED_EMBED_METADATA,
+                excluded_llm_metadata_keys=["source"],
+            ))
+    documents.sort(key=lambda d: d.doc_id)
+    return documents
+
+
+def chunk_documents(documents: list, chunk_size: int, chunk_overlap: int) -> tuple[list, list[str]]:
+    """Chunks with stable ids, and the hash of the embedded text of every chunk."""
+    from llama_index.core.node_parser import SentenceSplitter
+    from llama_index.core.schema import MetadataMode
+
+    splitter = SentenceSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    nodes, hashes, seen = [], [], set()
+    for node in splitter.get_nodes_from_documents(documents):
+        digest = content_hash(node.get_content(metadata_mode=MetadataMode.EMBED))
+        # the same text in the same article again adds nothing
+        node_id = content_hash(f"{node.ref_doc_id}\n{digest}")[:32]
+        if node_id in seen:
+            continue
+        seen.add(node_id)
+        node.id_ = node_id
+        nodes.append(node)
+        hashes.append(digest)
+    return nodes, hashes
+
+
+def embed_model_id(embed_model) -> str:
+    """Embeddings are only reused from a build with the same model."""
+    name = getattr(embed_model, "model_name", None) or getattr(embed_model, "model", None) or ""
+    dim = getattr(embed_model, "dim", None) or getattr(embed_model, "embed_dim", None) or ""
+    return f"{type(embed_model).__name__}:{name}:{dim}"
+
+
+def load_previous_embeddings(storage: str, model_id: str) -> dict[str, np.ndarray]:
+    """Embedding of every chunk hash of the previous build, empty if there is none to reuse."""
+    out_dir = mmap_dir(storage)
+    manifest_path = os.path.join(out_dir, MANIFEST_FILENAME)
+    if not has_mmap_store(storage) or not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("embed_model") != model_id:
+        logging.info(f"Previous build used {manifest.get('embed_model')}, re-embedding everything with {model_id}")
+        return {}
+    embeddings = np.load(os.path.join(out_dir, "embeddings.npy"), mmap_mode="r")
+    return {digest: np.array(embeddings[row]) for row, digest in enumerate(manifest["hashes"])}
+
+
+async def embed_texts(texts: list[str], embed_model, batch_size: int, concurrency: int) -> list[list[float]]:
+    """Embed in batches of `batch_size` texts, `concurrency` batches in flight at a time."""
+    semaphore = asyncio.Semaphore(concurrency)
+    done = 0
+
+    async def embed_batch(batch):
+        nonlocal done
+        async with semaphore:
+            embeddings = await embed_model.aget_text_embedding_batch(batch)
+        done += len(batch)
+        logging.info(f"Embedded {done}/{len(texts)} chunks")
+        return embeddings
+
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    results = await asyncio.gather(*(embed_batch(batch) for batch in batches))
+    return [embedding for batch in results for embedding in batch]
+
+
+def replace_store(storage: str, nodes: list, embeddings: np.ndarray, manifest: dict) -> str:
+    """Write the new build to its own directory and make it the current store; returns its path."""
+    os.makedirs(storage, exist_ok=True)
+    previous = os.path.basename(mmap_dir(storage))
+    name = f"{MMAP_DIRNAME}.{time.strftime('%Y%m%d%H%M%S')}.{uuid.uuid4().hex[:8]}"
+    out_dir = os.path.join(storage, name)
+    write_mmap_store(out_dir, nodes, embeddings)
+    with open(os.path.join(out_dir, MANIFEST_FILENAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    set_mmap_dir(storage, name)
+
+    # the previous build stays for a server that has not reloaded yet, older ones are removed
+    for entry in os.listdir(storage):
+        path = os.path.join(storage, entry)
+        is_build = entry == MMAP_DIRNAME or entry.startswith(f"{MMAP_DIRNAME}.")
+        if is_build and entry not in (name, previous) and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+    return out_dir
+
+
+async def build_index(
+    source_dir: str,
+    storage: str,
+    embed_model=None,
+    chunk_size: int = 512,
+    chunk_overlap: int = 50,
+    batch_size: int = 256,
+    concurrency: int = 4,
+) -> BuildReport:
+    from llama_index.core import Settings
+    from llama_index.core.schema import MetadataMode
+
+    embed_model = embed_model or Settings.embed_model
+    # one request per batch, the model would otherwise split it again
+    if hasattr(embed_model, "embed_batch_size"):
+        embed_model.embed_batch_size = batch_size
+    start = time.perf_counter()
+    report = BuildReport()
+
+    documents = read_documents(source_dir)
+    nodes, hashes = chunk_documents(documents, chunk_size, chunk_overlap)
+    report.documents, report.chunks = len(documents), len(nodes)
+    report.full_rebuild_calls = math.ceil(len(nodes) / batch_size)
+
+    model_id = embed_model_id(embed_model)
+    previous = load_previous_embeddings(storage, model_id)
+    report.deleted = len(set(previous) - set(hashes))
+
+    # each new text once, even when several chunks share it
+    missing = {}
+    for node, digest in zip(nodes, hashes):
+        if digest not in previous and digest not in missing:
+            missing[digest] = node.get_content(metadata_mode=MetadataMode.EMBED)
+    report.reused = sum(1 for digest in hashes if digest in previous)
+    report.embedded = len(nodes) - report.reused
+    report.embedding_calls = math.ceil(len(missing) / batch_size)
+
+    new_embeddings = await embed_texts(list(missing.values()), embed_model, batch_size, concurrency)
+    by_hash = {**previous, **dict(zip(missing, (np.asarray(e, dtype=np.float32) for e in new_embeddings)))}
+    embeddings = (np.stack([by_hash[digest] for digest in hashes]) if nodes
+                  else np.zeros((0, 0), dtype=np.float32))
+
+    replace_store(storage, nodes, embeddings, {
+        "embed_model": model_id,
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "hashes": hashes,
+    })
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or update the memory-mapped store of an index.")
+    parser.add_argument("source_dir", help="directory of .md, .txt or .html articles")
+    parser.add_argument("storage", help="storage directory of the index, as in VECTOR_INDEX_MAP")
+    parser.add_argument("--chunk-size", type=int, default=512, help="tokens per chunk")
+    parser.add_argument("--chunk-overlap", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=256, help="chunks per embedding request")
+    parser.add_argument("--concurrency", type=int, default=4, help="embedding requests in flight")
+    parser.add_argument("--mock-embeddings", action="store_true", help="deterministic local embeddings, no network")
+    parser.add_argument("--mock-latency-ms", type=float, default=0.0, help="latency per mock embedding request")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    if not os.path.isdir(args.source_dir):
+        print(f"not a directory: {args.source_dir}")
+        sys.exit(1)
+    embed_model = None
+    if args.mock_embeddings:
+        from benchmarks.fakes import FakeEmbedding
+        embed_model = FakeEmbedding(latency_ms=args.mock_latency_ms)
+
+    report = asyncio.run(build_index(
+        args.source_dir, args.storage, embed_model,
+        chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap,
+        batch_size=args.batch_size, concurrency=args.concurrency,
+    ))
+    logging.info(report.summary())
+
+
+if __name__ == "__main__":
+    main()
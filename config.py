@@ -4,14 +4,17 @@ import os
 import logging
 import time
 import json
+import threading
+from contextlib import contextmanager
 from dotenv import load_dotenv
-from langchain_openai import AzureChatOpenAI
-from llama_index.core import (StorageContext, load_index_from_storage)
 from collections import namedtuple
 import asyncio
 
+# LlamaIndex, LangChain and the Azure client are imported where they are first used,
+# so importing app.py stays cheap and Hypercorn binds before the heavy work starts
+
 # define the namedtuple at module scope
-IndexObject = namedtuple('IndexObject', ['name', 'index', 'description'])
+IndexObject = namedtuple('IndexObject', ['name', 'index', 'description', 'version'], defaults=[0])
 
 
 def RunningLocally():
@@ -23,15 +26,30 @@ def RunningLocally():
 
 # Class definitions
 class CustomError(Exception):
-    def __init__(self, message, code):
+    def __init__(self, message, code, retry_after=None):
         super().__init__(message)
         self.code = code
+        self.retry_after = retry_after  # seconds, sent as Retry-After by the routes
 
 class ServerSettings:
     def __init__(self):
         self.indexes_loaded = False
         self.status = "Server is not ready"
-        self.llm = None
+        self._llm = None
+        self._llm_factory = None
+        self._llm_lock = threading.Lock()
+
+    @property
+    def llm(self):
+        """The LLM client, built by the factory on first use (normally in the warm-up step)."""
+        if self._llm is None and self._llm_factory is not None:
+            with self._llm_lock:
+                if self._llm is None:
+                    self._llm = self._llm_factory()
+        return self._llm
+
+    def set_llm_factory(self, factory):
+        self._llm_factory = factory
 
     def update_status(self, status):
         self.status = status
@@ -39,7 +57,7 @@ class ServerSettings:
             self.indexes_loaded = True
 
     def set_llm(self, llm):
-        self.llm = llm
+        self._llm = llm
 
     def get_status(self):
         return self.status, self.indexes_loaded
@@ -54,33 +72,118 @@ server_settings = ServerSettings()
 
 
 class VectorIndexStore:
-    """Singleton store for all loaded vector indexes."""
+    """
+    Singleton store for all loaded vector indexes.
+    Entries live in a dict that is replaced as a whole on every change, so readers always
+    see a consistent version without locking. Requests lease the entry they work on;
+    a replaced entry is kept as retired until its last lease is released.
+    """
     def __init__(self):
         self.indexes_loaded = False
-        self.objects: list[IndexObject] = []
+        self.entries: dict[str, IndexObject] = {}
+        self.version = 0
+        # per-index load state: {"state": "loading" | "ready" | "failed" | "missing", ...details}
+        self.status: dict[str, dict] = {}
+        # version -> number of requests using it, and replaced versions still in use
+        self.in_flight: dict[int, int] = {}
+        self.retired: dict[int, IndexObject] = {}
+        # indexes are loaded concurrently from worker threads
+        self._lock = threading.Lock()
+
+    def next_version(self):
+        """Reserve a version number, e.g. to prepare caches before the swap."""
+        with self._lock:
+            self.version += 1
+            return self.version
+
+    def swap(self, name, index_obj, description, version=None):
+        """
+        Publish a new version of an index, atomically replacing the current one.
+        Returns (new entry, previous entry or None).
+        """
+        if version is None:
+            version = self.next_version()
+        with self._lock:
+            new_entry = IndexObject(name, index_obj, description, version)
+            old_entry = self.entries.get(name)
+            entries = dict(self.entries)
+            entries[name] = new_entry
+            self.entries = entries
+            if old_entry is not None and self.in_flight.get(old_entry.version):
+                self.retired[old_entry.version] = old_entry
+        if old_entry is not None:
+            logging.info(f"Index '{name}' swapped from version {old_entry.version} to {new_entry.version}")
+        return new_entry, old_entry
 
     def add(self, name, index_obj, description):
-        """Append a new IndexObject."""
-        self.objects.append(IndexObject(name, index_obj, description))
+        """Add (or replace) an index."""
+        return self.swap(name, index_obj, description)[0]
+
+    def set_status(self, name, state, **details):
+        """Record the load state of an index together with details like load time and size."""
+        with self._lock:
+            self.status[name] = {"state": state, **details}
+
+    def update_status(self, name, **details):
+        """Update details of the current status of an index."""
+        with self._lock:
+            self.status[name] = {**self.status.get(name, {}), **details}
+
+    def get_status(self, name):
+        """Return the load state of an index, or None if it is unknown."""
+        return self.status.get(name, {}).get("state")
 
     def get(self, name):
         """
         Retrieve the IndexObject by name.
         Returns the namedtuple or None if not found.
         """
-        for entry in self.objects:
-            if entry.name == name:
-                return entry
-        return None
+        return self.entries.get(name)
+
+    @contextmanager
+    def lease(self, name):
+        """Pin the current version of an index for the duration of a request. Yields None if not found."""
+        with self._lock:
+            entry = self.entries.get(name)
+            if entry is not None:
+                self.in_flight[entry.version] = self.in_flight.get(entry.version, 0) + 1
+        try:
+            yield entry
+        finally:
+            if entry is not None:
+                self._release(entry)
+
+    def _release(self, entry):
+        with self._lock:
+            remaining = self.in_flight[entry.version] - 1
+            if remaining:
+                self.in_flight[entry.version] = remaining
+                return
+            del self.in_flight[entry.version]
+            drained = self.retired.pop(entry.version, None)
+        if drained is not None:
+            # last reference held by the store, the old index is freed with it
+            logging.info(f"Index '{drained.name}' version {drained.version} drained and released")
 
     def clear(self):
         """Clear all stored indexes."""
-        self.objects.clear()
+        with self._lock:
+            self.entries = {}
+            self.status.clear()
 
     def get_all(self):
         """Return a list of all stored entries."""
-        return list(self.objects)
-    
+        return list(self.entries.values())
+
+    def versions(self):
+        """Current and retired versions with their number of in-flight requests."""
+        with self._lock:
+            current = {e.name: {"version": e.version, "in_flight": self.in_flight.get(e.version, 0)}
+                       for e in self.entries.values()}
+            retired = [{"name": e.name, "version": e.version, "in_flight": self.in_flight.get(e.version, 0)}
+                       for e in self.retired.values()]
+        return {"current": current, "retired": retired}
+
     def __str__(self):
         # Convert object properties to a JSON string
         return json.dumps(self.__dict__, ensure_ascii=False, indent=4, default=str)
@@ -103,19 +206,37 @@ VECTOR_INDEX_MAP = [
 ]
 
 
-LLMGPT4 = AzureChatOpenAI(
-    model=os.getenv('AZURE_OPENAI_MODEL'),
-    deployment_name=os.getenv('AZURE_OPENAI_DEPLOYMENT_NAME'),
-    azure_deployment=os.getenv('AZURE_OPENAI_DEPLOYMENT_NAME'),
-    api_key=os.getenv('AZURE_OPENAI_API_KEY'),
-    azure_endpoint=os.getenv('AZURE_OPENAI_AZURE_ENDPOINT'),
-    api_version=os.getenv('AZURE_OPENAI_API_VERSJON'),
-    temperature=0.0,
-    timeout=120,
-)
+# LLM of the answer synthesis in the query engines: "default" keeps llama_index's Settings.llm,
+# "azure" uses the Azure chat deployment through the same scheduler as the workflow calls
+SYNTHESIS_LLM = os.getenv('SYNTHESIS_LLM', 'default')
 
-server_settings.set_llm(LLMGPT4)
 
+def create_llm():
+    """
+    One pooled Azure client per worker, called through the rate-limit aware scheduler. With
+    SYNTHESIS_LLM=azure the answer synthesis of the query engines goes through it too.
+    """
+    from llama_index.core import Settings
+    from azure_client import create_azure_chat_model, create_scheduled_llm, create_synthesis_llm
+    llm = create_scheduled_llm(create_azure_chat_model())
+    if SYNTHESIS_LLM == "azure":
+        Settings.llm = create_synthesis_llm(llm)
+        logging.info("Answer synthesis uses the Azure chat deployment through the scheduler")
+    elif SYNTHESIS_LLM != "default":
+        raise ValueError(f"SYNTHESIS_LLM must be 'default' or 'azure', not {SYNTHESIS_LLM!r}")
+    return llm
+
+
+server_settings.set_llm_factory(create_llm)
+
+# upper bound on optimizer workflows running at the same time in one worker;
+# further /chat requests wait for a free slot instead of piling up Azure calls
+MAX_CONCURRENT_CHATS = int(os.getenv('MAX_CONCURRENT_CHATS', '32'))
+
+# the readability loop stops after this many rewrites, or when the request has run
+# this long, and then keeps the most readable answer produced so far
+MAX_READABILITY_REWRITES = int(os.getenv('MAX_READABILITY_REWRITES', '2'))
+READABILITY_DEADLINE_SECONDS = float(os.getenv('READABILITY_DEADLINE_SECONDS', '45'))
 
 
 def init_env_and_logging():
@@ -133,16 +254,10 @@ async def async_read_indexes():
     logging.info(f"Current Server Status: {status}")
 
     try:
-        # clear any previous run
-        vector_store.clear()
-        
-        # offload the sync work
-        found_any = await asyncio.to_thread(read_all_indexes_from_storage, VECTOR_INDEX_MAP)
-
+        found_any = await reload_indexes()
 
         if found_any:
             logging.info("Indexes successfully read from storage.")
-            server_settings.update_status("Server is ready")
         else:
             logging.info("Indexes not successfully read from storage.")
             server_settings.update_status("Server is not ready")
@@ -157,28 +272,144 @@ async def async_read_indexes():
         vector_store.indexes_loaded = False
 
 
-def read_all_indexes_from_storage(vector_map):
-    """Load all indexes into the singleton store."""
-    found_any = False
+# one reload at a time; a second trigger waits and then reloads again
+_reload_lock = asyncio.Lock()
 
-    for item in vector_map:
-        start = time.time()
-        name = item['name']
-        storage = item['storage']
-        desc = item['description']
-        logging.info("-------------------------------")
 
-        if os.path.exists(storage):
+async def reload_indexes(names=None):
+    """
+    (Re)load the indexes of VECTOR_INDEX_MAP (or only the given names) in the background.
+    Indexes already being served stay available until their new version is swapped in;
+    in-flight requests finish on the version they started with.
+    Returns True if at least one index was loaded.
+    """
+    items = [item for item in VECTOR_INDEX_MAP if names is None or item['name'] in names]
+
+    async def load(item):
+        # offload the sync work, one thread per index
+        ready = await asyncio.to_thread(read_index_from_storage, item)
+        if ready:
+            # serve this index right away, the others may still be loading
+            server_settings.update_status("Server is ready")
+            vector_store.indexes_loaded = True
+        return ready
+
+    async with _reload_lock:
+        results = await asyncio.gather(*(load(item) for item in items))
+    return any(results)
+
+
+def storage_mtime(storage):
+    """Latest modification time of the files of an index directory, 0 if it does not exist."""
+    return max(
+        (os.path.getmtime(os.path.join(root, f)) for root, _, files in os.walk(storage) for f in files),
+        default=0.0,
+    )
+
+
+async def watch_index_storage(interval):
+    """Reload an index whenever the files in its storage directory change."""
+    seen = {item['name']: storage_mtime(item['storage']) for item in VECTOR_INDEX_MAP}
+    while True:
+        await asyncio.sleep(interval)
+        changed = []
+        for item in VECTOR_INDEX_MAP:
+            mtime = await asyncio.to_thread(storage_mtime, item['storage'])
+            if mtime != seen.get(item['name']):
+                seen[item['name']] = mtime
+                changed.append(item['name'])
+        if changed:
+            logging.info(f"Index storage changed for {changed}, reloading")
+            try:
+                await reload_indexes(changed)
+            except Exception as e:
+                logging.error(f"Reload after storage change failed: {e}")
+
+
+def storage_size_bytes(storage):
+    return sum(
+        os.path.getsize(os.path.join(root, f))
+        for root, _, files in os.walk(storage)
+        for f in files
+    )
+
+
+def index_node_count(idx):
+    store = idx.vector_store
+    # the mmap store knows its size, JSON indexes list their nodes in the index struct
+    return len(store) if hasattr(store, "__len__") else len(idx.index_struct.nodes_dict)
+
+
+def read_index_from_storage(item):
+    """
+    Load one index and swap it into the singleton store, recording its status.
+    Returns True when the new version is being served.
+    """
+    from llama_index.core import StorageContext, load_index_from_storage
+    from mmap_vector_store import has_mmap_store, load_mmap_index
+    from query_engine_cache import query_engine_cache
+    from response_cache import response_cache
+    from vector_search import NUMPY_RETRIEVER, get_embedding_matrix
+    from keyword_index import get_keyword_index
+
+    start = time.time()
+    name = item['name']
+    storage = item['storage']
+    desc = item['description']
+    serving = vector_store.get(name) is not None
+    if serving:
+        # keep serving the current version while the new one is built
+        vector_store.update_status(name, reloading=True)
+    else:
+        vector_store.set_status(name, "loading")
+
+    try:
+        idx = None
+        if has_mmap_store(storage):
+            # converted with mmap_vector_store.py, preferred over the JSON stores
+            logging.info(f"Loading memory-mapped index '{name}' from {storage}")
+            idx = load_mmap_index(storage)
+        elif os.path.exists(storage):
             logging.info(f"Loading index '{name}' from {storage}")
             storage_ctx = StorageContext.from_defaults(persist_dir=storage)
             idx = load_index_from_storage(storage_ctx)
-            # correctly add to the store
-            vector_store.add(name, idx, desc)
-            found_any = True
         else:
             logging.warning(f"Index directory not found: {storage}")
+            if serving:
+                vector_store.update_status(name, reloading=False, reload_error=f"not found: {storage}")
+            else:
+                vector_store.set_status(name, "missing", storage=storage)
+            return False
+
+        # prepare the default query engine of the new version before publishing it
+        version = vector_store.next_version()
+        if NUMPY_RETRIEVER:
+            # the keyword index is built here too, whatever the default retrieval mode
+            get_keyword_index(idx, get_embedding_matrix(idx))
+        query_engine_cache.warm(name, idx, version)
+        entry, old_entry = vector_store.swap(name, idx, desc, version)
 
-        elapsed = time.time() - start
-        logging.info(f"Time taken for {name}: {elapsed:.2f}s")
+    except Exception as e:
+        logging.error(f"Failed to read index '{name}' from {storage}: {e}")
+        if serving:
+            vector_store.update_status(name, reloading=False, reload_error=str(e))
+        else:
+            vector_store.set_status(name, "failed", error=str(e), load_seconds=round(time.time() - start, 3))
+        return False
 
-    return found_any
+    if old_entry is not None:
+        # in-flight requests hold their own query engine, new requests must use the new version
+        query_engine_cache.invalidate(name, old_entry.version)
+    response_cache.invalidate(name)
+
+    elapsed = time.time() - start
+    vector_store.set_status(
+        name, "ready",
+        version=entry.version,
+        load_seconds=round(elapsed, 3),
+        loaded_at=time.strftime("%Y-%m-%dT%H:%M:%S"),
+        nodes=index_node_count(idx),
+        size_bytes=storage_size_bytes(storage),
+    )
+    logging.info(f"Time taken for {name}: {elapsed:.2f}s")
+    return True
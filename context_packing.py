@@ -0,0 +1,109 @@
+# context_packing.py
+#
+# Context for the "packed" response mode: the retrieved chunks are deduplicated and packed
+# greedily, in retrieval order, into a fixed token budget. The synthesizer then answers from
+# one prompt of bounded size with a single LLM call, instead of tree_summarize's
+# summarize-then-combine rounds when the chunks do not fit in one prompt.
+
+import os
+import re
+import logging
+import functools
+from typing import List, Optional
+
+from llama_index.core import Settings
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle, TextNode
+
+from metrics import CONTEXT_TOKENS, CONTEXT_CHUNKS_DROPPED
+from tracing import annotate
+
+PACKED_RESPONSE_MODE = "packed"
+# tokens of retrieved context per answer, the prompt template comes on top
+PACKED_CONTEXT_TOKENS = int(os.getenv('PACKED_CONTEXT_TOKENS', '3000'))
+# a chunk whose word 5-grams are mostly in the chunks already packed adds nothing new
+DUPLICATE_OVERLAP = float(os.getenv('PACKED_DUPLICATE_OVERLAP', '0.8'))
+SHINGLE_SIZE = 5
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def count_tokens(text: str) -> int:
+    return len(Settings.tokenizer(text))
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> set:
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) <= size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+@functools.lru_cache(maxsize=4096)
+def chunk_stats(text: str) -> tuple[int, frozenset]:
+    """Token count and shingles of a chunk; popular chunks are retrieved over and over."""
+    return count_tokens(text), frozenset(shingles(text))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    words = text.split()
+    while words and count_tokens(" ".join(words)) > max_tokens:
+        words = words[:int(len(words) * 0.9)]
+    return " ".join(words)
+
+
+class TokenBudgetPostprocessor(BaseNodePostprocessor):
+    """
+    Drops chunks that repeat chunks ranked above them (overlapping splits of one article,
+    the same text in several indexes) and packs the rest, best first, into `token_budget`
+    tokens. A chunk that does not fit is skipped so smaller ones further down can still fill
+    the budget; when not even the best chunk fits, it is truncated.
+    """
+    token_budget: int = PACKED_CONTEXT_TOKENS
+    duplicate_overlap: float = DUPLICATE_OVERLAP
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "TokenBudgetPostprocessor"
+
+    def _postprocess_nodes(
+        self,
+        nodes: List[NodeWithScore],
+        query_bundle: Optional[QueryBundle] = None,
+    ) -> List[NodeWithScore]:
+        packed, seen = [], set()
+        used = duplicates = over_budget = 0
+        for node in nodes:
+            tokens, node_shingles = chunk_stats(node.node.get_content(metadata_mode=MetadataMode.LLM))
+            if node_shingles and len(node_shingles & seen) >= self.duplicate_overlap * len(node_shingles):
+                duplicates += 1
+                continue
+            if used + tokens > self.token_budget:
+                if packed:
+                    over_budget += 1
+                    continue
+                # the best chunk alone is over the budget: keep its beginning
+                text = truncate_to_tokens(node.node.get_content(), self.token_budget)
+                node = NodeWithScore(node=TextNode(text=text, id_=node.node.node_id, metadata=node.node.metadata),
+                                     score=node.score)
+                tokens = count_tokens(node.node.get_content(metadata_mode=MetadataMode.LLM))
+            packed.append(node)
+            seen.update(node_shingles)
+            used += tokens
+
+        CONTEXT_TOKENS.observe(used)
+        CONTEXT_CHUNKS_DROPPED.inc(duplicates, reason="duplicate")
+        CONTEXT_CHUNKS_DROPPED.inc(over_budget, reason="over_budget")
+        annotate(context_tokens=used, context_chunks=len(packed),
+                 context_duplicates=duplicates, context_over_budget=over_budget)
+        logging.info(f"Packed {len(packed)} of {len(nodes)} chunks into {used}/{self.token_budget} tokens "
+                     f"({duplicates} duplicates, {over_budget} over budget)")
+        return packed
+
+    async def _apostprocess_nodes(
+        self,
+        nodes: List[NodeWithScore],
+        query_bundle: Optional[QueryBundle] = None,
+    ) -> List[NodeWithScore]:
+        # a few milliseconds of work, cheaper inline than the worker thread of the default
+        return self._postprocess_nodes(nodes, query_bundle)
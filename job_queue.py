@@ -0,0 +1,209 @@
+# job_queue.py
+#
+# Chats run as background jobs (POST /chat/jobs), so no HTTP connection is held for the
+# whole workflow. Admission and execution are separated: a job is accepted into a bounded
+# queue (429 with Retry-After when it is full) and a fixed pool of workers runs the queued
+# jobs. Clients poll GET /chat/jobs/<id> or wait on its event stream; finished jobs are
+# kept for JOB_RESULT_TTL_SECONDS.
+#
+# Jobs, results and the queue live in the memory of one process: the status and event requests
+# of a job must reach the process that accepted it. The job queue therefore needs a single
+# worker process (hypercorn --workers 1, one replica, or sticky routing by job id in front of
+# several); with more workers set JOB_WORKERS=0, which disables /chat/jobs. start() takes an
+# exclusive lock on JOB_LOCK_FILE and refuses to start when another process on the host holds it.
+
+import os
+import math
+import fcntl
+import tempfile
+import time
+import uuid
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+from metrics import JOBS_TOTAL, JOB_QUEUE_WAIT_SECONDS
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+JOB_LOCK_FILE = os.getenv('JOB_LOCK_FILE', os.path.join(tempfile.gettempdir(), "helsesvar-chat-jobs.lock"))
+
+
+class JobQueueFull(Exception):
+    """Raised when no more jobs can be queued; surfaced as 429 with Retry-After by the routes."""
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.code = 429
+        self.retry_after = retry_after
+
+
+@dataclass
+class Job:
+    run: Callable[[], Awaitable[Any]]
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = QUEUED
+    created: float = field(default_factory=time.time)
+    started: float | None = None
+    finished: float | None = None
+    result: Any = None
+    error: str | None = None
+    code: int | None = None
+    task: asyncio.Task | None = None
+    done: asyncio.Event = field(default_factory=asyncio.Event)
+
+    def to_dict(self) -> dict:
+        data = {
+            "job_id": self.id,
+            "status": self.status,
+            "created_at": self.created,
+            "started_at": self.started,
+            "finished_at": self.finished,
+        }
+        if self.status == DONE and isinstance(self.result, dict):
+            data.update(self.result)
+        if self.status == FAILED:
+            data.update(error=self.error, code=self.code)
+        return data
+
+
+class JobManager:
+    """
+    Bounded job queue drained by `workers` worker tasks, with cancellation and result expiry.
+    0 workers disables it. One process per host may run it, see the module header.
+    """
+    def __init__(self, workers: int = 8, max_queued: int = 100, result_ttl: float = 600,
+                 lock_file: str = JOB_LOCK_FILE):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.result_ttl = result_ttl
+        self.lock_file = lock_file
+        self.jobs: dict[str, Job] = {}
+        self._queue: asyncio.Queue | None = None
+        self._worker_tasks: list[asyncio.Task] = []
+        self._lock = None
+        # moving average of the job run time, for the Retry-After of a rejected job
+        self._average_seconds = 5.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    def _acquire_lock(self):
+        """Refuse to run in a second process: its jobs would be invisible to the first one's routes."""
+        lock = open(self.lock_file, "w")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            raise RuntimeError(f"Another process holds {self.lock_file}: /chat/jobs keeps its jobs in one "
+                               f"process, run a single worker or set JOB_WORKERS=0") from None
+        self._lock = lock
+
+    def start(self):
+        """Start the workers on the running event loop; called by the first submit at the latest."""
+        if self._queue is None and self.enabled:
+            self._acquire_lock()
+            self._queue = asyncio.Queue(self.max_queued)
+            self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+            logging.info(f"Job queue started: {self.workers} workers, at most {self.max_queued} queued jobs")
+
+    async def stop(self):
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._queue, self._worker_tasks = None, []
+        if self._lock is not None:
+            self._lock.close()  # releases the flock
+            self._lock = None
+
+    def submit(self, run: Callable[[], Awaitable[Any]]) -> Job:
+        """Queue a job running `run()`, or raise JobQueueFull."""
+        self.start()
+        self.expire()
+        if self._queue.full():
+            JOBS_TOTAL.inc(status="rejected")
+            # roughly when a worker will have taken the oldest queued jobs
+            retry_after = math.ceil(self._average_seconds * self._queue.qsize() / self.workers)
+            raise JobQueueFull(f"Too many queued chats ({self._queue.qsize()}), please try again later.",
+                               retry_after=max(1, retry_after))
+        job = Job(run)
+        self.jobs[job.id] = job
+        self._queue.put_nowait(job)
+        JOBS_TOTAL.inc(status="submitted")
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        self.expire()
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Job | None:
+        """Cancel a queued or running job; a finished job is returned unchanged."""
+        job = self.get(job_id)
+        if job is None or job.status in FINISHED:
+            return job
+        if job.status == RUNNING and job.task is not None:
+            job.task.cancel()
+        # a queued job stays in the queue and is skipped by the worker that takes it
+        self._finish(job, CANCELLED)
+        return job
+
+    def position(self, job: Job) -> int:
+        """Number of queued jobs ahead of this one."""
+        return sum(1 for j in self.jobs.values() if j.status == QUEUED and j.created < job.created)
+
+    def expire(self):
+        """Forget finished jobs older than the result TTL."""
+        limit = time.time() - self.result_ttl
+        for job_id in [i for i, j in self.jobs.items() if j.status in FINISHED and j.finished < limit]:
+            del self.jobs[job_id]
+
+    def stats(self) -> dict:
+        counts = {status: 0 for status in (QUEUED, RUNNING, DONE, FAILED, CANCELLED)}
+        for job in self.jobs.values():
+            counts[job.status] += 1
+        return {"workers": self.workers, "max_queued": self.max_queued, **counts}
+
+    def _finish(self, job: Job, status: str):
+        job.status = status
+        job.finished = time.time()
+        job.done.set()
+        JOBS_TOTAL.inc(status=status)
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                if job.status != QUEUED:
+                    continue  # cancelled while queued
+                job.status = RUNNING
+                job.started = time.time()
+                JOB_QUEUE_WAIT_SECONDS.observe(job.started - job.created)
+                job.task = asyncio.ensure_future(job.run())
+                try:
+                    job.result = await job.task
+                except asyncio.CancelledError:
+                    if job.status != CANCELLED:
+                        raise  # the worker itself is being stopped
+                    continue
+                except Exception as e:
+                    logging.error(f"Job {job.id} failed: {e}", exc_info=True)
+                    job.error, job.code = str(e), getattr(e, "code", 500)
+                    status = FAILED
+                else:
+                    status = DONE
+                if job.status == RUNNING:  # not cancelled just as it finished
+                    self._finish(job, status)
+                self._average_seconds = 0.8 * self._average_seconds + 0.2 * (job.finished - job.started)
+            finally:
+                self._queue.task_done()
+
+
+# instantiate the singleton
+job_manager = JobManager(
+    workers=int(os.getenv('JOB_WORKERS', '8')),
+    max_queued=int(os.getenv('JOB_QUEUE_MAX', '100')),
+    result_ttl=float(os.getenv('JOB_RESULT_TTL_SECONDS', '600')),
+)
@@ -0,0 +1,225 @@
+# keyword_index.py
+#
+# BM25 keyword search next to the vector index, for short keyword-like questions
+# ("snus gravid", "p-piller bivirkninger") where an exact term match matters more than
+# the embedding. The inverted index is built once when an index is loaded; a query
+# only adds precomputed BM25 weights of its terms into one score array.
+# HybridRetriever ranks by a mix of the cosine similarity and the normalized BM25 score;
+# a node's score blends its cosine similarity with its keyword coverage when the node matches
+# several query terms, so an exact multi-term match can lift a node over similarity_cutoff.
+
+import os
+import re
+import time
+import logging
+import threading
+import weakref
+from collections import Counter, defaultdict
+from typing import List
+
+import numpy as np
+from llama_index.core import Settings, VectorStoreIndex
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle
+
+from vector_search import EmbeddingMatrix, normalize_query
+
+# share of the BM25 score in the hybrid ranking
+HYBRID_KEYWORD_WEIGHT = float(os.getenv('HYBRID_KEYWORD_WEIGHT', '0.3'))
+# keyword coverage counts toward a node's score only when it matches this many distinct query
+# terms; one term, however common, says too little to pass the similarity cutoff
+HYBRID_MIN_MATCHED_TERMS = int(os.getenv('HYBRID_MIN_MATCHED_TERMS', '2'))
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# words, numbers and hyphenated compounds like "p-piller" or "covid-19"
+TOKEN_PATTERN = re.compile(r"[0-9a-zæøåäöüé]+(?:-[0-9a-zæøåäöüé]+)*")
+
+NORWEGIAN_STOPWORDS = frozenset("""
+alle at av bare begge ble blei bli blir blitt både da de deg dei deim deira deires dem den denne der dere deres
+det dette di din disse ditt du dykk dykkar då eg ein eit eitt eller elles en enn er et ett etter for fordi fra
+før ha hadde han hans har hennar henne hennes her hjå ho hoe honom hoss hossen hun hva hvem hver hvilke hvilken
+hvis hvor hvordan hvorfor i ikke ikkje ingen ingi inkje inn inni ja jeg kan kom korleis korso kun kunne kva kvar
+kvarhelst kven kvi kvifor man mange me med medan meg meget mellom men mi min mine mitt mot mykje ned no noe noen
+noka noko nokon nokor nokre nå når og også om opp oss over på samme seg selv si sia sidan siden sin sine sitt
+sjøl skal skulle slik so som somme somt så sånn til um upp ut uten var vart varte ved vere verte vi vil ville
+vore vors vort vår være vært å
+""".split())
+
+# inflection endings, longest first; a stem keeps at least three letters
+SUFFIXES = sorted("""
+hetene hetens heten heter endes ende edes enes ene ane ande ens ers ets het ast ert en ar er et as es e a
+""".split(), key=len, reverse=True)
+
+
+def stem(word: str) -> str:
+    """Light Norwegian stemming: "bivirkningene" and "bivirkninger" both become "bivirkning"."""
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased, stemmed terms without stopwords; a compound also yields its parts."""
+    terms = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        parts = token.split("-")
+        for word in ([token] + parts if len(parts) > 1 else parts):
+            if len(word) > 1 and word not in NORWEGIAN_STOPWORDS:
+                terms.append(stem(word))
+    return terms
+
+
+def node_text(node) -> str:
+    return f"{node.metadata.get('title', '')}\n{node.get_content(metadata_mode=MetadataMode.NONE)}"
+
+
+class KeywordIndex:
+    """
+    Inverted index over the rows of an EmbeddingMatrix. For every term the rows containing it
+    and their BM25 weights (idf included) are precomputed, so a query is a few array additions.
+    """
+    def __init__(self, postings: dict, num_rows: int, idf: dict):
+        self.postings = postings
+        self.num_rows = num_rows
+        self.idf = idf
+        # idf of a term no row contains
+        self.missing_idf = float(np.log(1.0 + (num_rows + 0.5) / 0.5))
+
+    def __len__(self):
+        return self.num_rows
+
+    @classmethod
+    def build(cls, texts: List[str], k1: float = BM25_K1, b: float = BM25_B) -> "KeywordIndex":
+        term_rows = defaultdict(list)
+        term_counts = defaultdict(list)
+        lengths = np.zeros(len(texts), dtype=np.float32)
+        for row, text in enumerate(texts):
+            terms = tokenize(text)
+            lengths[row] = len(terms)
+            for term, count in Counter(terms).items():
+                term_rows[term].append(row)
+                term_counts[term].append(count)
+
+        num_rows = len(texts)
+        average_length = float(lengths.mean()) if num_rows else 0.0
+        postings, idfs = {}, {}
+        for term, rows in term_rows.items():
+            rows = np.asarray(rows, dtype=np.int32)
+            tf = np.asarray(term_counts[term], dtype=np.float32)
+            idf = np.log(1.0 + (num_rows - len(rows) + 0.5) / (len(rows) + 0.5))
+            norm = k1 * (1.0 - b + b * lengths[rows] / (average_length or 1.0))
+            postings[term] = (rows, (idf * tf * (k1 + 1.0) / (tf + norm)).astype(np.float32))
+            idfs[term] = float(idf)
+        return cls(postings, num_rows, idfs)
+
+    @classmethod
+    def from_embedding_matrix(cls, embedding_matrix: EmbeddingMatrix) -> "KeywordIndex":
+        start = time.perf_counter()
+        keyword_index = cls.build([node_text(embedding_matrix.get_node(row)) for row in range(len(embedding_matrix))])
+        logging.info(f"Keyword index built: {len(keyword_index.postings)} terms over {keyword_index.num_rows} nodes "
+                     f"in {time.perf_counter() - start:.2f}s")
+        return keyword_index
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every row for the query."""
+        scores = np.zeros(self.num_rows, dtype=np.float32)
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if posting is not None:
+                scores[posting[0]] += posting[1]
+        return scores
+
+    def coverage(self, query: str, min_matched_terms: int = 1) -> np.ndarray:
+        """
+        Share of the query's idf weight each row contains: 1.0 when a row has every query term,
+        0.0 for rows matching fewer than min_matched_terms distinct terms. Unlike the BM25 score it
+        does not depend on the other rows, so it can be blended with the cosine similarity.
+        """
+        coverage = np.zeros(self.num_rows, dtype=np.float32)
+        matched = np.zeros(self.num_rows, dtype=np.int32)
+        total = 0.0
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term, self.missing_idf)
+            total += idf
+            posting = self.postings.get(term)
+            if posting is not None:
+                coverage[posting[0]] += idf
+                matched[posting[0]] += 1
+        coverage[matched < min_matched_terms] = 0.0
+        return coverage / total if total else coverage
+
+
+_keyword_indexes = weakref.WeakKeyDictionary()
+_keyword_indexes_lock = threading.Lock()
+
+
+def get_keyword_index(index: VectorStoreIndex, embedding_matrix: EmbeddingMatrix) -> KeywordIndex:
+    """Build the keyword index of an index once; read_index_from_storage does it at load time."""
+    with _keyword_indexes_lock:
+        keyword_index = _keyword_indexes.get(index)
+        if keyword_index is None:
+            keyword_index = KeywordIndex.from_embedding_matrix(embedding_matrix)
+            _keyword_indexes[index] = keyword_index
+        return keyword_index
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Top-k by (1 - w) * cosine + w * BM25 / max BM25. A node's score is its cosine similarity,
+    or (1 - w) * cosine + w * keyword coverage when that is higher and the node matches at least
+    HYBRID_MIN_MATCHED_TERMS query terms. similarity_cutoff applies to the score, so keyword
+    evidence lifts a node that is nearly close enough, and a single term never passes on its own.
+    """
+    def __init__(
+        self,
+        embedding_matrix: EmbeddingMatrix,
+        keyword_index: KeywordIndex,
+        similarity_top_k: int = 10,
+        similarity_cutoff: float | None = None,
+        keyword_weight: float = HYBRID_KEYWORD_WEIGHT,
+        embed_model=None,
+        **kwargs
+    ):
+        super().__init__(**kwargs)
+        self.embedding_matrix = embedding_matrix
+        self.keyword_index = keyword_index
+        self.similarity_top_k = similarity_top_k
+        self.similarity_cutoff = similarity_cutoff
+        self.keyword_weight = keyword_weight
+        self.embed_model = embed_model or Settings.embed_model
+
+    def _search(self, query: str, embedding) -> List[NodeWithScore]:
+        cosine = self.embedding_matrix.matrix @ normalize_query(embedding)
+        keyword = self.keyword_index.scores(query)
+        best_keyword = float(keyword.max()) if keyword.size else 0.0
+        combined = (1.0 - self.keyword_weight) * cosine
+        if best_keyword > 0:
+            combined += self.keyword_weight * keyword / best_keyword
+
+        coverage = self.keyword_index.coverage(query, HYBRID_MIN_MATCHED_TERMS)
+        relevance = np.maximum(cosine, (1.0 - self.keyword_weight) * cosine + self.keyword_weight * coverage)
+        candidates = (np.flatnonzero(relevance >= self.similarity_cutoff)
+                      if self.similarity_cutoff is not None else np.arange(cosine.shape[0]))
+        k = min(self.similarity_top_k, candidates.shape[0])
+        if k == 0:
+            return []
+        top = np.argpartition(-combined[candidates], k - 1)[:k]
+        top = candidates[top[np.argsort(-combined[candidates][top])]]
+        return [
+            NodeWithScore(node=self.embedding_matrix.get_node(int(row)), score=float(relevance[row]))
+            for row in top
+        ]
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        embedding = query_bundle.embedding
+        if embedding is None:
+            embedding = self.embed_model.get_query_embedding(query_bundle.query_str)
+        return self._search(query_bundle.query_str, embedding)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        embedding = query_bundle.embedding
+        if embedding is None:
+            embedding = await self.embed_model.aget_query_embedding(query_bundle.query_str)
+        return self._search(query_bundle.query_str, embedding)
@@ -0,0 +1,167 @@
+# load_shedding.py
+#
+# Keeps latency bounded when the server is saturated. Every chat gets a deadline
+# (REQUEST_DEADLINE_SECONDS, or a shorter "deadline_seconds" from the client):
+# - admission: a request that would only get a workflow slot after its deadline is turned
+#   away at once with 503 and Retry-After, instead of waiting and timing out;
+# - waiting: a request still waiting for a slot when its deadline comes gets the same 503;
+# - degradation: when DEGRADE_QUEUE_DEPTH requests are waiting for a slot, or less than a
+#   DEGRADE_REMAINING_SHARE of the request's own time is left, the optional workflow nodes (title
+#   and summary, readability rewrites) are skipped and the aggregator renders a shorter answer.
+#   A short "deadline_seconds" alone does not degrade a request on an idle server.
+
+import os
+import math
+import time
+import asyncio
+import functools
+import inspect
+import logging
+from contextlib import asynccontextmanager
+
+from config import CustomError, MAX_CONCURRENT_CHATS
+from metrics import SHED_REQUESTS, SKIPPED_NODES
+
+REQUEST_DEADLINE_SECONDS = float(os.getenv('REQUEST_DEADLINE_SECONDS', '60'))
+DEGRADE_QUEUE_DEPTH = int(os.getenv('DEGRADE_QUEUE_DEPTH', '8'))
+DEGRADE_REMAINING_SHARE = float(os.getenv('DEGRADE_REMAINING_SHARE', '0.33'))
+LOAD_SHEDDING_ENABLED = os.getenv('LOAD_SHEDDING_ENABLED', 'true').lower() == 'true'
+
+
+def request_seconds(deadline_seconds: float | None = None) -> float:
+    """Time a request is given; a client can only shorten the default."""
+    if deadline_seconds is None:
+        return REQUEST_DEADLINE_SECONDS
+    return min(REQUEST_DEADLINE_SECONDS, max(float(deadline_seconds), 0.0))
+
+
+def request_deadline(deadline_seconds: float | None = None) -> float:
+    """time.monotonic() deadline of a request starting now."""
+    return time.monotonic() + request_seconds(deadline_seconds)
+
+
+class LoadMonitor:
+    """
+    Tracks the requests waiting for and holding one of the `capacity` workflow slots, and a
+    moving average of the time a workflow holds its slot, to estimate the wait of a new request.
+    """
+    def __init__(self, capacity: int, degrade_queue_depth: int, degrade_remaining_share: float,
+                 shedding: bool = True):
+        self.capacity = capacity
+        self.degrade_queue_depth = degrade_queue_depth
+        self.degrade_remaining_share = degrade_remaining_share
+        self.shedding = shedding
+        self.waiting = 0
+        self.running = 0
+        self._average_seconds = None  # unknown until a workflow has finished
+
+    def expected_wait(self) -> float:
+        """Seconds until a request arriving now gets a slot."""
+        ahead = self.waiting + self.running - self.capacity + 1
+        if ahead <= 0 or self._average_seconds is None:
+            return 0.0
+        return math.ceil(ahead / self.capacity) * self._average_seconds
+
+    def admit(self, deadline: float):
+        """Raise 503 with Retry-After when the request would get a slot only after its deadline."""
+        if not self.shedding:
+            return
+        wait = self.expected_wait()
+        if wait and time.monotonic() + wait >= deadline:
+            self._shed("admission", wait)
+
+    def skip_optional(self, deadline: float, seconds: float) -> bool:
+        """Whether the optional workflow nodes of a request given `seconds` until `deadline` should be skipped now."""
+        return (self.waiting >= self.degrade_queue_depth
+                or deadline - time.monotonic() < self.degrade_remaining_share * seconds)
+
+    @asynccontextmanager
+    async def slot(self, semaphore: asyncio.Semaphore, deadline: float):
+        """Hold a workflow slot of `semaphore`, giving up with 503 when the deadline comes first."""
+        from tracing import span
+
+        # the queue is known exactly here, requests admitted at the same time are counted
+        self.admit(deadline)
+        self.waiting += 1
+        try:
+            with span("wait_for_slot"):
+                timeout = deadline - time.monotonic() if self.shedding else None
+                if timeout is not None and timeout <= 0:
+                    self._shed("deadline", self.expected_wait())
+                try:
+                    await asyncio.wait_for(semaphore.acquire(), timeout)
+                except asyncio.TimeoutError:
+                    self._shed("deadline", self.expected_wait())
+        finally:
+            self.waiting -= 1
+
+        self.running += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.running -= 1
+            semaphore.release()
+            seconds = time.monotonic() - started
+            self._average_seconds = (seconds if self._average_seconds is None
+                                     else 0.8 * self._average_seconds + 0.2 * seconds)
+
+    def stats(self) -> dict:
+        return {"capacity": self.capacity, "running": self.running, "waiting": self.waiting,
+                "expected_wait_seconds": round(self.expected_wait(), 2)}
+
+    def _shed(self, stage: str, wait: float):
+        SHED_REQUESTS.inc(stage=stage)
+        logging.warning(f"Request shed at {stage}: {self.waiting} waiting, {self.running} running")
+        raise CustomError("The server is busy, please try again later.", 503,
+                          retry_after=max(1, math.ceil(wait)))
+
+
+def record_skipped(node: str):
+    """Count an optional node that was skipped and list it in the trace."""
+    from tracing import current_trace
+    SKIPPED_NODES.inc(node=node)
+    trace = current_trace()
+    if trace is not None:
+        trace.attributes.setdefault("skipped_nodes", []).append(node)
+
+
+def skip_optional(node: str, state: dict) -> bool:
+    """Whether to skip the optional `node` now; a skipped node is counted and listed in the trace."""
+    if not load_monitor.skip_optional(state["request_deadline"], state["request_seconds"]):
+        return False
+    record_skipped(node)
+    return True
+
+
+def optional_node(fallback):
+    """
+    Workflow node that returns `fallback(state)` instead of doing its work when skip_optional()
+    holds, and adds its name to the skipped_nodes of the state.
+    """
+    def decorate(fn):
+        def skipped(state) -> dict | None:
+            if skip_optional(fn.__name__, state):
+                return {**fallback(state), "skipped_nodes": [fn.__name__]}
+            return None
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_node(state):
+                return skipped(state) or await fn(state)
+            return async_node
+
+        @functools.wraps(fn)
+        def node(state):
+            return skipped(state) or fn(state)
+        return node
+    return decorate
+
+
+# instantiate the singleton
+load_monitor = LoadMonitor(
+    capacity=MAX_CONCURRENT_CHATS,
+    degrade_queue_depth=DEGRADE_QUEUE_DEPTH,
+    degrade_remaining_share=DEGRADE_REMAINING_SHARE,
+    shedding=LOAD_SHEDDING_ENABLED,
+)
@@ -0,0 +1,205 @@
+# metrics.py
+
+import threading
+from collections import defaultdict
+
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+class Histogram:
+    """Minimal Prometheus-style histogram with optional labels."""
+    def __init__(self, name, documentation, buckets, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self.label_names = tuple(label_names)
+        # label values -> [bucket counts..., count, sum]
+        self.series = defaultdict(lambda: [0] * len(self.buckets) + [0, 0.0])
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.label_names)
+        with self._lock:
+            series = self.series[key]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def snapshot(self):
+        """Return {label values: {"buckets": {bound: count}, "count": n, "sum": s}}."""
+        with self._lock:
+            return {
+                key: {
+                    "buckets": dict(zip(self.buckets, series[:len(self.buckets)])),
+                    "count": series[-2],
+                    "sum": series[-1],
+                }
+                for key, series in self.series.items()
+            }
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, data in self.snapshot().items():
+            for bound, count in data["buckets"].items():
+                labels = _format_labels(self.label_names, key, ("le", bound))
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.label_names, key, ("le", "+Inf"))
+            lines.append(f"{self.name}_bucket{labels} {data['count']}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_count{labels} {data['count']}")
+            lines.append(f"{self.name}_sum{labels} {data['sum']}")
+        return "\n".join(lines)
+
+
+class Counter:
+    """Minimal Prometheus-style counter with optional labels."""
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.series = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.label_names)
+        with self._lock:
+            self.series[key] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            series = dict(self.series)
+        for key, value in series.items():
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return "\n".join(lines)
+
+
+class MetricsRegistry:
+    """Collects the metrics of this worker and renders them in the Prometheus text format."""
+    def __init__(self):
+        self.metrics = []
+
+    def histogram(self, name, documentation, buckets, label_names=()):
+        metric = Histogram(name, documentation, buckets, label_names)
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, label_names=()):
+        metric = Counter(name, documentation, label_names)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        return "\n".join(m.render() for m in self.metrics) + "\n"
+
+
+# instantiate the singleton
+registry = MetricsRegistry()
+
+READABILITY_REWRITE_ROUNDS = registry.histogram(
+    "helsesvar_readability_rewrite_rounds",
+    "Number of readability rewrite rounds needed per accepted answer.",
+    buckets=(0, 1, 2, 3, 5, 8),
+)
+
+EMBEDDING_BATCH_SIZE = registry.histogram(
+    "helsesvar_embedding_batch_size",
+    "Number of query embeddings sent in one batched embedding request.",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+
+COALESCED_REQUESTS = registry.counter(
+    "helsesvar_coalesced_requests_total",
+    "Requests answered by sharing an identical in-flight get_answer execution.",
+)
+
+AZURE_RETRIES = registry.counter(
+    "helsesvar_azure_retries_total",
+    "Azure OpenAI calls retried after a retryable error.",
+    label_names=("error",),
+)
+
+AZURE_QUEUE_WAIT_SECONDS = registry.histogram(
+    "helsesvar_azure_queue_wait_seconds",
+    "Time an Azure OpenAI call waited for rate-limit budget, by priority.",
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30),
+    label_names=("priority",),
+)
+
+STAGE_SECONDS = registry.histogram(
+    "helsesvar_stage_seconds",
+    "Wall time of the stages of a chat request: workflow nodes, embedding, cache lookup, queueing.",
+    buckets=(0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40),
+    label_names=("stage",),
+)
+
+LLM_TOKENS = registry.counter(
+    "helsesvar_llm_tokens_total",
+    "LLM tokens used, by stage of the chat request and kind (prompt or completion).",
+    label_names=("stage", "kind"),
+)
+
+CHAT_REQUEST_SECONDS = registry.histogram(
+    "helsesvar_chat_request_seconds",
+    "Wall time of a chat request, by the retrieval settings it used.",
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 20, 30, 60),
+    label_names=("response_mode", "similarity_top_k"),
+)
+
+CHAT_REQUEST_TOKENS = registry.histogram(
+    "helsesvar_chat_request_tokens",
+    "LLM tokens (prompt + completion) used by a chat request, by the retrieval settings it used.",
+    buckets=(500, 1000, 2000, 4000, 8000, 16000, 32000),
+    label_names=("response_mode", "similarity_top_k"),
+)
+
+CONTEXT_TOKENS = registry.histogram(
+    "helsesvar_context_tokens",
+    "Tokens of retrieved context packed into the prompt of the packed response mode.",
+    buckets=(250, 500, 1000, 2000, 3000, 4000, 6000, 8000),
+)
+
+CONTEXT_CHUNKS_DROPPED = registry.counter(
+    "helsesvar_context_chunks_dropped_total",
+    "Retrieved chunks left out of the packed context, by reason (duplicate or over_budget).",
+    label_names=("reason",),
+)
+
+JOBS_TOTAL = registry.counter(
+    "helsesvar_jobs_total",
+    "Chat jobs by outcome: submitted, rejected (queue full), done, failed or cancelled.",
+    label_names=("status",),
+)
+
+JOB_QUEUE_WAIT_SECONDS = registry.histogram(
+    "helsesvar_job_queue_wait_seconds",
+    "Time a chat job waited in the queue before a worker started it.",
+    buckets=(0.01, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+
+SESSION_EVICTIONS = registry.counter(
+    "helsesvar_session_evictions_total",
+    "Conversation sessions dropped, by reason: ttl, lru (session cap) or memory (memory cap).",
+    label_names=("reason",),
+)
+
+SHED_REQUESTS = registry.counter(
+    "helsesvar_shed_requests_total",
+    "Chats turned away with 503 because they would miss their deadline, by stage: admission or deadline (while waiting).",
+    label_names=("stage",),
+)
+
+SKIPPED_NODES = registry.counter(
+    "helsesvar_skipped_nodes_total",
+    "Optional workflow nodes skipped under load or close to the request deadline.",
+    label_names=("node",),
+)
@@ -0,0 +1,183 @@
+# mmap_vector_store.py
+#
+# Read-only vector store backed by memory-mapped files, so index startup does not parse
+# the JSON docstore and vector store, and all workers share one copy through the page cache.
+#
+# Layout of <storage>/mmap, or of the build directory named in <storage>/mmap.current
+# (written by build_index.py, which switches builds by replacing that file):
+#   meta.json       format version, node count and embedding dimension
+#   embeddings.npy  float32 matrix (count x dim), rows L2-normalized
+#   ids.json        node id of every row
+#   nodes.bin       node records (docstore JSON without embedding), UTF-8, back to back
+#   offsets.npy     int64 (count + 1) byte offsets of the records in nodes.bin
+#
+# Convert an existing JSON store with:
+#   python mmap_vector_store.py ./blobstorage/chatbot/helsenorgeartikler
+
+import os
+import sys
+import json
+import time
+import logging
+from typing import Any, List
+
+import numpy as np
+from pydantic import PrivateAttr
+from llama_index.core import StorageContext, VectorStoreIndex, load_index_from_storage
+from llama_index.core.schema import BaseNode
+from llama_index.core.storage.docstore.utils import doc_to_json, json_to_doc
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+
+from vector_search import normalize_rows, normalize_query, top_k_similarities
+
+MMAP_DIRNAME = "mmap"
+MMAP_FORMAT = "mmap-v1"
+# names the current build directory of the storage, see set_mmap_dir()
+MMAP_POINTER = "mmap.current"
+
+
+def mmap_dir(storage: str) -> str:
+    """The current mmap store of an index directory: the build named in mmap.current, else <storage>/mmap."""
+    try:
+        with open(os.path.join(storage, MMAP_POINTER), encoding="utf-8") as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        name = ""
+    return os.path.join(storage, name or MMAP_DIRNAME)
+
+
+def set_mmap_dir(storage: str, name: str):
+    """Make the build directory `name` (inside storage) the current store, with one atomic replace."""
+    pointer = os.path.join(storage, MMAP_POINTER)
+    with open(f"{pointer}.tmp", "w", encoding="utf-8") as f:
+        f.write(name)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f"{pointer}.tmp", pointer)
+
+
+def has_mmap_store(storage: str) -> bool:
+    return os.path.exists(os.path.join(mmap_dir(storage), "meta.json"))
+
+
+def write_mmap_store(out_dir: str, nodes: List[BaseNode], embeddings: np.ndarray):
+    """Write nodes and their embeddings (same order) in the memory-mapped layout."""
+    os.makedirs(out_dir, exist_ok=True)
+
+    offsets = [0]
+    with open(os.path.join(out_dir, "nodes.bin"), "wb") as f:
+        for node in nodes:
+            # the embedding lives in embeddings.npy, do not store it twice
+            record = doc_to_json(node.model_copy(update={"embedding": None}))
+            data = json.dumps(record, ensure_ascii=False).encode("utf-8")
+            f.write(data)
+            offsets.append(offsets[-1] + len(data))
+
+    np.save(os.path.join(out_dir, "offsets.npy"), np.asarray(offsets, dtype=np.int64))
+    np.save(os.path.join(out_dir, "embeddings.npy"), normalize_rows(np.asarray(embeddings, dtype=np.float32)))
+    with open(os.path.join(out_dir, "ids.json"), "w", encoding="utf-8") as f:
+        json.dump([n.node_id for n in nodes], f)
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"format": MMAP_FORMAT, "count": len(nodes), "dim": int(embeddings.shape[1]) if len(nodes) else 0}, f)
+
+
+def convert_storage_to_mmap(storage: str, out_dir: str | None = None) -> str:
+    """Convert a persisted JSON VectorStoreIndex (docstore + simple vector store) to the mmap layout."""
+    out_dir = out_dir or mmap_dir(storage)
+    storage_ctx = StorageContext.from_defaults(persist_dir=storage)
+    index = load_index_from_storage(storage_ctx)
+
+    embedding_dict = index.vector_store.data.embedding_dict
+    node_ids = list(index.index_struct.nodes_dict.values())
+    nodes = index.docstore.get_nodes(node_ids)
+    embeddings = np.asarray([embedding_dict[n.node_id] for n in nodes], dtype=np.float32)
+
+    write_mmap_store(out_dir, nodes, embeddings)
+    logging.info(f"Converted {len(nodes)} nodes from {storage} to {out_dir}")
+    return out_dir
+
+
+class MmapVectorStore(BasePydanticVectorStore):
+    """Read-only vector store over the memory-mapped layout written by write_mmap_store()."""
+
+    stores_text: bool = True
+    persist_dir: str
+
+    _embeddings: Any = PrivateAttr()
+    _ids: List[str] = PrivateAttr()
+    _records: Any = PrivateAttr()
+    _offsets: Any = PrivateAttr()
+
+    def __init__(self, persist_dir: str, **kwargs):
+        super().__init__(persist_dir=persist_dir, **kwargs)
+        with open(os.path.join(persist_dir, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("format") != MMAP_FORMAT:
+            raise ValueError(f"Unsupported vector store format in {persist_dir}: {meta.get('format')}")
+
+        self._embeddings = np.load(os.path.join(persist_dir, "embeddings.npy"), mmap_mode="r")
+        self._offsets = np.load(os.path.join(persist_dir, "offsets.npy"), mmap_mode="r")
+        self._records = np.memmap(os.path.join(persist_dir, "nodes.bin"), dtype=np.uint8, mode="r")
+        with open(os.path.join(persist_dir, "ids.json"), encoding="utf-8") as f:
+            self._ids = json.load(f)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "MmapVectorStore"
+
+    @property
+    def client(self) -> Any:
+        return None
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        return self._embeddings
+
+    @property
+    def ids(self) -> List[str]:
+        return self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def get_node(self, row: int) -> BaseNode:
+        start, end = int(self._offsets[row]), int(self._offsets[row + 1])
+        return json_to_doc(json.loads(self._records[start:end].tobytes().decode("utf-8")))
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        raise NotImplementedError("MmapVectorStore is read-only, rebuild it with write_mmap_store()")
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        raise NotImplementedError("MmapVectorStore is read-only, rebuild it with write_mmap_store()")
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if query.filters is not None:
+            raise ValueError("Metadata filters are not supported by MmapVectorStore")
+
+        rows, scores = top_k_similarities(
+            self._embeddings, normalize_query(query.query_embedding), query.similarity_top_k
+        )
+        return VectorStoreQueryResult(
+            nodes=[self.get_node(int(i)) for i in rows],
+            similarities=[float(s) for s in scores],
+            ids=[self._ids[i] for i in rows],
+        )
+
+
+def load_mmap_index(storage: str) -> VectorStoreIndex:
+    """Build a VectorStoreIndex over the mmap store of an index directory."""
+    return VectorStoreIndex.from_vector_store(MmapVectorStore(persist_dir=mmap_dir(storage)))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    if len(sys.argv) < 2:
+        print("usage: python mmap_vector_store.py <storage_dir> [<out_dir>]")
+        sys.exit(1)
+    start = time.time()
+    out = convert_storage_to_mmap(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
+    logging.info(f"Wrote {out} in {time.time() - start:.2f}s")
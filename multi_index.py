@@ -0,0 +1,162 @@
+# multi_index.py
+#
+# Answering from several indexes at once ("vectorIndex": "auto" or a list of index names).
+# - IndexRouter: drops the indexes whose description is far from the question, from one
+#   cosine per index against description embeddings computed once per index version.
+# - FusionRetriever: retrieves from every selected index concurrently and merges the
+#   candidates by reciprocal-rank fusion or min-max normalized scores. The nodes keep
+#   their cosine score, so validate_response() and the references work as for one index.
+
+import os
+import asyncio
+import logging
+from typing import Dict, List
+
+import numpy as np
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+
+from config import IndexObject
+from request_coalescing import embedding_batcher
+from vector_search import normalize_query
+
+# "rrf" (reciprocal-rank fusion) or "minmax" (per-index min-max normalized similarity)
+FUSION_MODE = os.getenv('MULTI_INDEX_FUSION', 'rrf').lower()
+RRF_K = int(os.getenv('MULTI_INDEX_RRF_K', '60'))
+# "auto" keeps the indexes whose description is within the margin of the best match
+ROUTING_ENABLED = os.getenv('MULTI_INDEX_ROUTING', 'true').lower() == 'true'
+ROUTING_MARGIN = float(os.getenv('MULTI_INDEX_ROUTING_MARGIN', '0.15'))
+ROUTING_MAX_INDEXES = int(os.getenv('MULTI_INDEX_MAX_INDEXES', '3'))
+
+
+def composite_entry(name: str, members: List[IndexObject]) -> IndexObject:
+    """One IndexObject standing for several leased indexes; index holds the members."""
+    return IndexObject(
+        name=name,
+        index=tuple(members),
+        description=". ".join(m.description.rstrip(". ") for m in members),
+        version=tuple(m.version for m in members),
+    )
+
+
+def is_composite(entry: IndexObject) -> bool:
+    return isinstance(entry.index, tuple)
+
+
+def cache_name(entry: IndexObject) -> str:
+    """
+    Response cache namespace of an entry. A composite one includes the versions of its
+    members, so a reload of any of them retires the answers fused from the old version.
+    """
+    if not is_composite(entry):
+        return entry.name
+    return entry.name + "@" + ",".join(f"{m.name}:{m.version}" for m in entry.index)
+
+
+def reciprocal_rank_fusion(results: List[List[NodeWithScore]], k: int = RRF_K) -> Dict[str, tuple]:
+    """node id -> (fused score, node); a node found by several indexes sums its 1 / (k + rank)."""
+    fused = {}
+    for nodes in results:
+        for rank, node in enumerate(nodes, start=1):
+            score, best = fused.get(node.node.node_id, (0.0, node))
+            if (node.score or 0.0) > (best.score or 0.0):
+                best = node
+            fused[node.node.node_id] = (score + 1.0 / (k + rank), best)
+    return fused
+
+
+def min_max_fusion(results: List[List[NodeWithScore]]) -> Dict[str, tuple]:
+    """node id -> (fused score, node); similarities rescaled to [0, 1] within each index."""
+    fused = {}
+    for nodes in results:
+        scores = [n.score or 0.0 for n in nodes]
+        if not scores:
+            continue
+        low, high = min(scores), max(scores)
+        for node, score in zip(nodes, scores):
+            normalized = (score - low) / (high - low) if high > low else 1.0
+            previous, best = fused.get(node.node.node_id, (0.0, node))
+            if score > (best.score or 0.0):
+                best = node
+            fused[node.node.node_id] = (max(previous, normalized), best)
+    return fused
+
+
+class FusionRetriever(BaseRetriever):
+    """Top-k over several retrievers, queried concurrently and merged by rank or normalized score."""
+    def __init__(
+        self,
+        retrievers: Dict[str, BaseRetriever],
+        similarity_top_k: int = 10,
+        mode: str = FUSION_MODE,
+        **kwargs
+    ):
+        super().__init__(**kwargs)
+        if mode not in ("rrf", "minmax"):
+            raise ValueError(f"Unknown fusion mode {mode!r}, expected 'rrf' or 'minmax'")
+        self.retrievers = retrievers
+        self.similarity_top_k = similarity_top_k
+        self.mode = mode
+
+    def fuse(self, results: List[List[NodeWithScore]]) -> List[NodeWithScore]:
+        fused = reciprocal_rank_fusion(results) if self.mode == "rrf" else min_max_fusion(results)
+        ranked = sorted(fused.values(), key=lambda item: -item[0])
+        return [node for _, node in ranked[:self.similarity_top_k]]
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        return self.fuse([r.retrieve(query_bundle) for r in self.retrievers.values()])
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        if query_bundle.embedding is not None:
+            # with the embedding known the searches are numpy work, which releases the GIL,
+            # so the indexes are searched side by side in worker threads
+            results = await asyncio.gather(*(
+                asyncio.to_thread(r.retrieve, query_bundle) for r in self.retrievers.values()
+            ))
+        else:
+            results = await asyncio.gather(*(r.aretrieve(query_bundle) for r in self.retrievers.values()))
+        return self.fuse(list(results))
+
+
+class IndexRouter:
+    """Picks the indexes worth searching for a question from their descriptions."""
+    def __init__(self, margin: float = ROUTING_MARGIN, max_indexes: int = ROUTING_MAX_INDEXES,
+                 enabled: bool = ROUTING_ENABLED):
+        self.margin = margin
+        self.max_indexes = max_indexes
+        self.enabled = enabled
+        # (name, version) -> normalized description embedding
+        self._vectors: Dict[tuple, np.ndarray] = {}
+
+    async def _description_vectors(self, members: List[IndexObject]) -> np.ndarray:
+        missing = [m for m in members if (m.name, m.version) not in self._vectors]
+        if missing:
+            # concurrent calls end up in one batched embedding request
+            embeddings = await asyncio.gather(*(embedding_batcher.embed(m.description) for m in missing))
+            for m, embedding in zip(missing, embeddings):
+                self._vectors[(m.name, m.version)] = normalize_query(embedding)
+            # forget the descriptions of replaced versions
+            current = {(m.name, m.version) for m in members}
+            names = {m.name for m in members}
+            for key in [k for k in self._vectors if k[0] in names and k not in current]:
+                del self._vectors[key]
+        return np.stack([self._vectors[(m.name, m.version)] for m in members])
+
+    async def select(self, members: List[IndexObject], query_embedding: list) -> List[IndexObject]:
+        if not self.enabled or len(members) <= 1:
+            return list(members)
+        similarities = await self._description_vectors(members) @ normalize_query(query_embedding)
+        best = float(similarities.max())
+        ranked = sorted(zip(similarities.tolist(), members), key=lambda item: -item[0])
+        selected = [m for similarity, m in ranked if similarity >= best - self.margin]
+        if self.max_indexes > 0:
+            selected = selected[:self.max_indexes]
+        logging.info("Routed to %s (description similarities %s)",
+                     [m.name for m in selected], {m.name: round(s, 3) for s, m in ranked})
+        # in the order of the request, so the same selection shares one cached query engine
+        names = {m.name for m in selected}
+        return [m for m in members if m.name in names]
+
+
+# instantiate the singleton
+index_router = IndexRouter()
@@ -0,0 +1,232 @@
+# query_engine_cache.py
+
+import os
+import logging
+import threading
+from collections import OrderedDict
+
+from llama_index.core.llms import ChatMessage, MessageRole
+from llama_index.core import ChatPromptTemplate, get_response_synthesizer, VectorStoreIndex
+from llama_index.core.query_engine import BaseQueryEngine, RetrieverQueryEngine
+
+from query_utils import QuerySettings
+from multi_index import FusionRetriever
+from keyword_index import HybridRetriever, get_keyword_index
+from context_packing import PACKED_RESPONSE_MODE, TokenBudgetPostprocessor
+from vector_search import NUMPY_RETRIEVER, NumpyVectorRetriever, get_embedding_matrix
+
+
+# ask for an easy-to-read answer up front, so the readability rewrite loop is rarely needed
+READABLE_FIRST_PROMPT = os.getenv('READABLE_FIRST_PROMPT', 'true').lower() == 'true'
+
+READABILITY_RULES = (
+    "\n\n**Readability:**\n"
+    "- Write so the answer has a LIX readability score below 50: on average at most 15 words per sentence.\n"
+    "- Prefer short, common Norwegian words; keep words longer than six letters to a minimum."
+)
+
+
+def build_text_qa_template(readable_first: bool = READABLE_FIRST_PROMPT) -> ChatPromptTemplate:
+    """Prompt used both for the QA step and the summarize step of the synthesizer."""
+    return ChatPromptTemplate([
+
+        ChatMessage(
+            role=MessageRole.SYSTEM,
+            content=(
+                "You are 'HelseSvar', a friendly, empathetic, and knowledgeable health advisor from helsenorge.no, specifically designed to help young people in Norway (ages 13-19).\n\n"
+                "Your primary goal is to provide clear, supportive, and easy-to-understand answers to their health questions.\n\n"
+                "**Tone and Style Guidelines:**\n"
+                "1.  **Empathy:** Always respond with understanding and support. Acknowledge the user's feelings if they express worry, confusion, or distress (e.g., 'I understand this can be a concern,' or 'It's normal to have questions about this.'). Be reassuring and non-judgmental.\n"
+                "2.  **Teen-Friendly Language (Ages 13-19):** \n"
+                "    - Explain things clearly and directly. Avoid overly medical jargon or complex terminology. If you must use a technical term, explain it immediately in simple words.\n"
+                "    - Use short sentences and paragraphs. Break down complex information.\n"
+                "    - Maintain a friendly, approachable, and encouraging tone. Imagine you're talking to a smart but not yet expert high school student.\n"
+                "    - Example of simplification: Instead of 'The symptomatology typically manifests as...', say 'Usually, you might notice symptoms like...'.\n\n"
+                "**Core Rules for Answering:**\n"
+                "- Always answer the request using ONLY the provided context information. Do not use any prior knowledge.\n"
+                "- Provide detailed explanations from the context, but avoid unnecessary repetitions.\n"
+                "- Always answer in Norwegian (Bokmål).\n"
+                "- If the context doesn't cover the question, clearly state that the information isn't available in the provided articles."
+                + (READABILITY_RULES if readable_first else "")
+            )
+        ),
+
+        ChatMessage(
+            role=MessageRole.USER,
+            content=(
+                "Context information is below.\n"
+                "---------------------\n"
+                "{context_str}\n"
+                "---------------------\n"
+                "Query: {query_str}\n"
+                "Answer: "
+            )
+        ),
+    ])
+
+
+# the template does not depend on the request, so it is built once per process
+TEXT_QA_TEMPLATE = build_text_qa_template()
+
+
+def build_response_synthesizer(query_settings: QuerySettings, streaming: bool = False):
+    if query_settings.response_mode == PACKED_RESPONSE_MODE:
+        # the packed context always fits in one prompt: one call, without compact's repacking and refine
+        return get_response_synthesizer(
+            response_mode="simple_summarize",
+            streaming=streaming,
+            text_qa_template=TEXT_QA_TEMPLATE,
+            use_async=True,
+        )
+    return get_response_synthesizer(
+        response_mode=query_settings.response_mode,
+        streaming=streaming,
+        text_qa_template=TEXT_QA_TEMPLATE,
+        summary_template=TEXT_QA_TEMPLATE,
+        structured_answer_filtering=True,
+        use_async=True,
+        verbose=True,
+    )
+
+
+def build_node_postprocessors(query_settings: QuerySettings) -> list:
+    if query_settings.response_mode == PACKED_RESPONSE_MODE:
+        return [TokenBudgetPostprocessor()]
+    return []
+
+
+def build_query_engine(
+    index: VectorStoreIndex,
+    query_settings: QuerySettings,
+    streaming: bool = False
+) -> BaseQueryEngine:
+    """Create the response synthesizer and the query engine for one combination of settings."""
+    response_synthesizer = build_response_synthesizer(query_settings, streaming)
+
+    if NUMPY_RETRIEVER:
+        embedding_matrix = get_embedding_matrix(index)
+        if query_settings.retrieval_mode == "hybrid":
+            retriever = HybridRetriever(
+                embedding_matrix,
+                get_keyword_index(index, embedding_matrix),
+                similarity_top_k=query_settings.similarity_top_k,
+                similarity_cutoff=query_settings.similarity_cutoff,
+            )
+        else:
+            retriever = NumpyVectorRetriever(
+                embedding_matrix,
+                similarity_top_k=query_settings.similarity_top_k,
+                similarity_cutoff=query_settings.similarity_cutoff,
+            )
+        return RetrieverQueryEngine.from_args(
+            retriever,
+            response_synthesizer=response_synthesizer,
+            node_postprocessors=build_node_postprocessors(query_settings),
+        )
+
+    return index.as_query_engine(
+        similarity_cutoff=query_settings.similarity_cutoff,
+        similarity_top_k=query_settings.similarity_top_k,
+        response_synthesizer=response_synthesizer,
+        node_postprocessors=build_node_postprocessors(query_settings),
+    )
+
+
+class QueryEngineCache:
+    """
+    LRU cache of prepared query engines.
+    Keyed on (index name, index version, response_mode, similarity_top_k, similarity_cutoff,
+    retrieval_mode, streaming);
+    the query engines are stateless between queries and can be shared by requests.
+    Engines over several indexes are keyed on the tuples of their names and versions.
+    """
+    def __init__(self, max_entries: int = 32):
+        self.max_entries = max_entries
+        self.engines: OrderedDict = OrderedDict()
+        # indexes are loaded in a worker thread while requests read on the event loop
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(name: str | tuple, version: int | tuple, query_settings: QuerySettings, streaming: bool = False) -> tuple:
+        return (
+            name,
+            version,
+            query_settings.response_mode,
+            query_settings.similarity_top_k,
+            query_settings.similarity_cutoff,
+            query_settings.retrieval_mode,
+            streaming,
+        )
+
+    def get(
+        self,
+        name: str,
+        index: VectorStoreIndex,
+        query_settings: QuerySettings,
+        streaming: bool = False,
+        version: int = 0
+    ) -> BaseQueryEngine:
+        """Return the cached query engine for these settings, building it on a miss."""
+        key = self.make_key(name, version, query_settings, streaming)
+        return self._get_or_build(key, lambda: build_query_engine(index, query_settings, streaming))
+
+    def get_fused(self, members: list, query_settings: QuerySettings, streaming: bool = False) -> BaseQueryEngine:
+        """Query engine retrieving from every member index (IndexObjects) and synthesizing one answer."""
+        key = self.make_key(
+            tuple(m.name for m in members), tuple(m.version for m in members), query_settings, streaming
+        )
+
+        def build():
+            # the per-index retrievers come from the cached single-index engines
+            retrievers = {
+                m.name: self.get(m.name, m.index, query_settings, version=m.version).retriever
+                for m in members
+            }
+            retriever = FusionRetriever(retrievers, similarity_top_k=query_settings.similarity_top_k)
+            return RetrieverQueryEngine.from_args(
+                retriever,
+                response_synthesizer=build_response_synthesizer(query_settings, streaming),
+                node_postprocessors=build_node_postprocessors(query_settings),
+            )
+
+        return self._get_or_build(key, build)
+
+    def _get_or_build(self, key: tuple, build) -> BaseQueryEngine:
+        with self._lock:
+            engine = self.engines.get(key)
+            if engine is not None:
+                self.engines.move_to_end(key)
+                return engine
+
+        # build outside the lock, a concurrent duplicate build is harmless
+        logging.info("Building query engine for %s", key)
+        engine = build()
+
+        with self._lock:
+            self.engines[key] = engine
+            self.engines.move_to_end(key)
+            while len(self.engines) > self.max_entries:
+                evicted, _ = self.engines.popitem(last=False)
+                logging.info("Evicted query engine for %s", evicted)
+        return engine
+
+    def warm(self, name: str, index: VectorStoreIndex, version: int = 0) -> BaseQueryEngine:
+        """Prepare the query engine for the default settings of the /chat endpoint."""
+        return self.get(name, index, QuerySettings(), version=version)
+
+    def invalidate(self, name: str, version: int | None = None):
+        """Drop the query engines built on the given index (all versions unless one is given)."""
+        def built_on(key):
+            names, versions = (key[0], key[1]) if isinstance(key[0], tuple) else ((key[0],), (key[1],))
+            return name in names and (version is None or version in versions)
+
+        with self._lock:
+            for key in [k for k in self.engines if built_on(k)]:
+                del self.engines[key]
+
+    def __len__(self):
+        return len(self.engines)
+
+
+# instantiate the singleton
+query_engine_cache = QueryEngineCache(int(os.getenv('QUERY_ENGINE_CACHE_SIZE', '32')))
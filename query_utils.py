@@ -1,31 +1,77 @@
 # query_utils.py
 
+import os
 import json
 
+from config import CustomError
+from load_shedding import request_deadline, request_seconds
+
+# "vectorIndex": "auto" answers from every loaded index, see multi_index.py
+MULTI_INDEX_AUTO = "auto"
+# "vector" (embeddings only) or "hybrid" (embeddings + BM25, see keyword_index.py)
+RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'hybrid').lower()
+
 class QuerySettings:
     def __init__(self, **kwargs):
         # Default values provided in the constructor
-        self.response_mode = kwargs.get('response_mode', 'tree_summarize')
+        self.response_mode = kwargs.get('response_mode', 'packed')  # see context_packing.py
         self.similarity_top_k = int(kwargs.get('similarity_top_k', 10))  # Default to int, not str
         self.similarity_cutoff = float(kwargs.get('similarity_cutoff', 0.7))  # Default to float
+        self.retrieval_mode = kwargs.get('retrieval_mode', RETRIEVAL_MODE)
         self.vectorIndex = kwargs.get('vectorIndex', "None")
+        # the indexes of a multi-index request given as a list, None otherwise
+        self.indexes = kwargs.get('indexes')
         self.user_content = kwargs.get('user_content', "")
+        # multi-turn conversations, see session_store.py: the session id, the earlier messages when
+        # the client sends the history itself, and the question as asked before it is made standalone
+        self.conversation_id = kwargs.get('conversation_id')
+        self.history = kwargs.get('history', [])
+        self.question = kwargs.get('question', "")
+        # time the answer is given, and the time.monotonic() by which it is due, see load_shedding.py
+        self.deadline_seconds = request_seconds(kwargs.get('deadline_seconds'))
+        self.deadline = request_deadline(self.deadline_seconds)
+
+    @property
+    def multi_index(self) -> bool:
+        return self.vectorIndex == MULTI_INDEX_AUTO or self.indexes is not None
 
     def __str__(self):
         # Convert object properties to a JSON string
         return json.dumps(self.__dict__, ensure_ascii=False, indent=4, default=str)
 
 def get_query_settings(json_request):
+    # a list of index names is searched as one, under a combined name like "a+b"
+    vector_index = json_request.get('vectorIndex', "helsenorgeartikler")
+    indexes = None
+    if isinstance(vector_index, list):
+        # an empty list would otherwise become "" and search every index like "auto"
+        if not vector_index:
+            raise CustomError('"vectorIndex" must name at least one index', 400)
+        indexes = sorted(set(vector_index))
+        vector_index = "+".join(indexes)
+        if len(indexes) == 1:
+            indexes = None
+
     # Use the QuerySettings class constructor with the json_request
     query_settings = QuerySettings(
-        response_mode=json_request.get('response_mode', 'tree_summarize'),
+        response_mode=json_request.get('response_mode', 'packed'),
         similarity_top_k=json_request.get('similarity_top_k', 10),
         similarity_cutoff=json_request.get('similarity_cutoff', 0.7),
-        vectorIndex=json_request.get('vectorIndex', "helsenorgeartikler"),
+        retrieval_mode=json_request.get('retrieval_mode', RETRIEVAL_MODE),
+        vectorIndex=vector_index,
+        indexes=indexes,
+        deadline_seconds=json_request.get('deadline_seconds'),
     )
     
-    # Messages extraction - more Pythonic way to handle potential missing data
+    # the question is the last user message, the messages before it are the history of the conversation
     messages = json_request.get('messages', [])
-    query_settings.user_content = next((obj['content'] for obj in messages if obj['role'] == 'user'), None)
+    last = next((i for i in range(len(messages) - 1, -1, -1) if messages[i]['role'] == 'user'), None)
+    if last is not None:
+        query_settings.user_content = query_settings.question = messages[last]['content']
+        query_settings.history = messages[:last]
+    else:
+        query_settings.user_content = None
+    conversation_id = json_request.get('conversation_id')
+    query_settings.conversation_id = str(conversation_id) if conversation_id else None
 
     return query_settings
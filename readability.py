@@ -0,0 +1,172 @@
+# readability.py
+#
+# LIX readability of Norwegian text, per sentence and per paragraph, for the readability loop
+# of the workflow. Words are counted with æ, ø and å (and other letters) included, so long
+# Norwegian words count as long. A rewrite round only sends the sentences that make the answer
+# hard to read, numbered, and splices the rewritten sentences back into the answer in place;
+# the rest of the answer is neither resent nor regenerated. List markers ("- ", "1. ") are not
+# part of a sentence, so they are not sent and the Markdown list keeps its formatting.
+#
+# LIX = words / sentences + 100 * long words / words, where a long word has more than 6 letters.
+
+import os
+import re
+from dataclasses import dataclass
+
+LIX_READABLE_LIMIT = 50
+LONG_WORD_LETTERS = 6
+# a sentence above this LIX is rewritten; for one sentence LIX is its length plus its share of long words
+SENTENCE_LIX_LIMIT = float(os.getenv('READABILITY_SENTENCE_LIX_LIMIT', str(LIX_READABLE_LIMIT)))
+# sentences sent per rewrite round, worst first
+MAX_REWRITE_SENTENCES = int(os.getenv('READABILITY_MAX_SENTENCES', '8'))
+
+# common Norwegian abbreviations, their full stops do not end a sentence
+ABBREVIATION_PATTERN = re.compile(r"\b(?:f\.eks|bl\.a|d\.v\.s|dvs|osv|m\.m|o\.l|pga|ca|nr|mv|evt|etc|kl|jf|inkl|ev)\.",
+                                  re.IGNORECASE)
+# a run with at least one word, up to the end mark, a line break or the end of the text
+SENTENCE_PATTERN = re.compile(r"[^.!?\n\w]*\w[^.!?\n]*(?:[.!?]+|(?=\n)|$)")
+PARAGRAPH_PATTERN = re.compile(r"\n\s*\n")
+# "- ", "* ", "• ", "1. " or "2) " starting a line of a Markdown list
+LIST_MARKER_PATTERN = re.compile(r"^[ \t]*(?:[-*+•]|\d{1,3}[.)])[ \t]+", re.MULTILINE)
+# a bullet the model put in front of a rewritten sentence; a number may be a date ("17. mai")
+BULLET_PATTERN = re.compile(r"^[-*+•]\s+")
+# letters in any alphabet and digits; a hyphenated compound ("p-piller") is one word
+WORD_PATTERN = re.compile(r"\w[\w-]*")
+# "3: Setningen ..." or "3. Setningen ..." in the rewrite output
+NUMBERED_LINE_PATTERN = re.compile(r"^\s*(\d+)\s*[:.)]\s*(.+?)\s*$", re.MULTILINE)
+
+
+def lix(words: int, sentences: int, long_words: int) -> float:
+    words = words or 1
+    return words / (sentences or 1) + 100.0 * long_words / words
+
+
+def count_words(text: str) -> tuple[int, int]:
+    """Number of words and of long words."""
+    words = WORD_PATTERN.findall(text)
+    long_words = sum(1 for w in words if len(w) > LONG_WORD_LETTERS and len(w) - w.count("-") > LONG_WORD_LETTERS)
+    return len(words), long_words
+
+
+def ends_in_abbreviation(text: str, end: int) -> bool:
+    for match in ABBREVIATION_PATTERN.finditer(text, max(0, end - 6), end + 5):
+        if match.start() < end <= match.end():
+            return True
+    return False
+
+
+def mask_list_markers(text: str) -> str:
+    """The text with list markers blanked out, same length so the offsets still match."""
+    return LIST_MARKER_PATTERN.sub(lambda match: " " * len(match.group()), text)
+
+
+def sentence_spans(text: str) -> list[tuple[int, int]]:
+    """
+    (start, end) of every sentence; a full stop of an abbreviation joins the pieces around it.
+    A list marker before a sentence is outside its span.
+    """
+    spans, join = [], False
+    text = mask_list_markers(text)
+    for match in SENTENCE_PATTERN.finditer(text):
+        start, end = match.span()
+        if join:
+            spans[-1] = (spans[-1][0], end)
+        else:
+            spans.append((start, end))
+        join = text[end - 1] == "." and ends_in_abbreviation(text, end)
+    return spans
+
+
+@dataclass(frozen=True)
+class Sentence:
+    start: int
+    end: int
+    text: str
+    words: int
+    long_words: int
+
+    @property
+    def lix(self) -> float:
+        return lix(self.words, 1, self.long_words)
+
+
+def split_sentences(text: str) -> list[Sentence]:
+    sentences = []
+    masked = mask_list_markers(text)
+    for start, end in sentence_spans(text):
+        start += len(masked[start:end]) - len(masked[start:end].lstrip())
+        sentences.append(Sentence(start, end, text[start:end], *count_words(text[start:end])))
+    return sentences
+
+
+def text_lix(text: str) -> float:
+    """LIX of a whole text."""
+    words, long_words = count_words(text)
+    return lix(words, len(sentence_spans(text)), long_words)
+
+
+def paragraph_lix(text: str) -> list[tuple[int, int, float]]:
+    """(start, end, LIX) of every paragraph (blocks separated by blank lines)."""
+    paragraphs, start = [], 0
+    for end, next_start in [m.span() for m in PARAGRAPH_PATTERN.finditer(text)] + [(len(text), len(text))]:
+        if text[start:end].strip():
+            paragraphs.append((start, end, text_lix(text[start:end])))
+        start = next_start
+    return paragraphs
+
+
+def hard_sentences(
+    text: str,
+    limit: float = SENTENCE_LIX_LIMIT,
+    max_sentences: int = MAX_REWRITE_SENTENCES
+) -> list[Sentence]:
+    """
+    The sentences to rewrite, in text order: those above the sentence limit, worst first up to
+    max_sentences. When none is, the sentences above their paragraph's LIX in the paragraphs
+    above LIX_READABLE_LIMIT are the ones pulling it up; without such a paragraph, the sentences
+    above the text's own LIX.
+    """
+    sentences = split_sentences(text)
+    candidates = [s for s in sentences if s.lix > limit]
+    if not candidates:
+        candidates = [s for start, end, value in paragraph_lix(text) if value > LIX_READABLE_LIMIT
+                      for s in sentences if start <= s.start < end and s.lix > value]
+    if not candidates and sentences:
+        overall = lix(sum(s.words for s in sentences), len(sentences), sum(s.long_words for s in sentences))
+        candidates = [s for s in sentences if s.lix > overall]
+    worst = sorted(candidates, key=lambda s: s.lix, reverse=True)[:max_sentences]
+    return sorted(worst, key=lambda s: s.start)
+
+
+def rewrite_prompt(sentences: list[Sentence], feedback: str) -> str:
+    numbered = "\n".join(f"{i}: {' '.join(s.text.split())}" for i, s in enumerate(sentences, 1))
+    return (
+        "Rewrite the numbered sentences from a Norwegian health answer so they are easier to read. "
+        f"{feedback} Keep the meaning and the language; one sentence may become two. "
+        "Answer with exactly one line per sentence, starting with its number and a colon.\n\n"
+        f"{numbered}"
+    )
+
+
+def parse_rewrites(content: str, count: int) -> list[str] | None:
+    """
+    The rewritten sentences in order, or None unless every number 1..count came back. A bullet
+    the model put in front of a sentence is dropped, the list marker in the answer stays in place.
+    """
+    rewrites = {}
+    for number, sentence in NUMBERED_LINE_PATTERN.findall(content):
+        rewrites.setdefault(int(number), BULLET_PATTERN.sub("", sentence))
+    if any(i not in rewrites for i in range(1, count + 1)):
+        return None
+    return [rewrites[i] for i in range(1, count + 1)]
+
+
+def splice(text: str, sentences: list[Sentence], rewrites: list[str]) -> str:
+    """Replace the sentences (in text order) by their rewrites, the rest of the text unchanged."""
+    parts, position = [], 0
+    for sentence, rewrite in zip(sentences, rewrites):
+        parts.append(text[position:sentence.start])
+        parts.append(rewrite)
+        position = sentence.end
+    parts.append(text[position:])
+    return "".join(parts)
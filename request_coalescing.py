@@ -0,0 +1,145 @@
+# request_coalescing.py
+#
+# Two ways of doing less work at peak:
+# - EmbeddingBatcher: query embeddings requested within a few milliseconds of each
+#   other are sent to the embedding model as one batched request. The embedding API only
+#   batches texts, so this is done for models that embed a query like a text (the OpenAI
+#   models); other models get one query embedding request per distinct text of the batch.
+# - SingleFlight: identical requests that are in flight at the same time share one execution.
+
+import os
+import asyncio
+import logging
+from typing import Awaitable, Callable, Hashable
+
+from llama_index.core import Settings
+
+from metrics import EMBEDDING_BATCH_SIZE, COALESCED_REQUESTS
+from tracing import annotate
+
+
+class EmbeddingBatcher:
+    """
+    Micro-batches query embeddings. The first query of a batch waits at most `window_ms`
+    for others to join; a full batch is sent right away. Identical texts in a batch are
+    embedded once. The batch goes through the text embedding endpoint only when
+    `embeds_queries_as_texts` holds for the model, since asymmetric models embed queries
+    differently; otherwise the query embeddings of the batch are requested concurrently.
+    """
+    def __init__(self, window_ms: float = 5, max_batch_size: int = 64, embed_model=None):
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        # None: resolve Settings.embed_model at call time
+        self.embed_model = embed_model
+        self._pending: list[tuple[str, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        # flushed batches; the event loop only keeps weak references to tasks
+        self._batches: set[asyncio.Task] = set()
+
+    async def embed(self, text: str) -> list[float]:
+        embed_model = self.embed_model or Settings.embed_model
+        if self.window <= 0:
+            return await embed_model.aget_query_embedding(text)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._embed_batch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _embed_batch(self, batch: list[tuple[str, asyncio.Future]]):
+        embed_model = self.embed_model or Settings.embed_model
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        EMBEDDING_BATCH_SIZE.observe(len(texts))
+        try:
+            if embeds_queries_as_texts(embed_model):
+                embeddings = await embed_model.aget_text_embedding_batch(texts)
+            else:
+                embeddings = await asyncio.gather(*(embed_model.aget_query_embedding(t) for t in texts))
+        except Exception as e:
+            logging.error(f"Batched embedding of {len(texts)} queries failed: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        by_text = dict(zip(texts, embeddings))
+        for text, future in batch:
+            if not future.done():
+                future.set_result(by_text[text])
+
+
+def embeds_queries_as_texts(embed_model) -> bool:
+    """
+    True when a query embedding of the model equals the text embedding of the same string: the
+    OpenAI embeddings when the query and text engines are the same deployment, and models that
+    declare it with an `embeds_queries_as_texts` class attribute.
+    """
+    declared = getattr(type(embed_model), "embeds_queries_as_texts", None)
+    if declared is not None:
+        return bool(declared)
+    query_engine = getattr(embed_model, "_query_engine", None)
+    return query_engine is not None and query_engine == getattr(embed_model, "_text_engine", None)
+
+
+class SingleFlight:
+    """
+    Runs one execution per key at a time; concurrent callers with the same key await its result.
+    The execution is cancelled when every caller awaiting it has been cancelled, so a cancelled
+    job or a disconnected client does not keep a workflow slot and its LLM calls busy.
+    """
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Future] = {}
+        self._waiters: dict[asyncio.Future, int] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable]):
+        future = self._calls.get(key)
+        if future is not None:
+            COALESCED_REQUESTS.inc()
+            # the work is traced on the request that started it
+            annotate(coalesced=True)
+        else:
+            future = asyncio.ensure_future(fn())
+            self._calls[key] = future
+            future.add_done_callback(lambda f: self._calls.pop(key, None) if self._calls.get(key) is f else None)
+
+        self._waiters[future] = self._waiters.get(future, 0) + 1
+        try:
+            # shielded, so a caller that is cancelled does not cancel the execution others await
+            return await asyncio.shield(future)
+        finally:
+            self._waiters[future] -= 1
+            if not self._waiters[future]:
+                del self._waiters[future]
+                if not future.done():
+                    self._calls.pop(key, None)
+                    future.cancel()
+
+    def __len__(self):
+        return len(self._calls)
+
+
+def normalize_query(query: str) -> str:
+    """Key used to recognize identical questions."""
+    return " ".join((query or "").lower().split())
+
+
+# instantiate the singletons
+embedding_batcher = EmbeddingBatcher(
+    window_ms=float(os.getenv('EMBEDDING_BATCH_WINDOW_MS', '5')),
+    max_batch_size=int(os.getenv('EMBEDDING_BATCH_MAX_SIZE', '64')),
+)
+single_flight = SingleFlight()
@@ -0,0 +1,334 @@
+# response_cache.py
+
+import os
+import json
+import base64
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field, asdict
+
+import numpy as np
+
+from query_utils import QuerySettings
+from request_coalescing import embedding_batcher
+
+
+@dataclass
+class CacheEntry:
+    index_name: str
+    settings_key: str
+    embedding: np.ndarray  # normalized float32
+    structured_answer: str
+    references: list = field(default_factory=list)
+    created_at: float = field(default_factory=time.time)
+    entry_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+
+
+def normalize(embedding) -> np.ndarray:
+    vec = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+
+@dataclass
+class CacheMatrix:
+    """The entries of one index and settings key with their embeddings stacked, for one matrix product."""
+    entries: list[CacheEntry]
+    embeddings: np.ndarray  # one normalized row per entry
+    created_at: np.ndarray
+
+    @classmethod
+    def of(cls, entries: list[CacheEntry]) -> "CacheMatrix":
+        if not entries:
+            return cls([], np.zeros((0, 0), dtype=np.float32), np.zeros(0))
+        return cls(entries, np.stack([e.embedding for e in entries]), np.array([e.created_at for e in entries]))
+
+
+class CacheBackend:
+    """Storage interface of the semantic response cache."""
+
+    def matrix(self, index_name: str, settings_key: str) -> CacheMatrix:
+        """The entries of an index and settings key; kept between lookups until they change."""
+        raise NotImplementedError
+
+    def put(self, entry: CacheEntry):
+        raise NotImplementedError
+
+    def touch(self, entry: CacheEntry):
+        """Mark the entry as recently used."""
+        raise NotImplementedError
+
+    def delete(self, entry: CacheEntry):
+        raise NotImplementedError
+
+    def invalidate(self, index_name: str):
+        """Drop every entry belonging to the given index."""
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+
+class InMemoryCacheBackend(CacheBackend):
+    """Per-process backend, LRU over all indexes."""
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self.store: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._matrices: dict[tuple[str, str], CacheMatrix] = {}
+        self._lock = threading.Lock()
+
+    def matrix(self, index_name, settings_key):
+        with self._lock:
+            matrix = self._matrices.get((index_name, settings_key))
+            if matrix is None:
+                matrix = CacheMatrix.of([e for e in self.store.values()
+                                         if e.index_name == index_name and e.settings_key == settings_key])
+                self._matrices[(index_name, settings_key)] = matrix
+            return matrix
+
+    def _changed(self, entry: CacheEntry):
+        self._matrices.pop((entry.index_name, entry.settings_key), None)
+
+    def put(self, entry):
+        with self._lock:
+            self.store[entry.entry_id] = entry
+            self._changed(entry)
+            while len(self.store) > self.max_entries:
+                self._changed(self.store.popitem(last=False)[1])
+
+    def touch(self, entry):
+        with self._lock:
+            if entry.entry_id in self.store:
+                self.store.move_to_end(entry.entry_id)
+
+    def delete(self, entry):
+        with self._lock:
+            if self.store.pop(entry.entry_id, None) is not None:
+                self._changed(entry)
+
+    def invalidate(self, index_name):
+        with self._lock:
+            for entry_id in [k for k, e in self.store.items() if e.index_name == index_name]:
+                del self.store[entry_id]
+            self._matrices = {key: m for key, m in self._matrices.items() if key[0] != index_name}
+
+    def __len__(self):
+        return len(self.store)
+
+
+class RedisCacheBackend(CacheBackend):
+    """
+    Backend shared by all workers through Redis (or a local stand-in speaking the same protocol).
+    Every entry is its own key expiring after the TTL; per index a sorted set of entry ids by
+    creation time and a version counter bumped on every change. A worker keeps the stacked
+    embeddings of an index until the version moves, so a lookup is one GET and a matrix product.
+    Recency is a sorted set used for LRU eviction.
+    """
+
+    def __init__(self, url: str, max_entries: int = 1000, ttl_seconds: float = 3600,
+                 prefix: str = "helsesvar:response_cache"):
+        import redis  # optional dependency, see requirements-redis.txt
+        self.client = redis.Redis.from_url(url)
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+        # index name -> (version, {settings_key: CacheMatrix})
+        self._matrices: dict[str, tuple[int, dict[str, CacheMatrix]]] = {}
+        self._lock = threading.Lock()
+
+    def _entry_key(self, entry_id):
+        return f"{self.prefix}:entry:{entry_id}"
+
+    def _ids_key(self, index_name):
+        return f"{self.prefix}:ids:{index_name}"
+
+    def _version_key(self, index_name):
+        return f"{self.prefix}:version:{index_name}"
+
+    def _lru_key(self):
+        return f"{self.prefix}:lru"
+
+    @staticmethod
+    def _encode(entry: CacheEntry) -> str:
+        data = asdict(entry)
+        data["embedding"] = base64.b64encode(entry.embedding.astype(np.float32).tobytes()).decode()
+        return json.dumps(data, ensure_ascii=False)
+
+    @staticmethod
+    def _decode(raw: bytes) -> CacheEntry:
+        data = json.loads(raw)
+        data["embedding"] = np.frombuffer(base64.b64decode(data["embedding"]), dtype=np.float32)
+        return CacheEntry(**data)
+
+    def _load(self, index_name: str) -> dict[str, CacheMatrix]:
+        """Every live entry of the index, grouped by settings key."""
+        entry_ids = self.client.zrangebyscore(self._ids_key(index_name), time.time() - self.ttl_seconds, "+inf")
+        raws = self.client.mget([self._entry_key(e.decode()) for e in entry_ids]) if entry_ids else []
+        groups: dict[str, list[CacheEntry]] = {}
+        for raw in raws:
+            if raw is not None:  # expired since
+                entry = self._decode(raw)
+                groups.setdefault(entry.settings_key, []).append(entry)
+        return {key: CacheMatrix.of(entries) for key, entries in groups.items()}
+
+    def matrix(self, index_name, settings_key):
+        version = int(self.client.get(self._version_key(index_name)) or 0)
+        with self._lock:
+            cached = self._matrices.get(index_name)
+        if cached is None or cached[0] != version:
+            cached = (version, self._load(index_name))
+            with self._lock:
+                self._matrices[index_name] = cached
+        return cached[1].get(settings_key) or CacheMatrix.of([])
+
+    def _remove(self, pipe, index_name: str, entry_id: str):
+        pipe.delete(self._entry_key(entry_id))
+        pipe.zrem(self._ids_key(index_name), entry_id)
+        pipe.zrem(self._lru_key(), f"{index_name}|{entry_id}")
+        pipe.incr(self._version_key(index_name))
+
+    def put(self, entry):
+        now = time.time()
+        ttl_ms = max(1, int(self.ttl_seconds * 1000))
+        pipe = self.client.pipeline()
+        pipe.set(self._entry_key(entry.entry_id), self._encode(entry), px=ttl_ms)
+        pipe.zadd(self._ids_key(entry.index_name), {entry.entry_id: entry.created_at})
+        # ids of entries whose keys have expired, and the sets of indexes nobody writes to any more
+        pipe.zremrangebyscore(self._ids_key(entry.index_name), "-inf", now - self.ttl_seconds)
+        pipe.pexpire(self._ids_key(entry.index_name), ttl_ms)
+        pipe.zadd(self._lru_key(), {f"{entry.index_name}|{entry.entry_id}": now})
+        pipe.zremrangebyscore(self._lru_key(), "-inf", now - self.ttl_seconds)
+        pipe.incr(self._version_key(entry.index_name))
+        pipe.execute()
+
+        overflow = self.client.zcard(self._lru_key()) - self.max_entries
+        if overflow > 0:
+            pipe = self.client.pipeline()
+            for member in self.client.zrange(self._lru_key(), 0, overflow - 1):
+                index_name, entry_id = member.decode().split("|", 1)
+                self._remove(pipe, index_name, entry_id)
+            pipe.execute()
+
+    def touch(self, entry):
+        self.client.zadd(self._lru_key(), {f"{entry.index_name}|{entry.entry_id}": time.time()}, xx=True)
+
+    def delete(self, entry):
+        pipe = self.client.pipeline()
+        self._remove(pipe, entry.index_name, entry.entry_id)
+        pipe.execute()
+
+    def invalidate(self, index_name):
+        entry_ids = [e.decode() for e in self.client.zrange(self._ids_key(index_name), 0, -1)]
+        pipe = self.client.pipeline()
+        if entry_ids:
+            pipe.delete(*[self._entry_key(e) for e in entry_ids])
+            pipe.zrem(self._lru_key(), *[f"{index_name}|{e}" for e in entry_ids])
+        pipe.delete(self._ids_key(index_name))
+        pipe.incr(self._version_key(index_name))
+        pipe.execute()
+
+    def __len__(self):
+        return self.client.zcard(self._lru_key())
+
+
+class SemanticResponseCache:
+    """
+    Cache of final structured answers, keyed on index name plus query embedding.
+    A lookup hits when a cached query for the same index and query settings has a
+    cosine similarity of at least `threshold` and is younger than `ttl_seconds`.
+    """
+
+    def __init__(self, backend: CacheBackend, threshold: float = 0.95, ttl_seconds: float = 3600, enabled: bool = True):
+        self.backend = backend
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def settings_key(query_settings: QuerySettings) -> str:
+        # answers only carry over between requests that would run the same retrieval and synthesis
+        return (f"{query_settings.response_mode}|{query_settings.similarity_top_k}|{query_settings.similarity_cutoff}"
+                f"|{query_settings.retrieval_mode}")
+
+    async def embed(self, query: str) -> list:
+        # the same embedding is used for retrieval, see State.query_embedding
+        return await embedding_batcher.embed(query)
+
+    def lookup(self, index_name: str, query_settings: QuerySettings, embedding: list) -> CacheEntry | None:
+        if not self.enabled:
+            return None
+
+        matrix = self.backend.matrix(index_name, self.settings_key(query_settings))
+        best = None
+        if matrix.entries:
+            # embeddings are stored normalized, so the dot product is the cosine similarity
+            similarities = matrix.embeddings @ normalize(embedding)
+            expired = matrix.created_at < time.time() - self.ttl_seconds
+            if expired.any():
+                # in Redis the entry keys expire by themselves, in memory they are dropped here
+                for i in np.flatnonzero(expired):
+                    self.backend.delete(matrix.entries[i])
+                similarities[expired] = -np.inf
+            i = int(np.argmax(similarities))
+            if similarities[i] >= self.threshold:
+                best = matrix.entries[i]
+
+        if best is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.backend.touch(best)
+        return best
+
+    def store(self, index_name: str, query_settings: QuerySettings, embedding: list, structured_answer: str, references: list):
+        if not self.enabled:
+            return
+        self.backend.put(CacheEntry(
+            index_name=index_name,
+            settings_key=self.settings_key(query_settings),
+            embedding=normalize(embedding),
+            structured_answer=structured_answer,
+            references=references,
+        ))
+
+    def invalidate(self, index_name: str):
+        self.backend.invalidate(index_name)
+        logging.info(f"Response cache invalidated for {index_name}")
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self.backend),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+def create_response_cache() -> SemanticResponseCache:
+    max_entries = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '1000'))
+    ttl_seconds = float(os.getenv('RESPONSE_CACHE_TTL_SECONDS', '3600'))
+    if os.getenv('RESPONSE_CACHE_BACKEND', 'memory') == 'redis':
+        backend = RedisCacheBackend(os.getenv('RESPONSE_CACHE_REDIS_URL', 'redis://localhost:6379/0'), max_entries,
+                                    ttl_seconds)
+    else:
+        backend = InMemoryCacheBackend(max_entries)
+
+    return SemanticResponseCache(
+        backend,
+        threshold=float(os.getenv('RESPONSE_CACHE_THRESHOLD', '0.95')),
+        ttl_seconds=ttl_seconds,
+        enabled=os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true',
+    )
+
+
+# instantiate the singleton
+response_cache = create_response_cache()
@@ -1,29 +1,254 @@
 from quart import request, jsonify, Response
+import asyncio
+import json
 import logging
-from config import (server_settings, vector_store)
-from query_utils import (get_query_settings)
-from answer_utils import (get_answer)
+import math
+import os
+from config import (server_settings, vector_store, reload_indexes)
+from query_utils import (get_query_settings, MULTI_INDEX_AUTO)
+from metrics import registry
+from job_queue import job_manager, JobQueueFull, QUEUED, FINISHED
+from session_store import session_store
+from load_shedding import load_monitor, request_deadline
+# the request path (answer_utils, response_cache, tracing) pulls in LlamaIndex and LangGraph;
+# it is imported by the warm-up step in app.py, or by the first request that needs it
+
+
+def format_sse(event, data):
+    """Encode one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def error_response(e):
+    """JSON error with the status of the exception, and Retry-After when it carries one."""
+    status = getattr(e, "code", 500)          # default to 500 if no .code
+    retry_after = getattr(e, "retry_after", None)
+    headers = {"Retry-After": str(math.ceil(retry_after))} if retry_after else {}
+    return {"error": str(e)}, status, headers
+
+
+def trace_labels(query_settings):
+    """Retrieval settings the request histograms are split by."""
+    return {"response_mode": query_settings.response_mode, "similarity_top_k": query_settings.similarity_top_k}
+
 
 def register_routes(app):
-    @app.route("/chat", methods=["POST"])
-    async def chat():
-        # Check if indexes are loaded
+    def index_not_ready(query_settings):
+        # Check if the requested index is loaded, other indexes may still be loading
         status, indexes_loaded = server_settings.get_status()
-        if not indexes_loaded:
-            logging.warning("Indexes are still loading...")
+        if query_settings.vectorIndex == MULTI_INDEX_AUTO:
+            # "auto" answers from whatever is loaded so far
+            loading = not indexes_loaded and not vector_store.get_all()
+        else:
+            states = [vector_store.get_status(name) for name in (query_settings.indexes or [query_settings.vectorIndex])]
+            loading = any(state == "loading" or (state is None and not indexes_loaded) for state in states)
+        if loading:
+            logging.warning(f"Index {query_settings.vectorIndex} is still loading...")
             logging.info(f'Server status: {status}')
             return {"error": "Indexes are still loading, please try again later."}, 503
-        
+        return None
+
+    async def chat_stream_response(query_settings, debug=False):
+        from answer_utils import stream_answer
+        from tracing import request_trace
+
+        events = stream_answer(query_settings, server_settings, vector_store)
+
+        async def generate():
+            try:
+                with request_trace(**trace_labels(query_settings)) as trace:
+                    async for event, data in events:
+                        yield format_sse(event, data)
+                if debug:
+                    yield format_sse("trace", trace.to_dict())
+                yield format_sse("done", {})
+            except Exception as e:
+                # headers are already sent, report the failure inside the stream
+                logging.error("Error in /chat/stream generator", exc_info=True)
+                yield format_sse("error", {"error": str(e), "code": getattr(e, "code", 500)})
+
+        response = Response(generate(), mimetype="text/event-stream")
+        response.headers["Cache-Control"] = "no-cache"
+        response.headers["X-Accel-Buffering"] = "no"
+        response.timeout = None
+        return response
+
+    @app.route("/chat", methods=["POST"])
+    async def chat():
         try:
             json_request = await request.get_json()
             logging.info("Received /chat payload: %r", json_request)
             # your real logic here...
-            
+
             query_settings = get_query_settings(json_request)
-            answer = get_answer(query_settings, server_settings, vector_store)
+            not_ready = index_not_ready(query_settings)
+            if not_ready:
+                return not_ready
+            # 503 with Retry-After when the answer could not start before the deadline
+            load_monitor.admit(query_settings.deadline)
+
+            # "debug": true adds the per-stage timings and token usage of this request
+            debug = bool(json_request.get("debug", False))
+            if json_request.get("stream", False):
+                return await chat_stream_response(query_settings, debug)
+
+            from answer_utils import get_answer
+            from tracing import request_trace
+
+            with request_trace(**trace_labels(query_settings)) as trace:
+                answer = await get_answer(query_settings, server_settings, vector_store)
+            if debug:
+                return {"answer": answer, "trace": trace.to_dict()}, 200
             return {"answer": answer}, 200
-        
+
+        except Exception as e:
+            if getattr(e, "code", None) != 503:
+                logging.error("Error in /chat handler", exc_info=True)
+            return error_response(e)
+
+    @app.route("/chat/jobs", methods=["POST"])
+    async def chat_job_submit():
+        try:
+            json_request = await request.get_json()
+            logging.info("Received /chat/jobs payload: %r", json_request)
+            if not job_manager.enabled:
+                return {"error": "Chat jobs are disabled on this server (JOB_WORKERS=0)"}, 404
+
+            query_settings = get_query_settings(json_request)
+            not_ready = index_not_ready(query_settings)
+            if not_ready:
+                return not_ready
+            # shed like /chat: a job queued under overload would only time out once it runs
+            load_monitor.admit(query_settings.deadline)
+            debug = bool(json_request.get("debug", False))
+
+            async def run():
+                from answer_utils import get_answer
+                from tracing import request_trace
+
+                # the deadline counts from when the job starts, not from when it was queued
+                query_settings.deadline = request_deadline(query_settings.deadline_seconds)
+                with request_trace(**trace_labels(query_settings)) as trace:
+                    answer = await get_answer(query_settings, server_settings, vector_store)
+                if debug:
+                    return {"answer": answer, "trace": trace.to_dict()}
+                return {"answer": answer}
+
+            job = job_manager.submit(run)
+            status_url = f"/chat/jobs/{job.id}"
+            return {
+                "job_id": job.id,
+                "status": job.status,
+                "status_url": status_url,
+                "events_url": f"{status_url}/events",
+            }, 202, {"Location": status_url}
+
+        except JobQueueFull as e:
+            # backpressure, not a failure
+            logging.warning(f"Chat job rejected: {e}")
+            return error_response(e)
+        except Exception as e:
+            if getattr(e, "code", None) != 503:
+                logging.error("Error in /chat/jobs handler", exc_info=True)
+            return error_response(e)
+
+    def job_status(job):
+        data = job.to_dict()
+        if job.status == QUEUED:
+            data["position"] = job_manager.position(job)
+        return data
+
+    @app.route("/chat/jobs/<job_id>", methods=["GET"])
+    async def chat_job_status(job_id):
+        job = job_manager.get(job_id)
+        if job is None:
+            return {"error": "Job not found or expired"}, 404
+        return job_status(job), 200
+
+    @app.route("/chat/jobs/<job_id>", methods=["DELETE"])
+    async def chat_job_cancel(job_id):
+        job = job_manager.get(job_id)
+        if job is None:
+            return {"error": "Job not found or expired"}, 404
+        if job.status in FINISHED:
+            return {"error": f"Job is already {job.status}", **job_status(job)}, 409
+        job_manager.cancel(job_id)
+        return job_status(job), 200
+
+    @app.route("/chat/jobs/<job_id>/events", methods=["GET"])
+    async def chat_job_events(job_id):
+        job = job_manager.get(job_id)
+        if job is None:
+            return {"error": "Job not found or expired"}, 404
+
+        async def generate():
+            yield format_sse("status", job_status(job))
+            while not job.done.is_set():
+                try:
+                    await asyncio.wait_for(job.done.wait(), timeout=15)
+                except asyncio.TimeoutError:
+                    # comment line, keeps proxies from closing an idle stream
+                    yield ": keepalive\n\n"
+            yield format_sse("result", job_status(job))
+            yield format_sse("done", {})
+
+        response = Response(generate(), mimetype="text/event-stream")
+        response.headers["Cache-Control"] = "no-cache"
+        response.headers["X-Accel-Buffering"] = "no"
+        response.timeout = None
+        return response
+
+    @app.route("/metrics", methods=["GET"])
+    async def metrics():
+        return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+    @app.route("/cache/stats", methods=["GET"])
+    async def cache_stats():
+        from response_cache import response_cache
+        return response_cache.stats(), 200
+
+    @app.route("/status", methods=["GET"])
+    async def status():
+        server_status, indexes_loaded = server_settings.get_status()
+        return {
+            "status": server_status,
+            "indexes_loaded": indexes_loaded,
+            "indexes": dict(vector_store.status),
+            "versions": vector_store.versions(),
+            "jobs": job_manager.stats(),
+            "sessions": session_store.stats(),
+            "load": load_monitor.stats(),
+        }, 200
+
+    @app.route("/admin/reload", methods=["POST"])
+    async def admin_reload():
+        # disabled unless ADMIN_TOKEN is configured
+        admin_token = os.getenv('ADMIN_TOKEN')
+        if not admin_token or request.headers.get("X-Admin-Token") != admin_token:
+            return {"error": "Forbidden"}, 403
+
+        json_request = await request.get_json(silent=True) or {}
+        names = json_request.get("indexes")  # None reloads every index
+        # build the new versions in the background, progress is visible on /status
+        asyncio.create_task(reload_indexes(names))
+        logging.info(f"Index reload scheduled for {names or 'all indexes'}")
+        return {"status": "Reload scheduled", "indexes": names}, 202
+
+    @app.route("/chat/stream", methods=["POST"])
+    async def chat_stream():
+        try:
+            json_request = await request.get_json()
+            logging.info("Received /chat/stream payload: %r", json_request)
+
+            query_settings = get_query_settings(json_request)
+            not_ready = index_not_ready(query_settings)
+            if not_ready:
+                return not_ready
+            load_monitor.admit(query_settings.deadline)
+
+            return await chat_stream_response(query_settings, bool(json_request.get("debug", False)))
+
         except Exception as e:
-            logging.error("Error in /chat handler", exc_info=True)
-            status = getattr(e, "code", 500)          # default to 500 if no .code
-            return {"error": str(e)}, status
\ No newline at end of file
+            if getattr(e, "code", None) != 503:
+                logging.error("Error in /chat/stream handler", exc_info=True)
+            return error_response(e)
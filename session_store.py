@@ -0,0 +1,255 @@
+# session_store.py
+#
+# Multi-turn conversations. A request with a "conversation_id" continues a session kept in
+# this worker: a rolling summary of the older turns plus the last SESSION_RECENT_TURNS turns.
+# A follow-up question ("hva med hvis jeg er 16?") is rewritten into a standalone question
+# from that context before retrieval, so retrieval, the response cache and the workflow see a
+# complete question. The context given to the rewrite is cut to SESSION_CONTEXT_TOKENS, so the
+# prompt stays the same size however long the conversation gets. Turns that leave the recent
+# window are folded into the summary by one LLM call after the answer has been returned.
+# Sessions expire after SESSION_TTL_SECONDS and are evicted least recently used first above
+# SESSION_MAX_SESSIONS or SESSION_MAX_MEMORY_MB.
+#
+# Sessions live in the memory of one worker process. With several Hypercorn workers or replicas a
+# follow-up that reaches another worker starts without context (it is answered as it stands), so
+# route the requests of a conversation_id to the same worker, or send the history in "messages",
+# which works on any worker. /chat/jobs has the same single-process constraint, see job_queue.py.
+
+import os
+import re
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+
+from metrics import SESSION_EVICTIONS
+
+SESSION_TTL_SECONDS = float(os.getenv('SESSION_TTL_SECONDS', '1800'))
+SESSION_MAX_SESSIONS = int(os.getenv('SESSION_MAX_SESSIONS', '10000'))
+SESSION_MAX_MEMORY_MB = float(os.getenv('SESSION_MAX_MEMORY_MB', '64'))
+SESSION_RECENT_TURNS = int(os.getenv('SESSION_RECENT_TURNS', '3'))
+# summary + recent turns given to the question rewrite
+SESSION_CONTEXT_TOKENS = int(os.getenv('SESSION_CONTEXT_TOKENS', '800'))
+SESSION_SUMMARY_TOKENS = int(os.getenv('SESSION_SUMMARY_TOKENS', '250'))
+# an answer is kept in the session only as far as a follow-up needs it
+SESSION_ANSWER_TOKENS = int(os.getenv('SESSION_ANSWER_TOKENS', '150'))
+
+# bookkeeping of a session besides its text, for the memory estimate
+SESSION_OVERHEAD_BYTES = 600
+
+# the readable answer inside the structured answer built by the workflow's aggregator
+READABLE_ANSWER_SECTION = re.compile(r"## Lettlest svar\n(.*?)(?:\n## |\Z)", re.S)
+
+
+def count_tokens(text: str) -> int:
+    from context_packing import count_tokens
+    return count_tokens(text)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    from context_packing import truncate_to_tokens
+    return truncate_to_tokens(text, max_tokens)
+
+
+def answer_text(structured_answer: str) -> str:
+    """The readable answer of a structured answer, or the whole text when it has no such section."""
+    match = READABLE_ANSWER_SECTION.search(structured_answer or "")
+    return (match.group(1) if match else structured_answer or "").strip()
+
+
+@dataclass
+class Turn:
+    question: str
+    answer: str
+
+
+@dataclass
+class Session:
+    id: str
+    summary: str = ""
+    turns: deque = field(default_factory=deque)
+    updated: float = field(default_factory=time.time)
+    # turns moved out of the recent window, waiting to be folded into the summary
+    pending: list = field(default_factory=list)
+    folding: bool = False
+
+    @property
+    def empty(self) -> bool:
+        return not (self.summary or self.turns or self.pending)
+
+    def size(self) -> int:
+        """Rough size in bytes, for the memory cap."""
+        texts = [self.summary] + [t.question + t.answer for t in (*self.turns, *self.pending)]
+        return SESSION_OVERHEAD_BYTES + sum(len(text.encode("utf-8")) for text in texts)
+
+    def context(self, max_tokens: int = SESSION_CONTEXT_TOKENS) -> str:
+        """Summary and recent turns, newest turns kept first when they do not all fit."""
+        parts, used = [], 0
+        for turn in reversed([*self.pending, *self.turns]):
+            text = f"Bruker: {turn.question}\nAssistent: {turn.answer}"
+            tokens = count_tokens(text)
+            if used + tokens > max_tokens:
+                break
+            parts.append(text)
+            used += tokens
+        if self.summary and used < max_tokens:
+            parts.append(f"Sammendrag av samtalen så langt: {truncate_to_tokens(self.summary, max_tokens - used)}")
+        return "\n\n".join(reversed(parts))
+
+
+def session_from_messages(messages: list) -> Session | None:
+    """
+    Transient session for a client that sends the history in "messages" instead of a
+    conversation_id; only the last SESSION_RECENT_TURNS exchanges are used.
+    """
+    turns, question = [], None
+    for message in messages:
+        if message.get("role") == "user":
+            question = message.get("content", "")
+        elif message.get("role") == "assistant" and question is not None:
+            answer = truncate_to_tokens(answer_text(message.get("content", "")), SESSION_ANSWER_TOKENS)
+            turns.append(Turn(question, answer))
+            question = None
+    if not turns:
+        return None
+    return Session(id="", turns=deque(turns[-SESSION_RECENT_TURNS:]))
+
+
+async def rewrite_question(llm, session: Session | None, question: str) -> str:
+    """Standalone version of a follow-up question; the first question of a session is returned as is."""
+    if session is None or session.empty:
+        return question
+    from azure_client import priority_config, PRIORITY_HIGH
+
+    msg = await llm.ainvoke(
+        "Rewrite the user's last question as one standalone question in norwegian that can be understood "
+        "without the conversation, keeping the 'I' form. If it already stands on its own, return it unchanged. "
+        "Answer with the question only.\n\n"
+        f"{session.context()}\n\nSiste spørsmål: {question}",
+        config=priority_config(PRIORITY_HIGH),
+    )
+    standalone = msg.content.strip()
+    return standalone or question
+
+
+class SessionStore:
+    """Sessions by conversation id with TTL expiry and LRU eviction under a count and memory cap."""
+    def __init__(self, ttl: float, max_sessions: int, max_bytes: int, recent_turns: int):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.recent_turns = recent_turns
+        self.sessions: OrderedDict[str, Session] = OrderedDict()
+        self.bytes = 0
+        self._sizes: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._last_expire = time.time()
+        # running summary updates; the event loop only keeps weak references to tasks
+        self._fold_tasks: set[asyncio.Task] = set()
+
+    def get(self, conversation_id: str) -> Session | None:
+        with self._lock:
+            session = self.sessions.get(conversation_id)
+            if session is None:
+                return None
+            if time.time() - session.updated > self.ttl:
+                self._evict(conversation_id, "ttl")
+                return None
+            self.sessions.move_to_end(conversation_id)
+            return session
+
+    def record(self, conversation_id: str, question: str, structured_answer: str, llm=None) -> Session:
+        """
+        Append a turn. Turns pushed out of the recent window are folded into the summary in the
+        background when an LLM is given.
+        """
+        answer = truncate_to_tokens(answer_text(structured_answer), SESSION_ANSWER_TOKENS)
+        with self._lock:
+            session = self.sessions.get(conversation_id)
+            if session is None or time.time() - session.updated > self.ttl:
+                session = self.sessions[conversation_id] = Session(conversation_id)
+            self.sessions.move_to_end(conversation_id)
+            session.turns.append(Turn(question, answer))
+            while len(session.turns) > self.recent_turns:
+                session.pending.append(session.turns.popleft())
+            session.updated = time.time()
+            self._resize(session)
+            self._enforce_limits()
+        if time.time() - self._last_expire > 60:
+            self.expire()
+        if session.pending and not session.folding and llm is not None:
+            session.folding = True
+            task = asyncio.create_task(self._fold(session, llm))
+            self._fold_tasks.add(task)
+            task.add_done_callback(self._fold_tasks.discard)
+        return session
+
+    async def _fold(self, session: Session, llm):
+        from azure_client import priority_config, PRIORITY_LOW
+
+        turns = []
+        try:
+            while session.pending:
+                turns, session.pending = session.pending, []
+                exchanges = "\n\n".join(f"Bruker: {t.question}\nAssistent: {t.answer}" for t in turns)
+                msg = await llm.ainvoke(
+                    "Update the summary of a conversation between a user and a health information assistant "
+                    "with the new exchanges. Write it in norwegian, keep what the user has told about "
+                    f"themselves and the topics asked about, at most {SESSION_SUMMARY_TOKENS // 2} words.\n\n"
+                    f"Summary so far: {session.summary or '(empty)'}\n\nNew exchanges:\n{exchanges}",
+                    config=priority_config(PRIORITY_LOW),
+                )
+                session.summary = truncate_to_tokens(msg.content.strip(), SESSION_SUMMARY_TOKENS)
+                turns = []
+        except Exception as e:
+            # the turns go back to pending: they stay in the context and the next turn folds them again
+            session.pending = turns + session.pending
+            logging.warning(f"Session summary update failed for {session.id}: {e}")
+        finally:
+            session.folding = False
+            with self._lock:
+                if self.sessions.get(session.id) is session:
+                    self._resize(session)
+
+    def expire(self):
+        """Drop the sessions idle for longer than the TTL."""
+        with self._lock:
+            self._last_expire = time.time()
+            limit = time.time() - self.ttl
+            for conversation_id in [k for k, s in self.sessions.items() if s.updated < limit]:
+                self._evict(conversation_id, "ttl")
+
+    def stats(self) -> dict:
+        return {"sessions": len(self.sessions), "memory_bytes": self.bytes,
+                "max_sessions": self.max_sessions, "max_memory_bytes": self.max_bytes}
+
+    def _resize(self, session: Session):
+        size = session.size()
+        self.bytes += size - self._sizes.get(session.id, 0)
+        self._sizes[session.id] = size
+
+    def _enforce_limits(self):
+        while len(self.sessions) > self.max_sessions:
+            self._evict(next(iter(self.sessions)), "lru")
+        # the newest session stays even if it alone is over the cap
+        while self.bytes > self.max_bytes and len(self.sessions) > 1:
+            self._evict(next(iter(self.sessions)), "memory")
+
+    def _evict(self, conversation_id: str, reason: str):
+        self.sessions.pop(conversation_id, None)
+        self.bytes -= self._sizes.pop(conversation_id, 0)
+        SESSION_EVICTIONS.inc(reason=reason)
+
+    def __len__(self):
+        return len(self.sessions)
+
+
+# instantiate the singleton
+session_store = SessionStore(
+    ttl=SESSION_TTL_SECONDS,
+    max_sessions=SESSION_MAX_SESSIONS,
+    max_bytes=int(SESSION_MAX_MEMORY_MB * 1024 * 1024),
+    recent_turns=SESSION_RECENT_TURNS,
+)
@@ -0,0 +1,49 @@
+# conftest.py
+#
+# The tests run offline: placeholder Azure settings, and the fake chat model, synthesis LLM and
+# embedding model of benchmarks/fakes.py over a small synthetic index.
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import build_synthetic_index, install_fakes, set_dummy_azure_env  # noqa: E402
+
+set_dummy_azure_env()
+
+INDEX_NAME = "helse"
+
+
+@pytest.fixture
+def fake_index():
+    """Fakes with a noticeable LLM latency and a ready index; returns a payload factory for it."""
+    from config import vector_store, server_settings
+    from response_cache import response_cache
+
+    embed_model = install_fakes(llm_latency_ms=200)
+    vector_store.add(INDEX_NAME, build_synthetic_index(200, embed_model, seed=1, name=INDEX_NAME), "helse")
+    vector_store.set_status(INDEX_NAME, "ready")
+    server_settings.update_status("Server is ready")
+    response_cache.invalidate(INDEX_NAME)
+
+    def payload(question: str, **kwargs) -> dict:
+        return {"messages": [{"role": "user", "content": question}], "vectorIndex": INDEX_NAME,
+                "similarity_cutoff": 0.1, **kwargs}
+
+    yield payload
+    response_cache.invalidate(INDEX_NAME)
+
+
+@pytest.fixture
+def loaded_indexes():
+    """Names of the indexes a test loads into the global vector_store; they are dropped afterwards."""
+    from config import vector_store
+
+    names = []
+    yield names
+    for name in names:
+        vector_store.entries = {k: v for k, v in vector_store.entries.items() if k != name}
+        vector_store.status.pop(name, None)
@@ -0,0 +1,19 @@
+import os
+import sys
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ("llama_index", "langgraph", "langchain_core", "langchain_openai", "openai", "numpy", "tiktoken")
+
+
+def test_importing_the_app_defers_the_request_path():
+    # a fresh interpreter, the tests have imported everything already
+    code = (
+        "import sys, app\n"
+        f"print(sorted({{m.split('.')[0] for m in sys.modules}} & set({HEAVY!r})))\n"
+        "print(app.server_settings._llm)\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True,
+                            env=dict(os.environ), timeout=120)
+    assert result.returncode == 0, result.stderr[-2000:]
+    assert result.stdout.splitlines()[-2:] == ["[]", "None"]
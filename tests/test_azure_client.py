@@ -0,0 +1,187 @@
+import asyncio
+
+import httpx
+import openai
+import pytest
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from llama_index.core import Settings
+from llama_index.core.base.llms.types import ChatMessage, MessageRole
+from llama_index.core.llms import MockLLM
+
+from azure_client import (PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL, AzureRateLimited, RateLimiter, ScheduledChatModel, ScheduledSynthesisLLM,
+                          create_synthesis_llm)
+
+
+def rate_limited() -> openai.RateLimitError:
+    request = httpx.Request("POST", "https://example.openai.azure.com/openai/deployments/x/chat/completions")
+    response = httpx.Response(429, request=request, headers={"retry-after-ms": "10"})
+    return openai.RateLimitError("Requests have exceeded the rate limit", response=response, body=None)
+
+
+class ThrottledChatModel(BaseChatModel):
+    """Answers 429 `failures` times, then "Snus kan skade fosteret." (streamed word by word)."""
+    failures: int = 0
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "throttled"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        raise NotImplementedError
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise rate_limited()
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="Snus kan skade fosteret."))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise rate_limited()
+        for word in ["Snus ", "kan ", "skade ", "fosteret."]:
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word))
+
+
+class RecordingLimiter(RateLimiter):
+    def __init__(self):
+        super().__init__()
+        self.priorities = []
+
+    async def acquire(self, tokens: int, priority: int = 5):
+        self.priorities.append(priority)
+        await super().acquire(tokens, priority)
+
+
+def synthesis_llm(failures: int, max_retries: int = 2):
+    limiter = RecordingLimiter()
+    model = ThrottledChatModel(failures=failures)
+    chat_model = ScheduledChatModel(model, limiter, max_retries=max_retries, backoff_base=0.01)
+    return create_synthesis_llm(chat_model), limiter, model
+
+
+MESSAGES = [ChatMessage(role=MessageRole.SYSTEM, content="Svar kort."),
+            ChatMessage(role=MessageRole.USER, content="Kan jeg bruke snus når jeg er gravid?")]
+
+
+def test_waiting_calls_are_served_by_priority_then_arrival():
+    async def scenario():
+        limiter = RateLimiter(max_concurrency=1)
+        await limiter.acquire(100)
+        served = []
+
+        async def call(name, priority):
+            await limiter.acquire(100, priority)
+            served.append(name)
+            limiter.release(100, 50)
+
+        waiting = [asyncio.ensure_future(call(name, priority)) for name, priority in [
+            ("tittel", PRIORITY_LOW), ("normal", PRIORITY_NORMAL), ("svar", PRIORITY_HIGH),
+            ("omskriving", PRIORITY_HIGH)]]
+        await asyncio.sleep(0)
+        assert limiter.stats()["waiting"] == 4
+        limiter.release(100, 100)
+        await asyncio.gather(*waiting)
+        return served, limiter
+
+    served, limiter = asyncio.run(scenario())
+    assert served == ["svar", "omskriving", "normal", "tittel"]
+    assert limiter.in_flight == 0
+
+
+def test_call_over_the_token_budget_waits_for_the_refill():
+    async def scenario():
+        # 6000 tokens per minute refill 100 tokens per second
+        limiter = RateLimiter(tokens_per_minute=6000)
+        await limiter.acquire(5980)
+        limiter.release(5980, 5980)
+        started = asyncio.get_running_loop().time()
+        await limiter.acquire(50)
+        return asyncio.get_running_loop().time() - started
+
+    assert 0.2 < asyncio.run(scenario()) < 1.0
+
+
+def test_synthesis_is_scheduled_at_high_priority_and_retried():
+    llm, limiter, model = synthesis_llm(failures=1)
+    response = asyncio.run(llm.achat(MESSAGES))
+    assert response.message.content == "Snus kan skade fosteret."
+    assert model.calls == 2
+    assert limiter.priorities == [PRIORITY_HIGH, PRIORITY_HIGH]
+    assert limiter.in_flight == 0
+
+
+def test_streamed_synthesis_is_retried_before_the_first_chunk():
+    llm, limiter, model = synthesis_llm(failures=1)
+
+    async def stream():
+        return [r.delta async for r in await llm.astream_chat(MESSAGES)]
+
+    assert "".join(asyncio.run(stream())) == "Snus kan skade fosteret."
+    assert model.calls == 2
+    assert limiter.priorities == [PRIORITY_HIGH, PRIORITY_HIGH]
+    assert limiter.in_flight == 0
+
+
+def test_synthesis_rate_limited_after_the_retries_is_503():
+    llm, limiter, model = synthesis_llm(failures=10, max_retries=2)
+    with pytest.raises(AzureRateLimited) as error:
+        asyncio.run(llm.acomplete("Kan jeg bruke snus når jeg er gravid?"))
+    assert error.value.code == 503
+    assert model.calls == 3
+    assert limiter.in_flight == 0
+
+
+def test_sync_stream_from_a_worker_thread_is_scheduled_on_the_event_loop():
+    async def main():
+        llm, limiter, model = synthesis_llm(failures=1)
+        deltas = await asyncio.to_thread(lambda: [r.delta for r in llm.stream_chat(MESSAGES)])
+        return deltas, limiter, model
+
+    deltas, limiter, model = asyncio.run(main())
+    assert "".join(deltas) == "Snus kan skade fosteret."
+    assert model.calls == 2
+    assert limiter.priorities == [PRIORITY_HIGH, PRIORITY_HIGH]
+    assert limiter.in_flight == 0
+
+
+def test_sync_chat_without_an_event_loop_is_scheduled_on_a_private_loop():
+    llm, limiter, model = synthesis_llm(failures=0)
+    assert llm.chat(MESSAGES).message.content == "Snus kan skade fosteret."
+    assert limiter.priorities == [PRIORITY_HIGH]
+    assert limiter.in_flight == 0
+
+
+def test_sync_chat_on_the_event_loop_thread_is_refused():
+    async def main():
+        llm, _, _ = synthesis_llm(failures=0)
+        with pytest.raises(RuntimeError):
+            llm.chat(MESSAGES)
+
+    asyncio.run(main())
+
+
+@pytest.fixture
+def restore_settings_llm():
+    previous = Settings._llm
+    yield
+    Settings._llm = previous
+
+
+def test_synthesis_llm_is_only_switched_to_azure_when_configured(monkeypatch, restore_settings_llm):
+    import config
+    default = MockLLM()
+    Settings.llm = default
+    monkeypatch.setattr(config, "SYNTHESIS_LLM", "default")
+    config.create_llm()
+    assert Settings.llm is default
+
+    monkeypatch.setattr(config, "SYNTHESIS_LLM", "azure")
+    monkeypatch.setenv("AZURE_OPENAI_CONTEXT_WINDOW", "8192")
+    monkeypatch.setenv("AZURE_OPENAI_MAX_OUTPUT_TOKENS", "512")
+    config.create_llm()
+    assert isinstance(Settings.llm, ScheduledSynthesisLLM)
+    assert (Settings.llm.metadata.context_window, Settings.llm.metadata.num_output) == (8192, 512)
@@ -0,0 +1,112 @@
+import os
+import asyncio
+
+import numpy as np
+import pytest
+from llama_index.core import Settings
+
+from benchmarks.fakes import FakeEmbedding
+from build_index import build_index
+from mmap_vector_store import MMAP_POINTER, load_mmap_index, mmap_dir
+
+
+@pytest.fixture(autouse=True)
+def fake_embed_model():
+    # the loaded index resolves Settings.embed_model
+    Settings.embed_model = FakeEmbedding(dim=32)
+
+
+def write_article(directory, name: str, body: str):
+    with open(os.path.join(directory, name), "w", encoding="utf-8") as f:
+        f.write(f"---\ntitle: {name}\nurl: https://www.helsenorge.no/{name}/\n---\n{body}\n")
+
+
+def articles(tmp_path, count: int = 6):
+    source = tmp_path / "articles"
+    source.mkdir()
+    for i in range(count):
+        write_article(source, f"artikkel-{i}.md",
+                      "\n\n".join(f"Avsnitt {j} om snus nummer {i}. Snakk med fastlegen om råd og hjelp til å slutte. " * 4
+                                  for j in range(5)))
+    return str(source), str(tmp_path / "storage")
+
+
+def build(source, storage, embed_model):
+    return asyncio.run(build_index(source, storage, embed_model, chunk_size=128, chunk_overlap=0, batch_size=8))
+
+
+def embeddings_by_id(storage) -> dict:
+    store = load_mmap_index(storage).vector_store
+    return {node_id: np.array(store.embeddings[row]) for row, node_id in enumerate(store.ids)}
+
+
+def test_unchanged_chunks_reuse_their_embeddings(tmp_path):
+    source, storage = articles(tmp_path)
+    embed_model = FakeEmbedding(dim=32)
+    first = build(source, storage, embed_model)
+    assert first.embedded == first.chunks > 0
+    before = embeddings_by_id(storage)
+
+    write_article(source, "artikkel-0.md", "Helt ny tekst om søvn og trening.")
+    second = build(source, storage, embed_model)
+    assert 0 < second.embedded < second.chunks
+    assert second.reused == second.chunks - second.embedded
+    after = embeddings_by_id(storage)
+    kept = set(before) & set(after)
+    assert kept and all(np.allclose(before[i], after[i]) for i in kept)
+
+    third = build(source, storage, embed_model)
+    assert third.embedded == 0 and third.embedding_calls == 0
+
+
+def test_deleted_articles_drop_their_chunks(tmp_path):
+    source, storage = articles(tmp_path)
+    embed_model = FakeEmbedding(dim=32)
+    first = build(source, storage, embed_model)
+
+    os.remove(os.path.join(source, "artikkel-1.md"))
+    second = build(source, storage, embed_model)
+    assert second.deleted > 0
+    assert second.chunks == first.chunks - second.deleted
+    store = load_mmap_index(storage).vector_store
+    sources = {store.get_node(row).metadata["source"] for row in range(len(store))}
+    assert "artikkel-1.md" not in sources and len(store) == second.chunks
+
+
+def test_model_or_dimension_change_re_embeds_everything(tmp_path):
+    source, storage = articles(tmp_path)
+    build(source, storage, FakeEmbedding(dim=32))
+    report = build(source, storage, FakeEmbedding(dim=48))
+    assert report.reused == 0 and report.embedded == report.chunks
+    assert load_mmap_index(storage).vector_store.embeddings.shape[1] == 48
+
+
+def test_builds_are_swapped_through_the_pointer_file(tmp_path):
+    source, storage = articles(tmp_path)
+    embed_model = FakeEmbedding(dim=32)
+    build(source, storage, embed_model)
+    first = mmap_dir(storage)
+    build(source, storage, embed_model)
+    second = mmap_dir(storage)
+    build(source, storage, embed_model)
+    third = mmap_dir(storage)
+
+    assert len({first, second, third}) == 3
+    assert os.path.isfile(os.path.join(storage, MMAP_POINTER))
+    # the current and the previous build remain
+    assert not os.path.exists(first) and os.path.isdir(second) and os.path.isdir(third)
+
+
+def test_build_loads_through_config(tmp_path, loaded_indexes):
+    from benchmarks.fakes import install_fakes
+    from config import read_index_from_storage, vector_store
+
+    source, storage = articles(tmp_path)
+    embed_model = install_fakes(dim=32)
+    report = build(source, storage, embed_model)
+
+    loaded_indexes.append("bygget")
+    item = {"name": "bygget", "storage": storage, "description": "Jeg svarer på spørsmål om snus"}
+    assert read_index_from_storage(item)
+    assert vector_store.get_status("bygget") == "ready"
+    assert len(vector_store.get("bygget").index.vector_store) == report.chunks
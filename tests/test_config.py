@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+import config
+from benchmarks.fakes import build_synthetic_index, install_fakes
+from config import VectorIndexStore, reload_indexes, vector_store
+
+
+def persist(tmp_path, name: str, num_nodes: int, embed_model) -> str:
+    storage = str(tmp_path / name)
+    build_synthetic_index(num_nodes, embed_model, name=name).storage_context.persist(persist_dir=storage)
+    return storage
+
+
+@pytest.fixture
+def index_map(tmp_path, monkeypatch, loaded_indexes):
+    """Two persisted indexes and a missing one in VECTOR_INDEX_MAP."""
+    embed_model = install_fakes(dim=64)
+    items = [
+        {"name": "helse", "storage": persist(tmp_path, "helse", 30, embed_model), "description": "Helse"},
+        {"name": "artikler", "storage": persist(tmp_path, "artikler", 20, embed_model), "description": "Artikler"},
+        {"name": "borte", "storage": str(tmp_path / "borte"), "description": "Finnes ikke"},
+    ]
+    monkeypatch.setattr(config, "VECTOR_INDEX_MAP", items)
+    loaded_indexes.extend(item["name"] for item in items)
+    return items, embed_model, tmp_path
+
+
+def test_lease_keeps_the_version_a_request_started_with():
+    store = VectorIndexStore()
+    first = store.add("helse", "indeks v1", "Helse")
+    with store.lease("helse") as leased:
+        second = store.add("helse", "indeks v2", "Helse")
+        assert leased is first and store.get("helse") is second
+        assert store.versions()["retired"] == [{"name": "helse", "version": first.version, "in_flight": 1}]
+    assert store.versions()["retired"] == []
+    assert store.versions()["current"]["helse"] == {"version": second.version, "in_flight": 0}
+
+
+def test_every_index_is_loaded_with_its_own_status(index_map):
+    assert asyncio.run(reload_indexes())
+    assert vector_store.get_status("helse") == "ready" and vector_store.status["helse"]["nodes"] == 30
+    assert vector_store.get_status("artikler") == "ready" and vector_store.status["artikler"]["nodes"] == 20
+    assert vector_store.get_status("borte") == "missing"
+
+
+def test_reload_swaps_in_a_new_version_and_a_failed_one_keeps_serving(index_map, monkeypatch):
+    items, embed_model, tmp_path = index_map
+    asyncio.run(reload_indexes(["helse"]))
+    first = vector_store.get("helse")
+
+    # a new build of the index in the same directory
+    persist(tmp_path, "helse", 40, embed_model)
+    asyncio.run(reload_indexes(["helse"]))
+    second = vector_store.get("helse")
+    assert second.version > first.version
+    assert vector_store.status["helse"]["nodes"] == 40
+
+    def broken(*args, **kwargs):
+        raise OSError("docstore.json is truncated")
+
+    monkeypatch.setattr("llama_index.core.load_index_from_storage", broken)
+    assert not asyncio.run(reload_indexes(["helse"]))
+    assert vector_store.get("helse") is second
+    assert vector_store.get_status("helse") == "ready"
+    assert vector_store.status["helse"]["reload_error"] == "docstore.json is truncated"
@@ -0,0 +1,37 @@
+from llama_index.core.schema import NodeWithScore, TextNode
+
+from context_packing import TokenBudgetPostprocessor, count_tokens
+
+SNUS = "Snus i svangerskapet kan gi lav fødselsvekt og for tidlig fødsel. Snakk med jordmor om hjelp til å slutte."
+PILLER = "P-piller gir en litt høyere risiko for blodpropp. Risikoen er størst det første året du bruker dem."
+MIGRENE = "Migrene hos ungdom kan utløses av lite søvn, stress og uregelmessige måltider."
+
+
+def scored(texts: list[str]) -> list[NodeWithScore]:
+    return [NodeWithScore(node=TextNode(id_=f"chunk-{i}", text=text), score=1.0 - i / 10)
+            for i, text in enumerate(texts)]
+
+
+def pack(texts: list[str], budget: int) -> list[NodeWithScore]:
+    return TokenBudgetPostprocessor(token_budget=budget).postprocess_nodes(scored(texts))
+
+
+def test_chunk_repeating_a_better_chunk_is_dropped():
+    packed = pack([SNUS, PILLER, f"{SNUS} Les mer", MIGRENE], budget=1000)
+    assert [n.node.text for n in packed] == [SNUS, PILLER, MIGRENE]
+
+
+def test_chunks_are_packed_best_first_into_the_budget():
+    long_chunk = " ".join([PILLER] * 10)
+    budget = count_tokens(SNUS) + count_tokens(MIGRENE) + 5
+    packed = pack([SNUS, long_chunk, MIGRENE], budget)
+    # the long chunk does not fit, the smaller one after it still does
+    assert [n.node.node_id for n in packed] == ["chunk-0", "chunk-2"]
+    assert sum(count_tokens(n.node.get_content()) for n in packed) <= budget
+
+
+def test_best_chunk_over_the_budget_is_truncated():
+    long_chunk = " ".join([SNUS] * 20)
+    [node] = pack([long_chunk, PILLER], budget=50)
+    assert node.node.node_id == "chunk-0" and node.score == 1.0
+    assert long_chunk.startswith(node.node.text) and count_tokens(node.node.text) <= 50
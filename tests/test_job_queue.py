@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from config import server_settings, vector_store
+from query_utils import get_query_settings
+from job_queue import JobManager, CANCELLED
+
+
+def test_cancel_running_job_releases_slot_and_stores_nothing(fake_index, tmp_path):
+    from answer_utils import get_answer, chat_semaphore
+    from load_shedding import load_monitor
+    from request_coalescing import single_flight
+    from response_cache import response_cache
+
+    async def scenario():
+        manager = JobManager(workers=1, max_queued=4, lock_file=str(tmp_path / "jobs.lock"))
+        query_settings = get_query_settings(fake_index("Kan jeg bruke snus når jeg er gravid?"))
+        free_slots = chat_semaphore._value
+        job = manager.submit(lambda: get_answer(query_settings, server_settings, vector_store))
+        try:
+            # wait until the workflow holds its slot
+            for _ in range(200):
+                if load_monitor.running:
+                    break
+                await asyncio.sleep(0.01)
+            assert load_monitor.running == 1
+
+            manager.cancel(job.id)
+            # longer than the rest of the workflow would have taken
+            await asyncio.sleep(1.5)
+            assert job.status == CANCELLED
+            assert load_monitor.running == 0
+            assert chat_semaphore._value == free_slots
+            assert len(single_flight) == 0
+            assert response_cache.stats()["entries"] == 0
+        finally:
+            await manager.stop()
+
+    asyncio.run(scenario())
+
+
+def test_second_process_refuses_to_run_the_job_queue(tmp_path):
+    lock_file = str(tmp_path / "jobs.lock")
+
+    async def scenario():
+        first = JobManager(workers=1, lock_file=lock_file)
+        first.start()
+        try:
+            # another open file description of the lock, like a second Hypercorn worker
+            with pytest.raises(RuntimeError, match="JOB_WORKERS=0"):
+                JobManager(workers=1, lock_file=lock_file).start()
+        finally:
+            await first.stop()
+        second = JobManager(workers=1, lock_file=lock_file)
+        second.start()
+        await second.stop()
+
+    asyncio.run(scenario())
+
+
+def test_disabled_job_queue_takes_no_lock(tmp_path):
+    manager = JobManager(workers=0, lock_file=str(tmp_path / "jobs.lock"))
+    manager.start()
+    assert not manager.enabled
+    assert not (tmp_path / "jobs.lock").exists()
+
+
+def test_job_submission_is_shed_like_chat(fake_index, monkeypatch, tmp_path):
+    from app import app
+    from job_queue import job_manager
+    from load_shedding import load_monitor
+
+    monkeypatch.setattr(job_manager, "lock_file", str(tmp_path / "jobs.lock"))
+    monkeypatch.setattr(load_monitor, "expected_wait", lambda: 3600.0)
+
+    async def submit():
+        response = await app.test_client().post("/chat/jobs", json=fake_index("Kan jeg bruke snus?"))
+        return response.status_code, response.headers.get("Retry-After")
+
+    status, retry_after = asyncio.run(submit())
+    assert status == 503 and retry_after
+    assert job_manager.stats()["queued"] == 0
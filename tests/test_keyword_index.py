@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from llama_index.core.schema import TextNode
+
+from benchmarks.fakes import FakeEmbedding
+from keyword_index import HybridRetriever, KeywordIndex, node_text
+from vector_search import EmbeddingMatrix, normalize_rows
+
+FILLER = ("Mange unge lurer på hvordan de kan ta vare på helsen sin i hverdagen. "
+          "Det er lurt å snakke med noen du stoler på hvis du er bekymret. ") * 4
+TEXTS = [
+    f"{FILLER}Her kan du lese om snus når du er gravid.",
+    f"{FILLER}Her kan du lese om p-piller og blodpropp.",
+    f"{FILLER}Her kan du lese om migrene hos ungdom.",
+    "Søvn, mat og fysisk aktivitet påvirker hvordan du har det.",
+]
+
+
+def retriever(cutoff=0.7):
+    embed_model = FakeEmbedding(dim=64)
+    nodes = [TextNode(id_=f"artikkel-{i}", text=text, metadata={"title": f"Artikkel {i}"},
+                      embedding=embed_model.vector(text)) for i, text in enumerate(TEXTS)]
+    matrix = EmbeddingMatrix([n.node_id for n in nodes],
+                             normalize_rows(np.asarray([n.embedding for n in nodes], dtype=np.float32)),
+                             lambda row: nodes[row])
+    keyword_index = KeywordIndex.build([node_text(n) for n in nodes])
+    return HybridRetriever(matrix, keyword_index, similarity_top_k=3, similarity_cutoff=cutoff,
+                           embed_model=embed_model), embed_model, matrix
+
+
+def test_multi_term_match_is_lifted_over_the_cutoff_by_a_blend():
+    _, embed_model, matrix = retriever()
+    cosine = float(matrix.matrix[0] @ embed_model.vector("snus gravid"))
+    blend = 0.7 * cosine + 0.3 * 1.0
+    hybrid, _, _ = retriever(cutoff=(cosine + blend) / 2)
+
+    nodes = hybrid.retrieve("snus gravid")
+    assert [n.node.node_id for n in nodes] == ["artikkel-0"]
+    assert nodes[0].score == pytest.approx(blend)
+    assert nodes[0].score < 1.0
+
+
+def test_single_common_term_does_not_pass_a_cutoff_the_cosine_fails():
+    _, embed_model, matrix = retriever()
+    # "lese" is in three of the four articles
+    cosine = matrix.matrix @ embed_model.vector("lese")
+    hybrid, _, _ = retriever(cutoff=float(cosine.max()) + 0.01)
+    assert hybrid.retrieve("lese") == []
+
+
+def test_off_topic_question_is_cut_off():
+    hybrid, _, _ = retriever()
+    # "lese" is in most articles, "bilforsikring" in none
+    assert hybrid.retrieve("bilforsikring lese") == []
+
+
+def test_coverage_is_the_idf_share_of_the_query_terms():
+    keyword_index = KeywordIndex.build(TEXTS)
+    coverage = keyword_index.coverage("snus gravid")
+    assert coverage[0] == 1.0
+    assert coverage[1:].max() == 0.0
+    partial = keyword_index.coverage("snus bilforsikring")
+    assert 0.0 < partial[0] < 0.5
+    assert keyword_index.coverage("snus bilforsikring", min_matched_terms=2).max() == 0.0
@@ -0,0 +1,109 @@
+import asyncio
+
+from config import server_settings, vector_store
+from query_utils import get_query_settings
+
+
+def test_degraded_answer_is_not_cached(fake_index, monkeypatch):
+    from answer_utils import get_answer
+    from load_shedding import load_monitor
+    from response_cache import response_cache
+    from tracing import request_trace
+
+    question = "Kan jeg bruke snus når jeg er gravid?"
+
+    async def ask():
+        with request_trace() as trace:
+            answer = await get_answer(get_query_settings(fake_index(question)), server_settings, vector_store)
+        return answer, trace.attributes
+
+    # every optional node is skipped
+    monkeypatch.setattr(load_monitor, "degrade_queue_depth", 0)
+    answer, attributes = asyncio.run(ask())
+    assert "llm_call_title_and_summary" in attributes["skipped_nodes"]
+    assert "## Tittel" not in answer
+    assert response_cache.stats()["entries"] == 0
+
+    monkeypatch.undo()
+    answer, attributes = asyncio.run(ask())
+    assert not attributes.get("cache_hit")
+    assert "skipped_nodes" not in attributes
+    assert "## Tittel" in answer
+    assert response_cache.stats()["entries"] == 1
+
+
+def test_short_client_deadline_alone_does_not_degrade(fake_index):
+    from answer_utils import get_answer
+    from tracing import request_trace
+
+    async def ask():
+        query_settings = get_query_settings(fake_index("Hva med trening når jeg er gravid?", deadline_seconds=5))
+        with request_trace() as trace:
+            answer = await get_answer(query_settings, server_settings, vector_store)
+        return answer, trace.attributes
+
+    answer, attributes = asyncio.run(ask())
+    assert "skipped_nodes" not in attributes
+    assert "## Tittel" in answer
+
+
+def test_skip_optional_is_relative_to_the_request_time():
+    import time
+    from load_shedding import LoadMonitor
+
+    monitor = LoadMonitor(capacity=2, degrade_queue_depth=8, degrade_remaining_share=0.25)
+    now = time.monotonic()
+    assert not monitor.skip_optional(now + 5, 5)
+    assert monitor.skip_optional(now + 1, 5)
+    monitor.waiting = 8
+    assert monitor.skip_optional(now + 5, 5)
+
+
+HARD_ANSWER = ("Svangerskapsdiabetesbehandlingen innebærer blodsukkermålinger, kostholdsveiledning, "
+               "insulinbehandling og oppfølgingskonsultasjoner hos spesialisthelsetjenesten gjennom svangerskapet.")
+
+
+def readability_state(**kwargs) -> dict:
+    import time
+    now = time.monotonic()
+    return {"answer": HARD_ANSWER, "best_answer": "", "best_lix_score": 0.0, "rewrite_rounds": 0,
+            "max_rewrite_rounds": 2, "deadline": now + 30, "request_deadline": now + 30,
+            "request_seconds": 60.0, **kwargs}
+
+
+def test_readability_stopped_by_the_deadline_is_skipped_and_not_cached():
+    import time
+    from agent_workflow_structured_answer import readability_evaluator
+
+    update = readability_evaluator(readability_state(deadline=time.monotonic() - 1))
+    assert update["rewrites_stopped"]
+    assert update["skipped_nodes"] == ["llm_make_answer_more_readable"]
+
+    # all rewrite rounds used is a finished answer, not a degraded one
+    update = readability_evaluator(readability_state(rewrite_rounds=2))
+    assert update["rewrites_stopped"]
+    assert update["skipped_nodes"] == []
+
+
+def test_slow_stream_reader_does_not_hold_a_chat_slot(fake_index):
+    from answer_utils import chat_semaphore, stream_answer
+    from load_shedding import load_monitor
+
+    async def read_slowly():
+        free_slots = chat_semaphore._value
+        query_settings = get_query_settings(fake_index("Kan jeg bruke p-piller når jeg er 15?"))
+        events = stream_answer(query_settings, server_settings, vector_store)
+        names = [(await anext(events))[0]]
+        assert names == ["token"]
+        # the client stops reading; the workflow finishes in the meantime
+        for _ in range(300):
+            if load_monitor.running == 0:
+                break
+            await asyncio.sleep(0.01)
+        slot_released = load_monitor.running == 0 and chat_semaphore._value == free_slots
+        names += [name async for name, _ in events]
+        return slot_released, names
+
+    slot_released, names = asyncio.run(read_slowly())
+    assert slot_released
+    assert names[-1] == "answer" and "references" in names
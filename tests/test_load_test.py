@@ -0,0 +1,34 @@
+import os
+import sys
+import json
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_load_test(tmp_path, *args: str) -> tuple[subprocess.CompletedProcess, dict]:
+    summary = tmp_path / "summary.json"
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.load_test", "--nodes", "200", "--requests", "12", "--concurrency", "4",
+         "--llm-latency-ms", "20", "--embed-latency-ms", "2", "--jitter-ms", "0", "--warmup", "2",
+         "--json", str(summary), *args],
+        cwd=ROOT, capture_output=True, text=True, env=dict(os.environ), timeout=300,
+    )
+    with open(summary, encoding="utf-8") as f:
+        return result, json.load(f)
+
+
+def test_load_test_reports_latency_and_stages_offline(tmp_path):
+    result, summary = run_load_test(tmp_path)
+    assert result.returncode == 0, result.stdout[-2000:] + result.stderr[-2000:]
+    assert summary["requests"] == 12 and summary["errors"] == 0 and summary["shed"] == 0
+    assert 0 < summary["p50_ms"] <= summary["p95_ms"] <= summary["p99_ms"]
+    assert summary["throughput_rps"] > 0 and summary["mean_tokens"] > 0
+    # a coalesced request shares the execution, and the spans, of an identical one
+    assert summary["stages"]["llm_call_answer"]["count"] == 12 - summary["coalesced"]
+
+
+def test_missed_threshold_fails_the_run(tmp_path):
+    result, summary = run_load_test(tmp_path, "--max-p95-ms", "1")
+    assert result.returncode == 1
+    assert f"p95 {summary['p95_ms']:.0f} ms > 1 ms" in result.stdout
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from llama_index.core import Settings
+from llama_index.core.schema import QueryBundle
+from llama_index.core.vector_stores.types import VectorStoreQuery
+
+from benchmarks.fakes import FakeEmbedding, build_synthetic_index
+from mmap_vector_store import convert_storage_to_mmap, has_mmap_store, load_mmap_index
+
+
+@pytest.fixture
+def converted(tmp_path):
+    embed_model = FakeEmbedding(dim=64)
+    # the loaded index resolves Settings.embed_model
+    Settings.embed_model = embed_model
+    index = build_synthetic_index(50, embed_model, seed=2)
+    storage = str(tmp_path / "helse")
+    index.storage_context.persist(persist_dir=storage)
+    assert not has_mmap_store(storage)
+    convert_storage_to_mmap(storage)
+    assert has_mmap_store(storage)
+    return index, load_mmap_index(storage), embed_model
+
+
+def test_converted_store_keeps_every_node(converted):
+    index, mmap_index, _ = converted
+    store = mmap_index.vector_store
+    assert len(store) == 50 and store.embeddings.shape == (50, 64)
+    assert np.allclose(np.linalg.norm(store.embeddings, axis=1), 1.0)
+    for row, node_id in enumerate(store.ids):
+        original = index.docstore.get_node(node_id)
+        node = store.get_node(row)
+        assert node.node_id == node_id and node.text == original.text and node.metadata == original.metadata
+
+
+def test_query_ranks_like_the_json_store(converted):
+    index, mmap_index, embed_model = converted
+    question = "Hva bør jeg vite om søvn og trening?"
+    result = mmap_index.vector_store.query(
+        VectorStoreQuery(query_embedding=embed_model.vector(question), similarity_top_k=5))
+    expected = index.as_retriever(similarity_top_k=5, embed_model=embed_model).retrieve(QueryBundle(question))
+    # the hashed embeddings have ties, so compare the scores and the best hit
+    assert result.ids[0] == expected[0].node.node_id
+    assert np.allclose(result.similarities, [n.score for n in expected], atol=1e-5)
+
+
+def test_store_is_read_only(converted):
+    _, mmap_index, _ = converted
+    with pytest.raises(NotImplementedError):
+        mmap_index.vector_store.delete("artikkel-0")
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, TextNode
+
+from benchmarks.fakes import FakeEmbedding
+from config import IndexObject
+from multi_index import FusionRetriever, IndexRouter, cache_name, composite_entry
+from request_coalescing import embedding_batcher
+
+
+def hits(*scored: tuple[str, float]) -> list[NodeWithScore]:
+    return [NodeWithScore(node=TextNode(id_=node_id, text=node_id), score=score) for node_id, score in scored]
+
+
+class StaticRetriever(BaseRetriever):
+    def __init__(self, nodes: list[NodeWithScore]):
+        super().__init__()
+        self.nodes = nodes
+
+    def _retrieve(self, query_bundle):
+        return self.nodes
+
+
+HELSE = hits(("snus", 0.82), ("felles", 0.80), ("søvn", 0.75))
+ARTIKLER = hits(("p-piller", 0.91), ("felles", 0.88), ("migrene", 0.60))
+
+
+def test_reciprocal_rank_fusion_ranks_a_node_found_by_both_indexes_first():
+    retriever = FusionRetriever({"helse": StaticRetriever(HELSE), "artikler": StaticRetriever(ARTIKLER)},
+                                similarity_top_k=3, mode="rrf")
+    nodes = asyncio.run(retriever.aretrieve("snus"))
+    assert nodes[0].node.node_id == "felles"
+    assert {n.node.node_id for n in nodes[1:]} == {"p-piller", "snus"}
+    # the node keeps its best cosine, not the fused score
+    assert nodes[0].score == 0.88
+
+
+def test_min_max_fusion_compares_the_indexes_on_their_own_scale():
+    retriever = FusionRetriever({"helse": StaticRetriever(HELSE), "artikler": StaticRetriever(ARTIKLER)},
+                                similarity_top_k=6, mode="minmax")
+    nodes = retriever.retrieve("snus")
+    assert [n.node.node_id for n in nodes][:2] in (["snus", "p-piller"], ["p-piller", "snus"])
+    assert [n.node.node_id for n in nodes][-2:] == ["søvn", "migrene"]
+
+
+def test_unknown_fusion_mode_is_refused():
+    with pytest.raises(ValueError):
+        FusionRetriever({}, mode="max")
+
+
+def test_router_keeps_the_indexes_close_to_the_question(monkeypatch):
+    monkeypatch.setattr(embedding_batcher, "embed_model", FakeEmbedding(dim=256))
+    members = [IndexObject("snus", None, "snus og nikotin i svangerskapet", 1),
+               IndexObject("bil", None, "forsikring av bil og motorsykkel", 1)]
+    router = IndexRouter(margin=0.1, max_indexes=3)
+    question = FakeEmbedding(dim=256).vector("kan jeg bruke snus i svangerskapet")
+    selected = asyncio.run(router.select(members, question))
+    assert [m.name for m in selected] == ["snus"]
+
+    # a reload replaces the description vector of the old version
+    reloaded = [members[0]._replace(version=2), members[1]]
+    asyncio.run(router.select(reloaded, question))
+    assert set(router._vectors) == {("snus", 2), ("bil", 1)}
+
+
+def test_cache_name_of_a_composite_changes_with_the_member_versions():
+    helse, artikler = IndexObject("helse", None, "Helse.", 1), IndexObject("artikler", None, "Artikler", 4)
+    entry = composite_entry("artikler+helse", [artikler, helse])
+    assert entry.description == "Artikler. Helse"
+    assert cache_name(entry) == "artikler+helse@artikler:4,helse:1"
+    assert cache_name(composite_entry("artikler+helse", [artikler, helse._replace(version=2)])) != cache_name(entry)
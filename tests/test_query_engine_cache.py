@@ -0,0 +1,46 @@
+from benchmarks.fakes import build_synthetic_index, install_fakes
+from config import IndexObject
+from query_engine_cache import QueryEngineCache
+from query_utils import QuerySettings
+
+
+def test_engine_is_built_once_per_index_version_and_settings():
+    embed_model = install_fakes(dim=64)
+    index = build_synthetic_index(20, embed_model)
+    cache = QueryEngineCache(max_entries=8)
+
+    engine = cache.get("helse", index, QuerySettings(), version=1)
+    assert cache.get("helse", index, QuerySettings(), version=1) is engine
+    assert cache.get("helse", index, QuerySettings(similarity_top_k=3), version=1) is not engine
+    assert cache.get("helse", index, QuerySettings(), streaming=True, version=1) is not engine
+    assert cache.get("helse", index, QuerySettings(), version=2) is not engine
+    assert len(cache) == 4
+
+
+def test_least_recently_used_engine_is_evicted():
+    embed_model = install_fakes(dim=64)
+    index = build_synthetic_index(20, embed_model)
+    cache = QueryEngineCache(max_entries=2)
+
+    first = cache.get("helse", index, QuerySettings(similarity_top_k=1))
+    cache.get("helse", index, QuerySettings(similarity_top_k=2))
+    assert cache.get("helse", index, QuerySettings(similarity_top_k=1)) is first
+    cache.get("helse", index, QuerySettings(similarity_top_k=3))
+    assert len(cache) == 2
+    assert cache.get("helse", index, QuerySettings(similarity_top_k=1)) is first
+
+
+def test_invalidating_a_version_drops_the_engines_fused_from_it():
+    embed_model = install_fakes(dim=64)
+    helse = IndexObject("helse", build_synthetic_index(20, embed_model, name="helse"), "Helse", 1)
+    artikler = IndexObject("artikler", build_synthetic_index(20, embed_model, name="artikler"), "Artikler", 2)
+    cache = QueryEngineCache(max_entries=8)
+
+    fused = cache.get_fused([artikler, helse], QuerySettings())
+    # the fused engine and the engines of both members
+    assert len(cache) == 3
+    assert cache.get_fused([artikler, helse], QuerySettings()) is fused
+
+    cache.invalidate("helse", version=1)
+    assert len(cache) == 1
+    assert cache.get_fused([artikler, helse], QuerySettings()) is not fused
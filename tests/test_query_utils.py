@@ -0,0 +1,19 @@
+import pytest
+
+from config import CustomError
+from query_utils import get_query_settings
+
+QUESTION = [{"role": "user", "content": "Kan jeg bruke snus når jeg er gravid?"}]
+
+
+def test_list_of_indexes_is_searched_as_one():
+    query_settings = get_query_settings({"vectorIndex": ["helse", "artikler", "helse"], "messages": QUESTION})
+    assert query_settings.vectorIndex == "artikler+helse"
+    assert query_settings.indexes == ["artikler", "helse"]
+    assert query_settings.multi_index
+
+
+def test_empty_list_of_indexes_is_rejected():
+    with pytest.raises(CustomError) as e:
+        get_query_settings({"vectorIndex": [], "messages": QUESTION})
+    assert e.value.code == 400
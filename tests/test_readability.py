@@ -0,0 +1,50 @@
+from readability import hard_sentences, paragraph_lix, parse_rewrites, rewrite_prompt, splice, split_sentences
+
+LIST_ANSWER = """Dette kan du gjøre:
+
+- Kontakt helsesykepleieren på skolen din dersom menstruasjonssmertene forstyrrer skolearbeidet ditt.
+- Drikk vann.
+1. Bestill en konsultasjon hos fastlegen for undersøkelse og eventuell behandlingsvurdering.
+2) Hvil."""
+
+
+def test_list_markers_are_not_part_of_a_sentence():
+    texts = [s.text for s in split_sentences(LIST_ANSWER)]
+    assert texts == [
+        "Dette kan du gjøre:",
+        "Kontakt helsesykepleieren på skolen din dersom menstruasjonssmertene forstyrrer skolearbeidet ditt.",
+        "Drikk vann.",
+        "Bestill en konsultasjon hos fastlegen for undersøkelse og eventuell behandlingsvurdering.",
+        "Hvil.",
+    ]
+
+
+def test_rewrite_keeps_the_list_formatting():
+    sentences = hard_sentences(LIST_ANSWER)
+    assert [s.text[:7] for s in sentences] == ["Kontakt", "Bestill"]
+    prompt = rewrite_prompt(sentences, "")
+    assert "1: Kontakt" in prompt and "2: Bestill" in prompt and "- " not in prompt
+
+    rewrites = parse_rewrites("1: - Snakk med helsesykepleieren.\n2: Gå til fastlegen.", 2)
+    assert splice(LIST_ANSWER, sentences, rewrites) == """Dette kan du gjøre:
+
+- Snakk med helsesykepleieren.
+- Drikk vann.
+1. Gå til fastlegen.
+2) Hvil."""
+
+
+def test_rewrite_of_a_date_keeps_its_number():
+    assert parse_rewrites("1: 17. mai er fridag.", 1) == ["17. mai er fridag."]
+
+
+def test_hard_paragraph_is_picked_when_no_sentence_is_above_the_limit():
+    easy = "Du kan ringe oss. Vi svarer raskt. Det er gratis."
+    hard = ("Helsestasjonen tilbyr samtaler om prevensjon. Legemiddelbehandling vurderes individuelt. "
+            "Spørsmål besvares.")
+    text = f"{easy}\n\n{hard}"
+    (_, _, easy_lix), (start, _, hard_lix) = paragraph_lix(text)
+    assert easy_lix < 50 < hard_lix
+
+    sentences = hard_sentences(text, limit=100)
+    assert sentences and all(s.start >= start and s.lix > hard_lix for s in sentences)
@@ -0,0 +1,75 @@
+import asyncio
+
+from benchmarks.fakes import FakeEmbedding
+from request_coalescing import EmbeddingBatcher, SingleFlight
+
+
+class AsymmetricEmbedding(FakeEmbedding):
+    """Embeds queries with an instruction prefix, like the E5 and BGE models."""
+    embeds_queries_as_texts = False
+
+    async def _aget_query_embedding(self, query: str) -> list[float]:
+        return self.vector(f"query: {query}")
+
+
+async def embed_concurrently(batcher, texts):
+    futures = [asyncio.ensure_future(batcher.embed(t)) for t in texts]
+    await asyncio.sleep(0)
+    assert len(batcher._batches) == 1
+    embeddings = await asyncio.gather(*futures)
+    assert not batcher._batches
+    return embeddings
+
+
+def test_batch_of_a_symmetric_model_is_one_text_request():
+    embed_model = FakeEmbedding(dim=64)
+    calls = []
+    original = embed_model._aget_text_embeddings
+
+    async def counted(texts):
+        calls.append(texts)
+        return await original(texts)
+
+    object.__setattr__(embed_model, "_aget_text_embeddings", counted)
+    batcher = EmbeddingBatcher(window_ms=50, max_batch_size=3, embed_model=embed_model)
+    texts = ["snus gravid", "migrene", "snus gravid"]
+    embeddings = asyncio.run(embed_concurrently(batcher, texts))
+    assert calls == [["snus gravid", "migrene"]]
+    assert embeddings == [embed_model.vector(t) for t in texts]
+
+
+def test_batch_of_an_asymmetric_model_uses_query_embeddings():
+    embed_model = AsymmetricEmbedding(dim=64)
+    batcher = EmbeddingBatcher(window_ms=50, max_batch_size=2, embed_model=embed_model)
+    embeddings = asyncio.run(embed_concurrently(batcher, ["snus gravid", "migrene"]))
+    assert embeddings == [embed_model.vector("query: snus gravid"), embed_model.vector("query: migrene")]
+
+
+def test_execution_survives_a_cancelled_caller_and_stops_with_the_last():
+    async def scenario():
+        flight = SingleFlight()
+        started, finished = asyncio.Event(), []
+
+        async def work():
+            started.set()
+            await asyncio.sleep(0.2)
+            finished.append(True)
+            return "svar"
+
+        leader = asyncio.ensure_future(flight.do("k", work))
+        follower = asyncio.ensure_future(flight.do("k", work))
+        await started.wait()
+        follower.cancel()
+        assert await leader == "svar"
+
+        finished.clear()
+        first = asyncio.ensure_future(flight.do("k", work))
+        second = asyncio.ensure_future(flight.do("k", work))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        second.cancel()
+        await asyncio.sleep(0.3)
+        assert not finished
+        assert len(flight) == 0
+
+    asyncio.run(scenario())
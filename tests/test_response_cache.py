@@ -0,0 +1,56 @@
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from response_cache import CacheEntry, InMemoryCacheBackend, SemanticResponseCache, normalize
+
+SETTINGS = SimpleNamespace(response_mode="packed", similarity_top_k=10, similarity_cutoff=0.7, retrieval_mode="hybrid")
+
+
+def vector(*values) -> list:
+    return list(np.asarray(values, dtype=np.float32))
+
+
+def cache(ttl_seconds: float = 3600) -> SemanticResponseCache:
+    return SemanticResponseCache(InMemoryCacheBackend(max_entries=10), threshold=0.95, ttl_seconds=ttl_seconds)
+
+
+def test_close_question_hits_and_a_different_one_misses():
+    response_cache = cache()
+    response_cache.store("helse", SETTINGS, vector(1, 0, 0), "## Svar om snus", [])
+
+    hit = response_cache.lookup("helse", SETTINGS, vector(1, 0.1, 0))
+    assert hit is not None and hit.structured_answer == "## Svar om snus"
+    assert response_cache.lookup("helse", SETTINGS, vector(0, 1, 0)) is None
+    assert response_cache.lookup("annen", SETTINGS, vector(1, 0, 0)) is None
+    other_settings = SimpleNamespace(**{**vars(SETTINGS), "similarity_top_k": 3})
+    assert response_cache.lookup("helse", other_settings, vector(1, 0, 0)) is None
+    assert response_cache.stats()["hits"] == 1 and response_cache.stats()["misses"] == 3
+
+
+def test_expired_entry_misses_and_is_dropped():
+    response_cache = cache(ttl_seconds=60)
+    response_cache.backend.put(CacheEntry("helse", response_cache.settings_key(SETTINGS), normalize(vector(1, 0, 0)),
+                                          "## Gammelt svar", created_at=time.time() - 61))
+    response_cache.store("helse", SETTINGS, vector(0, 1, 0), "## Nytt svar", [])
+
+    assert response_cache.lookup("helse", SETTINGS, vector(1, 0, 0)) is None
+    assert len(response_cache.backend) == 1
+    assert response_cache.lookup("helse", SETTINGS, vector(0, 1, 0)).structured_answer == "## Nytt svar"
+
+
+def test_stacked_embeddings_are_reused_until_an_entry_is_stored():
+    response_cache = cache()
+    backend = response_cache.backend
+    key = response_cache.settings_key(SETTINGS)
+    response_cache.store("helse", SETTINGS, vector(1, 0, 0), "## Svar", [])
+
+    matrix = backend.matrix("helse", key)
+    response_cache.lookup("helse", SETTINGS, vector(0, 1, 0))
+    assert backend.matrix("helse", key) is matrix
+
+    response_cache.store("helse", SETTINGS, vector(0, 1, 0), "## Svar 2", [])
+    assert backend.matrix("helse", key).embeddings.shape == (2, 3)
+    response_cache.invalidate("helse")
+    assert backend.matrix("helse", key).entries == []
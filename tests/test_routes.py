@@ -0,0 +1,115 @@
+import json
+import time
+import asyncio
+
+import pytest
+from quart import Quart
+
+from routes import register_routes
+
+
+@pytest.fixture
+def client(fake_index):
+    app = Quart(__name__)
+    register_routes(app)
+    return app.test_client(), fake_index
+
+
+def parse_sse(body: str) -> list[tuple[str, dict]]:
+    events = []
+    for block in body.strip().split("\n\n"):
+        event, data = block.split("\n", 1)
+        events.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    return events
+
+
+def test_chat_answers_with_a_trace_of_every_stage(client):
+    client, payload = client
+
+    async def scenario():
+        response = await client.post("/chat", json=payload("Kan jeg bruke snus når jeg er gravid?", debug=True))
+        assert response.status_code == 200
+        return await response.get_json()
+
+    result = asyncio.run(scenario())
+    assert "## Lettlest svar" in result["answer"]
+    trace = result["trace"]
+    spans = {s["name"]: s for s in trace["spans"]}
+    assert {"embed_query", "response_cache_lookup", "retrieve_nodes", "validate_response",
+            "llm_call_answer", "aggregator"} <= set(spans)
+    assert spans["llm_call_answer"]["llm_calls"] == 1 and spans["llm_call_answer"]["prompt_tokens"] > 0
+    assert trace["prompt_tokens"] >= spans["llm_call_answer"]["prompt_tokens"]
+    assert trace["cache_hit"] is False and trace["context_chunks"] > 0
+
+
+def test_concurrent_chats_do_not_wait_for_each_other(client):
+    client, payload = client
+
+    async def chat(question: str) -> float:
+        started = time.perf_counter()
+        response = await client.post("/chat", json=payload(question))
+        assert response.status_code == 200
+        return time.perf_counter() - started
+
+    async def scenario():
+        single = await chat("Hva med trening når jeg er gravid?")
+        started = time.perf_counter()
+        await asyncio.gather(*(chat(f"Kan jeg ta p-piller når jeg er {age}?") for age in (15, 16, 17, 18)))
+        return single, time.perf_counter() - started
+
+    single, together = asyncio.run(scenario())
+    # every answer waits for the fake LLM; run one after the other four would take 4x as long
+    assert together < 2 * single
+
+
+def test_stream_sends_the_tokens_before_the_answer(client):
+    client, payload = client
+
+    async def scenario():
+        response = await client.post("/chat/stream", json=payload("Kan jeg bruke snus når jeg er gravid?"))
+        assert response.status_code == 200
+        assert response.mimetype == "text/event-stream"
+        return parse_sse(await response.get_data(as_text=True))
+
+    events = asyncio.run(scenario())
+    names = [event for event, _ in events]
+    first_other = next(i for i, name in enumerate(names) if name != "token")
+    assert first_other > 0 and "token" not in names[first_other:]
+    assert names[-2:] == ["answer", "done"]
+    answer = events[-2][1]
+    assert "".join(data["text"] for event, data in events if event == "token") == answer["answer"]
+    assert answer["answer"] in answer["structured_answer"]
+
+
+def test_off_topic_question_is_rejected_without_synthesis(client):
+    client, payload = client
+
+    async def scenario():
+        response = await client.post("/chat", json=payload("Hvordan bytter jeg dekk på bilen?",
+                                                             similarity_cutoff=0.99, debug=True))
+        return await response.get_json()
+
+    result = asyncio.run(scenario())
+    assert result["answer"].startswith("Jeg beklager!")
+    names = {s["name"] for s in result["trace"]["spans"]}
+    assert "validate_response" in names and "llm_call_answer" not in names
+    assert result["trace"]["prompt_tokens"] == 0
+
+
+def test_chat_on_an_index_still_loading_is_503(client):
+    from config import vector_store
+
+    client, payload = client
+    vector_store.set_status("lastes", "loading")
+
+    async def scenario():
+        response = await client.post("/chat", json={**payload("Hva er migrene?"), "vectorIndex": "lastes"})
+        status = await (await client.get("/status")).get_json()
+        return response.status_code, status
+
+    try:
+        code, status = asyncio.run(scenario())
+    finally:
+        vector_store.status.pop("lastes", None)
+    assert code == 503
+    assert status["indexes"]["lastes"]["state"] == "loading" and status["indexes"]["helse"]["state"] == "ready"
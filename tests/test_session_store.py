@@ -0,0 +1,48 @@
+import asyncio
+
+from langchain_core.messages import AIMessage
+
+from session_store import SessionStore
+
+
+class SummaryLLM:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = 0
+
+    async def ainvoke(self, messages, config=None):
+        self.calls += 1
+        await asyncio.sleep(0)
+        if self.fail:
+            raise RuntimeError("azure timeout")
+        return AIMessage(content="Brukeren spurte om snus i svangerskapet.")
+
+
+def store():
+    return SessionStore(ttl=60, max_sessions=10, max_bytes=1_000_000, recent_turns=1)
+
+
+async def record_two_turns(sessions, llm):
+    sessions.record("samtale", "Er snus farlig?", "Ja, snus kan skade fosteret.", llm)
+    session = sessions.record("samtale", "Hva med nikotinplaster?", "Snakk med jordmor.", llm)
+    assert len(sessions._fold_tasks) == 1
+    await asyncio.gather(*sessions._fold_tasks)
+    assert not sessions._fold_tasks
+    return session
+
+
+def test_fold_summarizes_the_turns_out_of_the_recent_window():
+    llm = SummaryLLM()
+    session = asyncio.run(record_two_turns(store(), llm))
+    assert llm.calls == 1
+    assert session.summary == "Brukeren spurte om snus i svangerskapet."
+    assert session.pending == [] and not session.folding
+
+
+def test_failed_fold_keeps_the_turns_pending():
+    llm = SummaryLLM(fail=True)
+    session = asyncio.run(record_two_turns(store(), llm))
+    assert session.summary == ""
+    assert [t.question for t in session.pending] == ["Er snus farlig?"]
+    assert "Er snus farlig?" in session.context()
+    assert not session.folding
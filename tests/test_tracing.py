@@ -0,0 +1,49 @@
+import asyncio
+
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, LLMResult
+
+from tracing import annotate, record_llm_usage, record_retry, request_trace, span, token_usage_callback, traced_node
+
+
+@traced_node
+async def llm_call_title(state):
+    token_usage_callback.on_llm_end(LLMResult(generations=[[ChatGeneration(message=AIMessage(
+        content="Snus i svangerskapet", usage_metadata={"input_tokens": 40, "output_tokens": 6, "total_tokens": 46}))]]))
+    return {"query_short_version": "Snus i svangerskapet"}
+
+
+@traced_node
+def references_generator(state):
+    # the streaming path already produced them
+    return {}
+
+
+def test_spans_count_the_usage_and_retries_inside_them():
+    async def scenario():
+        with request_trace() as trace:
+            with span("llm_call_answer"):
+                record_retry()
+                record_llm_usage(1200, 80)
+            await llm_call_title({})
+            references_generator({})
+            annotate(cache_hit=False)
+        return trace.to_dict()
+
+    trace = asyncio.run(scenario())
+    spans = {s["name"]: s for s in trace["spans"]}
+    # a node that returned nothing did no work and is left out
+    assert set(spans) == {"llm_call_answer", "llm_call_title"}
+    assert spans["llm_call_answer"] | {"start": 0, "seconds": 0} == {
+        "name": "llm_call_answer", "start": 0, "seconds": 0, "llm_calls": 1,
+        "prompt_tokens": 1200, "completion_tokens": 80, "retries": 1}
+    assert spans["llm_call_title"]["prompt_tokens"] == 40 and spans["llm_call_title"]["completion_tokens"] == 6
+    assert (trace["prompt_tokens"], trace["completion_tokens"], trace["retries"]) == (1240, 86, 1)
+    assert trace["cache_hit"] is False
+
+
+def test_usage_outside_a_request_is_not_recorded_on_one():
+    record_llm_usage(10, 1)
+    with request_trace() as trace:
+        pass
+    assert trace.spans == [] and trace.prompt_tokens == 0
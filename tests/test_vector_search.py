@@ -0,0 +1,38 @@
+import numpy as np
+from llama_index.core.schema import QueryBundle
+
+from benchmarks.fakes import FakeEmbedding, build_synthetic_index
+from vector_search import NumpyVectorRetriever, get_embedding_matrix, normalize_rows, top_k_similarities_batch
+
+
+def test_top_k_matches_a_full_sort():
+    rng = np.random.default_rng(0)
+    matrix = normalize_rows(rng.normal(size=(500, 32)))
+    queries = normalize_rows(rng.normal(size=(4, 32)))
+    for query, (rows, scores) in zip(queries, top_k_similarities_batch(matrix, queries, k=10)):
+        expected = np.argsort(-(matrix @ query))[:10]
+        assert rows.tolist() == expected.tolist()
+        assert np.allclose(scores, matrix[expected] @ query)
+
+
+def test_rows_below_the_cutoff_are_not_returned():
+    matrix = normalize_rows(np.asarray([[1, 0], [1, 1], [0, 1], [-1, 0]], dtype=np.float32))
+    [(rows, scores)] = top_k_similarities_batch(matrix, np.asarray([[1, 0]], dtype=np.float32), k=4, cutoff=0.5)
+    assert rows.tolist() == [0, 1]
+    assert scores[0] == 1.0 and scores[1] > 0.7
+    [(rows, _)] = top_k_similarities_batch(matrix, np.asarray([[1, 0]], dtype=np.float32), k=4, cutoff=1.5)
+    assert rows.size == 0
+
+
+def test_retriever_returns_the_same_nodes_as_the_simple_vector_store():
+    embed_model = FakeEmbedding(dim=64)
+    index = build_synthetic_index(100, embed_model, seed=3)
+    question = "Hva bør jeg vite om søvn og trening?"
+
+    matrix = get_embedding_matrix(index)
+    assert get_embedding_matrix(index) is matrix
+    nodes = NumpyVectorRetriever(matrix, similarity_top_k=5, embed_model=embed_model).retrieve(question)
+    expected = index.as_retriever(similarity_top_k=5, embed_model=embed_model).retrieve(QueryBundle(question))
+    # the hashed embeddings have ties, so compare the scores and the best hit
+    assert nodes[0].node.node_id == expected[0].node.node_id
+    assert np.allclose([n.score for n in nodes], [n.score for n in expected], atol=1e-5)
@@ -0,0 +1,100 @@
+import time
+import asyncio
+
+import httpx
+import openai
+import pytest
+from langchain_core.messages import AIMessage
+
+from agent_workflow_structured_answer import (TitleAndSummary, llm_call_title_and_summary, llm_make_answer_more_readable,
+                                              readability_evaluator, route_readability)
+
+
+class StructuredOutputLLM:
+    """Chat model stub: with_structured_output() returns `structured`, or raises it when it is an exception."""
+    def __init__(self, structured):
+        self.structured = structured
+        self.prompts = []
+        self.structured_kwargs = None
+
+    def with_structured_output(self, schema, **kwargs):
+        self.structured_kwargs = kwargs
+        llm = self
+
+        class Runnable:
+            async def ainvoke(self, prompt, config=None):
+                if isinstance(llm.structured, Exception):
+                    raise llm.structured
+                return llm.structured
+        return Runnable()
+
+    async def ainvoke(self, prompt, config=None):
+        self.prompts.append(prompt)
+        return AIMessage(content="Snus i svangerskapet")
+
+
+def bad_request() -> openai.BadRequestError:
+    request = httpx.Request("POST", "https://example.openai.azure.com/openai/deployments/x/chat/completions")
+    return openai.BadRequestError("response_format json_schema is not supported",
+                                  response=httpx.Response(400, request=request), body=None)
+
+
+def state(llm) -> dict:
+    return {"llm": llm, "query": "Kan jeg bruke snus når jeg er gravid?",
+            "request_deadline": time.monotonic() + 60, "request_seconds": 60}
+
+
+def test_title_and_summary_in_one_structured_call():
+    llm = StructuredOutputLLM(TitleAndSummary(title="Snus og graviditet", summary="Jeg lurer på snus."))
+    result = asyncio.run(llm_call_title_and_summary(state(llm)))
+    assert result == {"query_short_version": "Snus og graviditet", "query_summary": "Jeg lurer på snus."}
+    assert llm.structured_kwargs == {"method": "function_calling"}
+    assert llm.prompts == []
+
+
+@pytest.mark.parametrize("structured", [
+    bad_request(),
+    NotImplementedError(),
+    None,
+    TitleAndSummary(title="", summary="Jeg lurer på snus."),
+])
+def test_title_and_summary_falls_back_to_two_calls(structured):
+    llm = StructuredOutputLLM(structured)
+    result = asyncio.run(llm_call_title_and_summary(state(llm)))
+    assert result == {"query_short_version": "Snus i svangerskapet", "query_summary": "Snus i svangerskapet"}
+    assert len(llm.prompts) == 2
+
+
+HARD = ("Svangerskapsdiabetesbehandlingen innebærer blodsukkermålinger, kostholdsveiledning, insulinbehandling "
+        "og oppfølgingskonsultasjoner hos spesialisthelsetjenesten gjennom svangerskapet.")
+HARDER = ("Svangerskapsdiabetesbehandlingen innebærer kontinuerlige blodsukkermålinger, individualisert "
+          "kostholdsveiledning, insulinbehandling og oppfølgingskonsultasjoner hos spesialisthelsetjenesten.")
+
+
+class RewritingLLM:
+    """Rewrites every hard sentence into an even harder one."""
+    def __init__(self):
+        self.calls = 0
+
+    async def ainvoke(self, prompt, config=None):
+        self.calls += 1
+        return AIMessage(content=f"1: {HARDER}")
+
+
+def test_readability_loop_stops_after_the_last_round_with_the_best_answer():
+    llm = RewritingLLM()
+    loop_state = {**state(llm), "answer": HARD, "best_answer": "", "best_lix_score": 0.0, "rewrite_rounds": 0,
+                  "max_rewrite_rounds": 2, "rewrites_stopped": False, "deadline": time.monotonic() + 60}
+
+    async def run():
+        while True:
+            loop_state.update(readability_evaluator(loop_state))
+            if route_readability(loop_state) == "ok":
+                return
+            loop_state.update(await llm_make_answer_more_readable(loop_state))
+
+    asyncio.run(run())
+    assert llm.calls == 2 and loop_state["rewrite_rounds"] == 2
+    assert loop_state["rewrites_stopped"] and loop_state["skipped_nodes"] == []
+    # no rewrite was easier to read than the first answer
+    assert loop_state["answer"] == HARD
@@ -0,0 +1,207 @@
+# tracing.py
+#
+# Per-request trace of where a /chat request spends its time and tokens.
+# A RequestTrace lives in a context variable for the duration of the request; every
+# workflow node and request stage records a Span with its wall time, LLM token usage
+# and retries. Spans also feed the Prometheus histograms served on /metrics.
+
+import time
+import inspect
+import functools
+import contextvars
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from typing import Any
+
+from langchain_core.callbacks import BaseCallbackHandler
+from llama_index.core.instrumentation import get_dispatcher
+from llama_index.core.instrumentation.event_handlers import BaseEventHandler
+from llama_index.core.instrumentation.events.llm import LLMChatEndEvent, LLMCompletionEndEvent
+
+from metrics import STAGE_SECONDS, LLM_TOKENS, CHAT_REQUEST_SECONDS, CHAT_REQUEST_TOKENS
+
+
+@dataclass
+class Span:
+    name: str
+    start: float = 0.0  # seconds after the start of the request
+    seconds: float = 0.0
+    llm_calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    retries: int = 0
+
+
+class RequestTrace:
+    """Spans of one request; wall time, token usage and retries per stage."""
+    def __init__(self, **labels):
+        self.labels = labels
+        self.started = time.perf_counter()
+        self.spans: list[Span] = []
+        self.attributes: dict[str, Any] = {}
+
+    @property
+    def prompt_tokens(self) -> int:
+        return sum(s.prompt_tokens for s in self.spans)
+
+    @property
+    def completion_tokens(self) -> int:
+        return sum(s.completion_tokens for s in self.spans)
+
+    def to_dict(self) -> dict:
+        return {
+            "seconds": round(time.perf_counter() - self.started, 4),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "retries": sum(s.retries for s in self.spans),
+            **self.attributes,
+            "spans": [
+                {**asdict(s), "start": round(s.start, 4), "seconds": round(s.seconds, 4)}
+                for s in sorted(self.spans, key=lambda s: s.start)
+            ],
+        }
+
+
+_current_trace: contextvars.ContextVar[RequestTrace | None] = contextvars.ContextVar("request_trace", default=None)
+_current_span: contextvars.ContextVar[Span | None] = contextvars.ContextVar("trace_span", default=None)
+
+
+def current_trace() -> RequestTrace | None:
+    return _current_trace.get()
+
+
+@contextmanager
+def request_trace(**labels):
+    """Trace everything run in this context; labels go on the request-level histograms."""
+    trace = RequestTrace(**labels)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        CHAT_REQUEST_SECONDS.observe(time.perf_counter() - trace.started, **labels)
+        CHAT_REQUEST_TOKENS.observe(trace.prompt_tokens + trace.completion_tokens, **labels)
+
+
+def annotate(**attributes):
+    """Attach attributes (cache hit, coalesced, ...) to the current request trace."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.attributes.update(attributes)
+
+
+def _begin_span(name: str) -> tuple[Span, contextvars.Token]:
+    trace = _current_trace.get()
+    current = Span(name, start=time.perf_counter() - trace.started if trace else 0.0)
+    return current, _current_span.set(current)
+
+
+def _end_span(current: Span, token: contextvars.Token, started: float, keep: bool = True):
+    current.seconds = time.perf_counter() - started
+    _current_span.reset(token)
+    if not keep:
+        return
+    STAGE_SECONDS.observe(current.seconds, stage=current.name)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.spans.append(current)
+
+
+@contextmanager
+def span(name: str):
+    """Time a stage of the request; LLM usage and retries inside it are counted on it."""
+    current, token = _begin_span(name)
+    started = time.perf_counter()
+    try:
+        yield current
+    finally:
+        _end_span(current, token, started)
+
+
+def traced_node(fn):
+    """
+    Record a workflow node as a span named after the function. A node returning an empty
+    update did nothing (e.g. work already done by the streaming path) and is not recorded.
+    """
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_node(state):
+            current, token = _begin_span(fn.__name__)
+            started = time.perf_counter()
+            update = None
+            try:
+                update = await fn(state)
+                return update
+            finally:
+                _end_span(current, token, started, keep=bool(update) or current.llm_calls > 0)
+        return async_node
+
+    @functools.wraps(fn)
+    def node(state):
+        current, token = _begin_span(fn.__name__)
+        started = time.perf_counter()
+        update = None
+        try:
+            update = fn(state)
+            return update
+        finally:
+            _end_span(current, token, started, keep=bool(update) or current.llm_calls > 0)
+    return node
+
+
+def record_llm_usage(prompt_tokens: int, completion_tokens: int):
+    current = _current_span.get()
+    stage = current.name if current else "unknown"
+    LLM_TOKENS.inc(prompt_tokens, stage=stage, kind="prompt")
+    LLM_TOKENS.inc(completion_tokens, stage=stage, kind="completion")
+    if current is not None:
+        current.llm_calls += 1
+        current.prompt_tokens += prompt_tokens
+        current.completion_tokens += completion_tokens
+
+
+def record_retry():
+    current = _current_span.get()
+    if current is not None:
+        current.retries += 1
+
+
+class TokenUsageCallback(BaseCallbackHandler):
+    """Token usage of LangChain chat model calls, including structured output calls."""
+    run_inline = True
+
+    def on_llm_end(self, response, **kwargs):
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    record_llm_usage(usage.get("input_tokens", 0), usage.get("output_tokens", 0))
+                    return
+        token_usage = (response.llm_output or {}).get("token_usage") or {}
+        if token_usage:
+            record_llm_usage(token_usage.get("prompt_tokens", 0), token_usage.get("completion_tokens", 0))
+
+
+class LlamaIndexTokenHandler(BaseEventHandler):
+    """Token usage of llama_index LLM calls (response synthesis), from its instrumentation events."""
+    @classmethod
+    def class_name(cls) -> str:
+        return "LlamaIndexTokenHandler"
+
+    def handle(self, event, **kwargs):
+        if not isinstance(event, (LLMChatEndEvent, LLMCompletionEndEvent)) or event.response is None:
+            return
+        counts = event.response.additional_kwargs or {}
+        if "prompt_tokens" not in counts:
+            usage = getattr(event.response.raw, "usage", None) if event.response.raw is not None else None
+            if usage is None and isinstance(event.response.raw, dict):
+                usage = event.response.raw.get("usage")
+            if usage is None:
+                return
+            counts = usage if isinstance(usage, dict) else usage.model_dump()
+        record_llm_usage(counts.get("prompt_tokens", 0) or 0, counts.get("completion_tokens", 0) or 0)
+
+
+# instantiate the singletons
+token_usage_callback = TokenUsageCallback()
+get_dispatcher().add_event_handler(LlamaIndexTokenHandler())
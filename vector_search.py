@@ -0,0 +1,146 @@
+# vector_search.py
+#
+# Vectorized similarity search over one normalized embedding matrix per index,
+# replacing the per-node Python loop of the simple vector store.
+
+import os
+import logging
+import threading
+import weakref
+from typing import Callable, List
+
+import numpy as np
+from llama_index.core import Settings, VectorStoreIndex
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import BaseNode, NodeWithScore, QueryBundle
+
+# set to false to fall back to the retriever of the index' own vector store
+NUMPY_RETRIEVER = os.getenv('NUMPY_RETRIEVER', 'true').lower() == 'true'
+
+
+def top_k_similarities_batch(
+    matrix: np.ndarray,
+    queries: np.ndarray,
+    k: int,
+    cutoff: float | None = None
+) -> list[tuple[np.ndarray, np.ndarray]]:
+    """
+    Top-k rows of `matrix` for every row of `queries` (both L2-normalized), as
+    (row indices, cosine similarities) pairs sorted by descending similarity.
+    Rows scoring below `cutoff` are masked out before ranking.
+    """
+    # one matrix product for the whole batch
+    scores = queries @ matrix.T
+    results = []
+    for row in scores:
+        candidates = np.flatnonzero(row >= cutoff) if cutoff is not None else np.arange(row.shape[0])
+        kk = min(k, candidates.shape[0])
+        if kk == 0:
+            results.append((np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)))
+            continue
+        candidate_scores = row[candidates]
+        # partial selection is O(n), only the k winners are sorted
+        top = np.argpartition(-candidate_scores, kk - 1)[:kk]
+        top = top[np.argsort(-candidate_scores[top])]
+        results.append((candidates[top], candidate_scores[top]))
+    return results
+
+
+def top_k_similarities(matrix: np.ndarray, query: np.ndarray, k: int, cutoff: float | None = None):
+    return top_k_similarities_batch(matrix, query.reshape(1, -1), k, cutoff)[0]
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32)
+
+
+def normalize_query(embedding) -> np.ndarray:
+    vec = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+
+class EmbeddingMatrix:
+    """All embeddings of one index as a normalized float32 matrix, plus row -> node lookup."""
+    def __init__(self, ids: List[str], matrix: np.ndarray, get_node: Callable[[int], BaseNode]):
+        self.ids = ids
+        self.matrix = matrix
+        self.get_node = get_node
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_index(cls, index: VectorStoreIndex) -> "EmbeddingMatrix":
+        from mmap_vector_store import MmapVectorStore  # imports this module
+
+        store = index.vector_store
+        if isinstance(store, MmapVectorStore):
+            # already normalized and memory-mapped, no copy
+            return cls(store.ids, store.embeddings, store.get_node)
+
+        # simple vector store: one contiguous copy of the embedding dict
+        embedding_dict = store.data.embedding_dict
+        ids = list(embedding_dict.keys())
+        matrix = normalize_rows(np.asarray([embedding_dict[i] for i in ids], dtype=np.float32))
+        docstore = index.docstore
+        return cls(ids, matrix, lambda row: docstore.get_node(ids[row]))
+
+
+_matrices = weakref.WeakKeyDictionary()
+_matrices_lock = threading.Lock()
+
+
+def get_embedding_matrix(index: VectorStoreIndex) -> EmbeddingMatrix:
+    """Build the embedding matrix of an index once and share it between its query engines."""
+    with _matrices_lock:
+        matrix = _matrices.get(index)
+        if matrix is None:
+            matrix = EmbeddingMatrix.from_index(index)
+            _matrices[index] = matrix
+            logging.info(f"Embedding matrix built: {len(matrix)} nodes")
+        return matrix
+
+
+class NumpyVectorRetriever(BaseRetriever):
+    """Top-k retriever doing one matrix-vector product per query."""
+    def __init__(
+        self,
+        embedding_matrix: EmbeddingMatrix,
+        similarity_top_k: int = 10,
+        similarity_cutoff: float | None = None,
+        embed_model: BaseEmbedding | None = None,
+        **kwargs
+    ):
+        super().__init__(**kwargs)
+        self.embedding_matrix = embedding_matrix
+        self.similarity_top_k = similarity_top_k
+        self.similarity_cutoff = similarity_cutoff
+        self.embed_model = embed_model or Settings.embed_model
+
+    def _search(self, embedding) -> List[NodeWithScore]:
+        rows, scores = top_k_similarities(
+            self.embedding_matrix.matrix,
+            normalize_query(embedding),
+            self.similarity_top_k,
+            self.similarity_cutoff,
+        )
+        return [
+            NodeWithScore(node=self.embedding_matrix.get_node(int(row)), score=float(score))
+            for row, score in zip(rows, scores)
+        ]
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        embedding = query_bundle.embedding
+        if embedding is None:
+            embedding = self.embed_model.get_query_embedding(query_bundle.query_str)
+        return self._search(embedding)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        embedding = query_bundle.embedding
+        if embedding is None:
+            embedding = await self.embed_model.aget_query_embedding(query_bundle.query_str)
+        return self._search(embedding)